@@ -0,0 +1,7 @@
+-- Добавление идентификатора OpenStreetMap в таблицу мест.
+-- Нужна базам, созданным по db/schema.sql до появления столбца osm_id:
+-- скрипты сбора мест (insert_places.sql, delta_places.sql, pg_loader.py)
+-- записывают osm_id и обновляют места по нему (ON CONFLICT (osm_id)).
+-- Миграцию можно выполнять повторно.
+ALTER TABLE places ADD COLUMN IF NOT EXISTS osm_id TEXT; -- идентификатор объекта OpenStreetMap, например node/123
+CREATE UNIQUE INDEX IF NOT EXISTS places_osm_id_key ON places (osm_id);
@@ -23,6 +23,7 @@ CREATE TRIGGER on_user_created
 -- Создание таблицы мест (достопримечательностей, кафе и т.д.)
 CREATE TABLE places (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  osm_id TEXT UNIQUE, -- идентификатор объекта OpenStreetMap, например node/123
   name TEXT NOT NULL,
   description TEXT,
   type TEXT NOT NULL CHECK (type IN ('attraction', 'cafe', 'restaurant', 'shop', 'park', 'exhibition')),
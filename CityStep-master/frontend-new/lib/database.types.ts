@@ -12,6 +12,7 @@ export interface Database {
       places: {
         Row: {
           id: string
+          osm_id: string | null
           name: string
           description: string | null
           type: 'attraction' | 'cafe' | 'restaurant' | 'shop' | 'park' | 'exhibition'
@@ -23,6 +24,7 @@ export interface Database {
         }
         Insert: {
           id?: string
+          osm_id?: string | null
           name: string
           description?: string | null
           type: 'attraction' | 'cafe' | 'restaurant' | 'shop' | 'park' | 'exhibition'
@@ -34,6 +36,7 @@ export interface Database {
         }
         Update: {
           id?: string
+          osm_id?: string | null
           name?: string
           description?: string | null
           type?: 'attraction' | 'cafe' | 'restaurant' | 'shop' | 'park' | 'exhibition'
@@ -1,40 +1,95 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
+import argparse
 import os
-import matplotlib.pyplot as plt
+from typing import List, Optional
+
 import numpy as np
-from collections import Counter
-from typing import List, Dict, Any
+
+from chart_runner import CHART_WORKERS, ChartRunner, pyplot
+from map_render import MAP_MODES, use_hexbin, scatter_by_type, declutter_labels, draw_labels, draw_density
+from metrics import metrics
+from place_store import PlaceStore, open_place_store
 
 # Константы
 DATA_DIR = "data"
 INPUT_FILE = os.path.join(DATA_DIR, "moscow_beautiful_places.json")
 OUTPUT_DIR = os.path.join(DATA_DIR, "beauty_analysis")
+CITY_TITLE = "Москвы"  # в родительном падеже, для заголовков диаграмм и отчета
 
-def load_places() -> List[Dict[str, Any]]:
-    """Загружает данные о местах из JSON-файла"""
-    if not os.path.exists(INPUT_FILE):
-        raise FileNotFoundError(f"Файл {INPUT_FILE} не найден")
-    
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+# Числовые факторы мест (первый - оценка красоты, с ним сравниваются остальные)
+FACTORS = ["beauty_score", "popularity", "historical_value", "architectural_value"]
+FACTOR_NAMES = {
+    "beauty_score": "Оценка красоты",
+    "popularity": "Популярность",
+    "historical_value": "Историческая ценность",
+    "architectural_value": "Архитектурная ценность"
+}
+SEASONS = ['весна', 'лето', 'осень', 'зима']
 
-def analyze_beauty_scores(places: List[Dict[str, Any]]) -> None:
-    """Анализирует оценки красоты мест и создает диаграмму"""
-    # Сортируем места по оценке красоты
-    sorted_places = sorted(places, key=lambda x: x["beauty_score"], reverse=True)
-    
-    # Берем топ-10 мест
-    top_places = sorted_places[:10]
-    
-    # Создаем диаграмму
+def load_places(input_file: str = INPUT_FILE) -> PlaceStore:
+    """Открывает столбцовое хранилище мест (при необходимости создает его из JSON-файла)"""
+    return open_place_store(input_file)
+
+class BeautyStats:
+    """Статистика по красивым местам, посчитанная за один проход по столбцам.
+    
+    Диаграммы и отчет берут готовые значения отсюда и ничего не пересчитывают:
+    - order - номера мест по убыванию оценки красоты;
+    - type_names, type_counts, type_means - количество мест и средние
+      всех факторов по типам;
+    - type_order - номера типов по убыванию средней оценки красоты;
+    - factors, corr - факторы и полная матрица корреляций между ними;
+    - season_names, season_counts, season_order - гистограмма сезонов
+      (пустая, если у мест нет поля best_time).
+    При равных значениях сохраняется исходный порядок мест.
+    """
+    
+    def __init__(self, places: PlaceStore):
+        self.factors = [name for name in FACTORS if name in places]
+        values = np.column_stack([np.asarray(places[name], dtype=np.float64) for name in self.factors])
+        beauty = values[:, 0]
+        
+        self.order = np.argsort(-beauty, kind="stable")
+        
+        # Агрегаты по типам: суммы всех факторов через bincount
+        codes = np.asarray(places["type"])
+        self.type_names = places.labels("type")
+        type_count = len(self.type_names)
+        self.type_counts = np.bincount(codes, minlength=type_count)
+        sums = np.column_stack([np.bincount(codes, weights=column, minlength=type_count) for column in values.T])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.type_means = sums / self.type_counts[:, None]
+        present = np.flatnonzero(self.type_counts)
+        self.type_order = present[np.argsort(-self.type_means[present, 0], kind="stable")]
+        
+        # Полная матрица корреляций между факторами
+        self.corr = np.atleast_2d(np.corrcoef(values, rowvar=False))
+        
+        # Гистограмма сезонов по битовым маскам (у мест, оцененных сборщиком, сезонов нет)
+        self.season_names = places.labels("best_time") if "best_time" in places else []
+        self.season_counts = np.zeros(0, dtype=np.int64)
+        if self.season_names:
+            bits = (np.asarray(places["best_time"])[:, None] >> np.arange(len(self.season_names))) & 1
+            self.season_counts = bits.sum(axis=0)
+        present = np.flatnonzero(self.season_counts)
+        self.season_order = present[np.argsort(-self.season_counts[present], kind="stable")]
+    
+    def beauty_correlations(self) -> list:
+        """Возвращает (фактор, корреляция с оценкой красоты) для остальных факторов"""
+        return [(name, self.corr[0, i]) for i, name in enumerate(self.factors) if i > 0]
+    
+    def season_count(self, season: str) -> int:
+        if season not in self.season_names:
+            return 0
+        return int(self.season_counts[self.season_names.index(season)])
+
+def plot_beauty_scores(names: List[str], scores: List[float], output_dir: str, title: str) -> None:
+    """Рисует диаграмму самых красивых мест"""
+    plt = pyplot()
     plt.figure(figsize=(12, 8))
     
-    names = [place["name"] for place in top_places]
-    scores = [place["beauty_score"] for place in top_places]
-    
     # Создаем горизонтальную столбчатую диаграмму
     bars = plt.barh(names, scores, color='skyblue')
     
@@ -45,41 +100,35 @@ def analyze_beauty_scores(places: List[Dict[str, Any]]) -> None:
                  ha='left', va='center', fontweight='bold')
     
     plt.xlabel('Оценка красоты (0-10)')
-    plt.title('Топ-10 самых красивых мест Москвы')
+    plt.title(f'Топ-10 самых красивых мест {title}')
     plt.xlim(0, 11)  # Устанавливаем диапазон оси X
     plt.grid(axis='x', linestyle='--', alpha=0.7)
     plt.tight_layout()
     
     # Сохраняем диаграмму
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "top_beautiful_places.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "top_beautiful_places.png"))
     plt.close()
+
+def analyze_beauty_scores(places: PlaceStore, stats: BeautyStats, charts: ChartRunner,
+                          output_dir: str = OUTPUT_DIR, title: str = CITY_TITLE) -> None:
+    """Анализирует оценки красоты мест и создает диаграмму"""
+    # Берем топ-10 мест по оценке красоты
+    top_places = [places.record(i) for i in stats.order[:10]]
+    
+    # Создаем диаграмму
+    charts.submit(plot_beauty_scores, [place["name"] for place in top_places],
+                  [place["beauty_score"] for place in top_places], output_dir, title)
     
-    print("Топ-10 самых красивых мест Москвы:")
+    print(f"Топ-10 самых красивых мест {title}:")
     for i, place in enumerate(top_places, 1):
         print(f"{i}. {place['name']} - {place['beauty_score']}")
 
-def analyze_beauty_by_type(places: List[Dict[str, Any]]) -> None:
-    """Анализирует красоту мест по типам и создает диаграмму"""
-    # Группируем места по типам
-    types = {}
-    for place in places:
-        place_type = place["type"]
-        if place_type not in types:
-            types[place_type] = []
-        types[place_type].append(place["beauty_score"])
-    
-    # Вычисляем средние оценки по типам
-    avg_scores = {t: sum(scores)/len(scores) for t, scores in types.items()}
-    
-    # Создаем диаграмму
+def plot_beauty_by_type(type_names: List[str], type_scores: np.ndarray, output_dir: str) -> None:
+    """Рисует диаграмму средней оценки красоты по типам мест"""
+    plt = pyplot()
     plt.figure(figsize=(10, 6))
     
-    # Сортируем типы по средней оценке
-    sorted_types = sorted(avg_scores.items(), key=lambda x: x[1], reverse=True)
-    type_names = [t[0] for t in sorted_types]
-    type_scores = [t[1] for t in sorted_types]
-    
     # Создаем столбчатую диаграмму
     bars = plt.bar(type_names, type_scores, color='lightgreen')
     
@@ -96,35 +145,33 @@ def analyze_beauty_by_type(places: List[Dict[str, Any]]) -> None:
     plt.tight_layout()
     
     # Сохраняем диаграмму
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "beauty_by_type.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "beauty_by_type.png"))
     plt.close()
+
+def analyze_beauty_by_type(stats: BeautyStats, charts: ChartRunner, output_dir: str = OUTPUT_DIR) -> None:
+    """Создает диаграмму средней оценки красоты по типам мест"""
+    # Типы уже отсортированы по средней оценке
+    type_names = [stats.type_names[i] for i in stats.type_order]
+    type_scores = stats.type_means[stats.type_order, 0]
+    
+    # Создаем диаграмму
+    charts.submit(plot_beauty_by_type, type_names, type_scores, output_dir)
     
     print("\nСредняя оценка красоты по типам мест:")
-    for t, score in sorted_types:
+    for t, score in zip(type_names, type_scores):
         print(f"{t}: {score:.2f}")
 
-def analyze_beauty_factors(places: List[Dict[str, Any]]) -> None:
-    """Анализирует факторы, влияющие на красоту мест"""
-    # Вычисляем корреляцию между оценкой красоты и другими факторами
-    beauty_scores = [place["beauty_score"] for place in places]
-    popularity_scores = [place["popularity"] for place in places]
-    historical_scores = [place["historical_value"] for place in places]
-    architectural_scores = [place["architectural_value"] for place in places]
-    
-    # Вычисляем корреляцию
-    corr_popularity = np.corrcoef(beauty_scores, popularity_scores)[0, 1]
-    corr_historical = np.corrcoef(beauty_scores, historical_scores)[0, 1]
-    corr_architectural = np.corrcoef(beauty_scores, architectural_scores)[0, 1]
-    
-    # Создаем диаграмму
+def plot_beauty_factors(correlations: list, output_dir: str) -> None:
+    """Рисует диаграмму корреляции оценки красоты с другими факторами"""
+    plt = pyplot()
     plt.figure(figsize=(10, 6))
     
-    factors = ['Популярность', 'Историческая ценность', 'Архитектурная ценность']
-    correlations = [corr_popularity, corr_historical, corr_architectural]
+    factors = [FACTOR_NAMES[name] for name, _ in correlations]
+    values = [corr for _, corr in correlations]
     
     # Создаем столбчатую диаграмму
-    bars = plt.bar(factors, correlations, color=['gold', 'lightcoral', 'mediumaquamarine'])
+    bars = plt.bar(factors, values, color=['gold', 'lightcoral', 'mediumaquamarine'])
     
     # Добавляем значения на столбцы
     for bar in bars:
@@ -139,31 +186,28 @@ def analyze_beauty_factors(places: List[Dict[str, Any]]) -> None:
     plt.tight_layout()
     
     # Сохраняем диаграмму
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "beauty_factors.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "beauty_factors.png"))
     plt.close()
-    
-    print("\nКорреляция между оценкой красоты и другими факторами:")
-    print(f"Популярность: {corr_popularity:.2f}")
-    print(f"Историческая ценность: {corr_historical:.2f}")
-    print(f"Архитектурная ценность: {corr_architectural:.2f}")
 
-def analyze_best_seasons(places: List[Dict[str, Any]]) -> None:
-    """Анализирует лучшие сезоны для посещения красивых мест"""
-    # Подсчитываем количество мест для каждого сезона
-    seasons_count = Counter()
-    for place in places:
-        for season in place["best_time"]:
-            seasons_count[season] += 1
+def analyze_beauty_factors(stats: BeautyStats, charts: ChartRunner, output_dir: str = OUTPUT_DIR) -> None:
+    """Создает диаграмму корреляции оценки красоты с другими факторами"""
+    correlations = stats.beauty_correlations()
     
     # Создаем диаграмму
-    plt.figure(figsize=(10, 6))
+    charts.submit(plot_beauty_factors, correlations, output_dir)
     
-    seasons = ['весна', 'лето', 'осень', 'зима']
-    counts = [seasons_count[season] for season in seasons]
+    print("\nКорреляция между оценкой красоты и другими факторами:")
+    for name, corr in correlations:
+        print(f"{FACTOR_NAMES[name]}: {corr:.2f}")
+
+def plot_best_seasons(counts: List[int], output_dir: str, title: str) -> None:
+    """Рисует диаграмму лучших сезонов для посещения красивых мест"""
+    plt = pyplot()
+    plt.figure(figsize=(10, 6))
     
     # Создаем столбчатую диаграмму
-    bars = plt.bar(seasons, counts, color=['lightgreen', 'gold', 'orange', 'lightblue'])
+    bars = plt.bar(SEASONS, counts, color=['lightgreen', 'gold', 'orange', 'lightblue'])
     
     # Добавляем значения на столбцы
     for bar in bars:
@@ -172,27 +216,37 @@ def analyze_best_seasons(places: List[Dict[str, Any]]) -> None:
                  ha='center', va='bottom', fontweight='bold')
     
     plt.ylabel('Количество мест')
-    plt.title('Лучшие сезоны для посещения красивых мест Москвы')
+    plt.title(f'Лучшие сезоны для посещения красивых мест {title}')
     plt.grid(axis='y', linestyle='--', alpha=0.7)
     plt.tight_layout()
     
     # Сохраняем диаграмму
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "best_seasons.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "best_seasons.png"))
     plt.close()
+
+def analyze_best_seasons(stats: BeautyStats, charts: ChartRunner, output_dir: str = OUTPUT_DIR,
+                         title: str = CITY_TITLE) -> None:
+    """Создает диаграмму лучших сезонов для посещения красивых мест"""
+    if not stats.season_names:
+        print("\nУ мест нет данных о лучших сезонах для посещения")
+        return
     
-    print("\nЛучшие сезоны для посещения красивых мест Москвы:")
-    for season, count in seasons_count.most_common():
-        print(f"{season}: {count} мест")
+    # Создаем диаграмму
+    charts.submit(plot_best_seasons, [stats.season_count(season) for season in SEASONS], output_dir, title)
+    
+    print(f"\nЛучшие сезоны для посещения красивых мест {title}:")
+    for i in stats.season_order:
+        print(f"{stats.season_names[i]}: {stats.season_counts[i]} мест")
 
-def create_beauty_map(places: List[Dict[str, Any]]) -> None:
-    """Создает карту красивых мест с учетом их оценки красоты"""
+def plot_beauty_map(places: PlaceStore, output_dir: str, title: str, map_mode: str = "auto") -> None:
+    """Рисует карту красивых мест с учетом их оценки красоты"""
+    plt = pyplot()
+    
     # Извлекаем координаты и оценки
-    latitudes = [place["latitude"] for place in places]
-    longitudes = [place["longitude"] for place in places]
-    beauty_scores = [place["beauty_score"] for place in places]
-    names = [place["name"] for place in places]
-    types = [place["type"] for place in places]
+    latitudes = places["latitude"]
+    longitudes = places["longitude"]
+    beauty_scores = places["beauty_score"]
     
     # Создаем словарь цветов для типов мест
     type_colors = {
@@ -204,44 +258,50 @@ def create_beauty_map(places: List[Dict[str, Any]]) -> None:
     # Создаем карту
     plt.figure(figsize=(12, 10))
     
-    # Добавляем точки для каждого места с размером, зависящим от оценки красоты
-    for lat, lon, score, name, place_type in zip(latitudes, longitudes, beauty_scores, names, types):
-        color = type_colors.get(place_type, "gray")
-        size = score * 20  # Размер маркера зависит от оценки красоты
-        plt.scatter(lon, lat, c=color, alpha=0.7, s=size, label=place_type if place_type not in plt.gca().get_legend_handles_labels()[1] else "")
-        plt.text(lon, lat, name, fontsize=8, ha='right')
-    
-    # Добавляем легенду (только уникальные типы)
-    handles, labels = plt.gca().get_legend_handles_labels()
-    by_label = dict(zip(labels, handles))
-    plt.legend(by_label.values(), by_label.keys())
+    if use_hexbin(map_mode, len(places)):
+        # Для большого количества мест рисуем среднюю оценку красоты по ячейкам
+        draw_density(plt.gca(), longitudes, latitudes, beauty_scores, label="Средняя оценка красоты")
+    else:
+        # Один вызов scatter на тип, размер маркера зависит от оценки красоты
+        scatter_by_type(plt.gca(), longitudes, latitudes, places["type"], places.labels("type"), type_colors,
+                        sizes=beauty_scores * 20)
+        plt.legend()
+        
+        # Подписываем самые красивые места, пропуская те, что наложились бы на уже подписанные
+        names = places["name"]
+        labelled = declutter_labels(longitudes, latitudes, beauty_scores, names)
+        draw_labels(plt.gca(), longitudes, latitudes, names, labelled)
     
-    plt.title('Карта красивых мест Москвы')
+    plt.title(f'Карта красивых мест {title}')
     plt.xlabel('Долгота')
     plt.ylabel('Широта')
     plt.grid(True, linestyle="--", alpha=0.7)
     plt.tight_layout()
     
     # Сохраняем карту
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "beauty_map.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "beauty_map.png"))
     plt.close()
+
+def create_beauty_map(places: PlaceStore, charts: ChartRunner, map_mode: str = "auto",
+                      output_dir: str = OUTPUT_DIR, title: str = CITY_TITLE) -> None:
+    """Создает карту красивых мест с учетом их оценки красоты"""
+    charts.submit(plot_beauty_map, places, output_dir, title, map_mode)
     
-    print("\nКарта красивых мест Москвы сохранена в файл beauty_map.png")
+    if charts.enabled:
+        print(f"\nКарта красивых мест {title} сохранена в файл beauty_map.png")
 
-def generate_beauty_report(places: List[Dict[str, Any]]) -> None:
+def generate_beauty_report(places: PlaceStore, stats: BeautyStats, output_dir: str = OUTPUT_DIR,
+                           title: str = CITY_TITLE) -> None:
     """Генерирует отчет о наиболее красивых местах"""
-    report_file = os.path.join(OUTPUT_DIR, "beauty_report.md")
-    
-    # Сортируем места по оценке красоты
-    sorted_places = sorted(places, key=lambda x: x["beauty_score"], reverse=True)
+    report_file = os.path.join(output_dir, "beauty_report.md")
     
     with open(report_file, "w", encoding="utf-8") as f:
-        f.write("# Отчет о наиболее красивых местах Москвы\n\n")
+        f.write(f"# Отчет о наиболее красивых местах {title}\n\n")
         
         f.write("## Топ-20 самых красивых мест\n\n")
         
-        for i, place in enumerate(sorted_places, 1):
+        for i, place in enumerate(map(places.record, stats.order), 1):
             f.write(f"### {i}. {place['name']} - {place['beauty_score']}/10\n\n")
             f.write(f"- **Тип:** {place['type']}\n")
             f.write(f"- **Описание:** {place['description']}\n")
@@ -249,93 +309,104 @@ def generate_beauty_report(places: List[Dict[str, Any]]) -> None:
             f.write(f"- **Популярность:** {place['popularity']}/10\n")
             f.write(f"- **Историческая ценность:** {place['historical_value']}/10\n")
             f.write(f"- **Архитектурная ценность:** {place['architectural_value']}/10\n")
-            f.write(f"- **Лучшее время для посещения:** {', '.join(place['best_time'])}\n")
+            if "best_time" in place:
+                f.write(f"- **Лучшее время для посещения:** {', '.join(place['best_time'])}\n")
             f.write(f"- **Координаты:** {place['latitude']}, {place['longitude']}\n\n")
         
         # Добавляем выводы
         f.write("## Выводы\n\n")
         
-        # Группируем места по типам
-        types = {}
-        for place in places:
-            place_type = place["type"]
-            if place_type not in types:
-                types[place_type] = []
-            types[place_type].append(place["beauty_score"])
-        
-        # Вычисляем средние оценки по типам
-        avg_scores = {t: sum(scores)/len(scores) for t, scores in types.items()}
-        sorted_types = sorted(avg_scores.items(), key=lambda x: x[1], reverse=True)
-        
         f.write("### Средняя оценка красоты по типам мест\n\n")
-        for t, score in sorted_types:
-            f.write(f"- **{t}:** {score:.2f}/10\n")
-        
-        # Вычисляем корреляцию между оценкой красоты и другими факторами
-        beauty_scores = [place["beauty_score"] for place in places]
-        popularity_scores = [place["popularity"] for place in places]
-        historical_scores = [place["historical_value"] for place in places]
-        architectural_scores = [place["architectural_value"] for place in places]
-        
-        corr_popularity = np.corrcoef(beauty_scores, popularity_scores)[0, 1]
-        corr_historical = np.corrcoef(beauty_scores, historical_scores)[0, 1]
-        corr_architectural = np.corrcoef(beauty_scores, architectural_scores)[0, 1]
+        for i in stats.type_order:
+            f.write(f"- **{stats.type_names[i]}:** {stats.type_means[i, 0]:.2f}/10\n")
         
         f.write("\n### Корреляция между оценкой красоты и другими факторами\n\n")
-        f.write(f"- **Популярность:** {corr_popularity:.2f}\n")
-        f.write(f"- **Историческая ценность:** {corr_historical:.2f}\n")
-        f.write(f"- **Архитектурная ценность:** {corr_architectural:.2f}\n")
+        for name, corr in stats.beauty_correlations():
+            f.write(f"- **{FACTOR_NAMES[name]}:** {corr:.2f}\n")
         
-        # Подсчитываем количество мест для каждого сезона
-        seasons_count = Counter()
-        for place in places:
-            for season in place["best_time"]:
-                seasons_count[season] += 1
-        
-        f.write("\n### Лучшие сезоны для посещения красивых мест\n\n")
-        for season, count in seasons_count.most_common():
-            f.write(f"- **{season}:** {count} мест\n")
+        if stats.season_names:
+            f.write("\n### Лучшие сезоны для посещения красивых мест\n\n")
+            for i in stats.season_order:
+                f.write(f"- **{stats.season_names[i]}:** {stats.season_counts[i]} мест\n")
     
     print(f"\nОтчет сохранен в файл {report_file}")
 
-def main():
-    try:
-        # Загружаем данные о местах
-        print("Загрузка данных о красивых местах Москвы...")
-        places = load_places()
-        print(f"Загружено {len(places)} мест")
-        
-        # Создаем директорию для результатов анализа
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбирает параметры анализа (по умолчанию - из командной строки)"""
+    parser = argparse.ArgumentParser(description="Анализ красивых мест Москвы")
+    parser.add_argument("--input", default=INPUT_FILE,
+                        help="JSON-файл мест с оценками (рядом с ним создается хранилище)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="директория диаграмм и отчета")
+    parser.add_argument("--city-title", default=CITY_TITLE,
+                        help="название города в заголовках, в родительном падеже (например, Казани)")
+    parser.add_argument("--map-mode", choices=MAP_MODES, default="auto",
+                        help="карта: точки по типам (scatter), плотность (hexbin) или выбор по количеству мест (auto)")
+    parser.add_argument("--report-only", action="store_true",
+                        help="только текстовый отчет, без диаграмм и карт")
+    parser.add_argument("--chart-workers", type=int, default=CHART_WORKERS,
+                        help="количество процессов для построения диаграмм (1 - в текущем процессе)")
+    parser.add_argument("--metrics", help="JSON-файл для сводки метрик запуска (время и память по стадиям)")
+    parser.add_argument("--prometheus", help="файл для метрик запуска в текстовом формате Prometheus")
+    return parser.parse_args(argv)
+
+def run(args: argparse.Namespace) -> None:
+    """Выполняет анализ с заданными параметрами; ошибки выбрасываются дальше"""
+    # Загружаем данные о местах
+    print(f"Загрузка данных о красивых местах {args.city_title}...")
+    with metrics.stage("load_places") as stage:
+        places = load_places(args.input)
+        stage["elements"] = len(places)
+    print(f"Загружено {len(places)} мест")
+    
+    # Считаем всю статистику за один проход
+    with metrics.stage("beauty_stats"):
+        stats = BeautyStats(places)
+    
+    # Создаем директорию для результатов анализа
+    os.makedirs(args.output_dir, exist_ok=True)
+    
+    # Диаграммы строятся в пуле процессов, пока здесь готовится текстовый анализ
+    with ChartRunner(args.chart_workers, enabled=not args.report_only) as charts:
         # Анализируем оценки красоты
         print("\nАнализ оценок красоты...")
-        analyze_beauty_scores(places)
+        with metrics.stage("analyze_beauty_scores"):
+            analyze_beauty_scores(places, stats, charts, args.output_dir, args.city_title)
         
         # Анализируем красоту по типам мест
         print("\nАнализ красоты по типам мест...")
-        analyze_beauty_by_type(places)
+        with metrics.stage("analyze_beauty_by_type"):
+            analyze_beauty_by_type(stats, charts, args.output_dir)
         
         # Анализируем факторы, влияющие на красоту
         print("\nАнализ факторов, влияющих на красоту...")
-        analyze_beauty_factors(places)
+        with metrics.stage("analyze_beauty_factors"):
+            analyze_beauty_factors(stats, charts, args.output_dir)
         
         # Анализируем лучшие сезоны для посещения
         print("\nАнализ лучших сезонов для посещения...")
-        analyze_best_seasons(places)
+        with metrics.stage("analyze_best_seasons"):
+            analyze_best_seasons(stats, charts, args.output_dir, args.city_title)
         
         # Создаем карту красивых мест
         print("\nСоздание карты красивых мест...")
-        create_beauty_map(places)
+        with metrics.stage("create_beauty_map"):
+            create_beauty_map(places, charts, args.map_mode, args.output_dir, args.city_title)
         
         # Генерируем отчет
         print("\nГенерация отчета...")
-        generate_beauty_report(places)
-        
-        print("\nАнализ завершен. Результаты сохранены в директории", OUTPUT_DIR)
-        
+        with metrics.stage("generate_beauty_report"):
+            generate_beauty_report(places, stats, args.output_dir, args.city_title)
+    
+    print("\nАнализ завершен. Результаты сохранены в директории", args.output_dir)
+
+def main():
+    args = parse_args()
+    metrics.script = "analyze_beauty"
+    try:
+        run(args)
     except Exception as e:
         print(f"Ошибка: {e}")
+    metrics.save(args.metrics, args.prometheus)
 
 if __name__ == "__main__":
     main()
@@ -1,33 +1,36 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
+import argparse
 import os
-import matplotlib.pyplot as plt
-from collections import Counter
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from chart_runner import CHART_WORKERS, ChartRunner, pyplot
+from metrics import metrics
+from map_render import MAP_MODES, use_hexbin, scatter_by_type, draw_density
+from place_clusters import CLUSTER_RADIUS, MIN_CLUSTER_PLACES, find_clusters, save_clusters
+from place_store import PlaceStore, open_place_store
 
 # Константы
 DATA_DIR = "data"
 INPUT_FILE = os.path.join(DATA_DIR, "moscow_places.json")
 OUTPUT_DIR = os.path.join(DATA_DIR, "analysis")
+CITY_TITLE = "Москвы"  # в родительном падеже, для заголовков диаграмм и отчета
 
-def load_places() -> List[Dict[str, Any]]:
-    """Загружает данные о местах из JSON-файла"""
-    if not os.path.exists(INPUT_FILE):
-        raise FileNotFoundError(f"Файл {INPUT_FILE} не найден. Сначала запустите скрипт collect_moscow_places.py")
-    
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+def load_places(input_file: str = INPUT_FILE) -> PlaceStore:
+    """Открывает столбцовое хранилище мест (при необходимости создает его из JSON-файла)"""
+    try:
+        return open_place_store(input_file)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Файл {input_file} не найден. Сначала запустите скрипт collect_moscow_places.py")
 
-def analyze_place_types(places: List[Dict[str, Any]]) -> None:
-    """Анализирует типы мест и создает диаграмму"""
-    # Подсчитываем количество мест каждого типа
-    type_counter = Counter(place["type"] for place in places)
-    
-    # Создаем диаграмму
+def plot_place_types(type_names: List[str], counts: List[int], output_dir: str) -> None:
+    """Рисует диаграмму распределения мест по типам"""
+    plt = pyplot()
     plt.figure(figsize=(10, 6))
-    plt.bar(type_counter.keys(), type_counter.values())
+    plt.bar(type_names, counts)
     plt.title("Распределение мест по типам")
     plt.xlabel("Тип места")
     plt.ylabel("Количество")
@@ -35,47 +38,57 @@ def analyze_place_types(places: List[Dict[str, Any]]) -> None:
     plt.tight_layout()
     
     # Сохраняем диаграмму
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "place_types.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "place_types.png"))
     plt.close()
+
+def analyze_place_types(places: PlaceStore, charts: ChartRunner, output_dir: str = OUTPUT_DIR) -> None:
+    """Анализирует типы мест и создает диаграмму"""
+    # Подсчитываем количество мест каждого типа
+    type_counts = places.value_counts("type")
+    
+    # Создаем диаграмму (типы в порядке первого появления)
+    type_names = [t for t in places.labels("type") if t in dict(type_counts)]
+    charts.submit(plot_place_types, type_names, [dict(type_counts)[t] for t in type_names], output_dir)
     
     print("Распределение мест по типам:")
-    for type_name, count in type_counter.most_common():
+    for type_name, count in type_counts:
         print(f"  {type_name}: {count}")
 
-def analyze_visit_time(places: List[Dict[str, Any]]) -> None:
-    """Анализирует время посещения мест и создает диаграмму"""
-    # Группируем места по времени посещения
-    time_groups = {}
-    for place in places:
-        time = place["estimated_time"]
-        if time not in time_groups:
-            time_groups[time] = []
-        time_groups[time].append(place)
-    
-    # Создаем диаграмму
+def plot_visit_time(times: np.ndarray, counts: np.ndarray, output_dir: str) -> None:
+    """Рисует диаграмму распределения мест по времени посещения"""
+    plt = pyplot()
     plt.figure(figsize=(10, 6))
-    plt.bar(time_groups.keys(), [len(places) for places in time_groups.values()])
+    plt.bar(times, counts)
     plt.title("Распределение мест по времени посещения")
     plt.xlabel("Время посещения (минуты)")
     plt.ylabel("Количество мест")
     plt.tight_layout()
     
     # Сохраняем диаграмму
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "visit_time.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "visit_time.png"))
     plt.close()
+
+def analyze_visit_time(places: PlaceStore, charts: ChartRunner, output_dir: str = OUTPUT_DIR) -> None:
+    """Анализирует время посещения мест и создает диаграмму"""
+    # Группируем места по времени посещения
+    times, counts = np.unique(places["estimated_time"], return_counts=True)
+    
+    # Создаем диаграмму
+    charts.submit(plot_visit_time, times, counts, output_dir)
     
     print("\nРаспределение мест по времени посещения:")
-    for time, places_list in sorted(time_groups.items()):
-        print(f"  {time} минут: {len(places_list)} мест")
+    for time, count in zip(times, counts):
+        print(f"  {time} минут: {count} мест")
 
-def analyze_location_clusters(places: List[Dict[str, Any]]) -> None:
-    """Анализирует географическое распределение мест и создает карту"""
+def plot_location_map(places: PlaceStore, output_dir: str, title: str, map_mode: str = "auto") -> None:
+    """Рисует карту географического распределения мест"""
+    plt = pyplot()
+    
     # Извлекаем координаты
-    latitudes = [place["latitude"] for place in places]
-    longitudes = [place["longitude"] for place in places]
-    types = [place["type"] for place in places]
+    latitudes = places["latitude"]
+    longitudes = places["longitude"]
     
     # Создаем словарь цветов для типов мест
     type_colors = {
@@ -90,51 +103,86 @@ def analyze_location_clusters(places: List[Dict[str, Any]]) -> None:
     # Создаем карту
     plt.figure(figsize=(12, 10))
     
-    # Добавляем точки для каждого места с цветом по типу
-    for lat, lon, place_type in zip(latitudes, longitudes, types):
-        color = type_colors.get(place_type, "gray")
-        plt.scatter(lon, lat, c=color, alpha=0.7, s=30)
-    
-    # Добавляем легенду
-    for place_type, color in type_colors.items():
-        plt.scatter([], [], c=color, label=place_type)
+    if use_hexbin(map_mode, len(places)):
+        # Для большого количества мест рисуем плотность вместо отдельных точек
+        draw_density(plt.gca(), longitudes, latitudes)
+    else:
+        # Один вызов scatter на тип места
+        scatter_by_type(plt.gca(), longitudes, latitudes, places["type"], places.labels("type"), type_colors,
+                        labeled=False)
+        
+        # Легенда со всеми цветами типов мест
+        for place_type, color in type_colors.items():
+            plt.scatter([], [], c=color, label=place_type)
+        plt.legend()
     
-    plt.legend()
-    plt.title("Географическое распределение мест в Москве")
+    plt.title(f"Географическое распределение мест {title}")
     plt.xlabel("Долгота")
     plt.ylabel("Широта")
     plt.grid(True, linestyle="--", alpha=0.7)
     plt.tight_layout()
     
     # Сохраняем карту
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    plt.savefig(os.path.join(OUTPUT_DIR, "location_map.png"))
+    os.makedirs(output_dir, exist_ok=True)
+    plt.savefig(os.path.join(output_dir, "location_map.png"))
     plt.close()
+
+def analyze_location_clusters(places: PlaceStore, charts: ChartRunner, map_mode: str = "auto",
+                              radius: float = CLUSTER_RADIUS, min_places: int = MIN_CLUSTER_PLACES,
+                              output_dir: str = OUTPUT_DIR, title: str = CITY_TITLE) -> Dict[str, Any]:
+    """Анализирует географическое распределение мест: создает карту и делит места на районы"""
+    charts.submit(plot_location_map, places, output_dir, title, map_mode)
+    
+    # Делим места на пешеходные районы (DBSCAN по пространственному индексу)
+    clusters = find_clusters(places, eps=radius, min_samples=min_places)
+    # С --report-only создается только текстовый отчет
+    if charts.enabled:
+        save_clusters(clusters, os.path.join(output_dir, "clusters.json"))
     
-    print("\nГеографический анализ сохранен в файл location_map.png")
+    print(f"Найдено районов: {len(clusters['clusters'])}, мест вне районов: {clusters['noise']}")
+    for cluster in clusters["clusters"][:5]:
+        print(f"  Район {cluster['id']}: {cluster['count']} мест, радиус {cluster['radius']:.0f} м")
+    
+    if charts.enabled:
+        print("\nГеографический анализ сохранен в файл location_map.png")
+    return clusters
 
-def generate_report(places: List[Dict[str, Any]]) -> None:
+def generate_report(places: PlaceStore, clusters: Dict[str, Any], output_dir: str = OUTPUT_DIR,
+                    title: str = CITY_TITLE) -> None:
     """Генерирует текстовый отчет о местах"""
-    report_file = os.path.join(OUTPUT_DIR, "places_report.md")
+    report_file = os.path.join(output_dir, "places_report.md")
     
     with open(report_file, "w", encoding="utf-8") as f:
-        f.write("# Отчет о красивых местах Москвы\n\n")
+        f.write(f"# Отчет о красивых местах {title}\n\n")
         
         f.write(f"## Общая информация\n\n")
         f.write(f"Всего мест: {len(places)}\n\n")
         
         # Типы мест
-        type_counter = Counter(place["type"] for place in places)
         f.write("### Распределение по типам\n\n")
-        for type_name, count in type_counter.most_common():
+        for type_name, count in places.value_counts("type"):
             f.write(f"- {type_name}: {count}\n")
         
+        # Районы
+        f.write("\n### Районы\n\n")
+        f.write(f"Места в радиусе {clusters['eps']:.0f} м друг от друга объединены в районы "
+                f"(ядро района - не меньше {clusters['min_samples']} мест рядом). "
+                f"Районов: {len(clusters['clusters'])}, мест вне районов: {clusters['noise']}.\n")
+        if clusters["clusters"]:
+            f.write("\n| Район | Мест | Типы | Центр | Радиус |\n")
+            f.write("|-------|------|------|-------|--------|\n")
+            for cluster in clusters["clusters"]:
+                types = ", ".join(f"{name}: {count}" for name, count in cluster["types"].items())
+                latitude, longitude = cluster["centroid"]
+                f.write(f"| {cluster['id']} | {cluster['count']} | {types} | {latitude}, {longitude} | "
+                        f"{cluster['radius']:.0f} м |\n")
+        
         f.write("\n## Топ-10 мест по времени посещения\n\n")
         
-        # Сортируем места по времени посещения (по убыванию)
-        sorted_places = sorted(places, key=lambda x: x["estimated_time"], reverse=True)
+        # Сортируем места по времени посещения (по убыванию, при равном времени - в исходном порядке)
+        top_indexes = np.argsort(-places["estimated_time"], kind="stable")[:10]
         
-        for i, place in enumerate(sorted_places[:10], 1):
+        for i, place in enumerate(map(places.record, top_indexes), 1):
             f.write(f"### {i}. {place['name']}\n\n")
             f.write(f"- **Тип:** {place['type']}\n")
             f.write(f"- **Время посещения:** {place['estimated_time']} минут\n")
@@ -146,41 +194,80 @@ def generate_report(places: List[Dict[str, Any]]) -> None:
         f.write("| № | Название | Тип | Время посещения |\n")
         f.write("|---|---------|-----|----------------|\n")
         
-        for i, place in enumerate(sorted(places, key=lambda x: x["name"]), 1):
-            f.write(f"| {i} | {place['name']} | {place['type']} | {place['estimated_time']} мин. |\n")
+        names = places["name"].tolist()
+        types = places.decode("type")
+        times = places["estimated_time"]
+        for i, index in enumerate(sorted(range(len(places)), key=names.__getitem__), 1):
+            f.write(f"| {i} | {names[index]} | {types[index]} | {times[index]} мин. |\n")
     
     print(f"\nОтчет сохранен в файл {report_file}")
 
-def main():
-    try:
-        # Загружаем данные о местах
-        print("Загрузка данных о местах...")
-        places = load_places()
-        print(f"Загружено {len(places)} мест")
-        
-        # Создаем директорию для результатов анализа
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбирает параметры анализа (по умолчанию - из командной строки)"""
+    parser = argparse.ArgumentParser(description="Анализ собранных мест Москвы")
+    parser.add_argument("--input", default=INPUT_FILE, help="JSON-файл мест (рядом с ним создается хранилище)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="директория диаграмм и отчета")
+    parser.add_argument("--city-title", default=CITY_TITLE,
+                        help="название города в заголовках, в родительном падеже (например, Казани)")
+    parser.add_argument("--map-mode", choices=MAP_MODES, default="auto",
+                        help="карта: точки по типам (scatter), плотность (hexbin) или выбор по количеству мест (auto)")
+    parser.add_argument("--cluster-radius", type=float, default=CLUSTER_RADIUS,
+                        help="радиус соседства мест при делении на районы, в метрах")
+    parser.add_argument("--cluster-min-places", type=int, default=MIN_CLUSTER_PLACES,
+                        help="минимальное количество мест рядом с ядром района")
+    parser.add_argument("--report-only", action="store_true",
+                        help="только текстовый отчет, без диаграмм и карт")
+    parser.add_argument("--chart-workers", type=int, default=CHART_WORKERS,
+                        help="количество процессов для построения диаграмм (1 - в текущем процессе)")
+    parser.add_argument("--metrics", help="JSON-файл для сводки метрик запуска (время и память по стадиям)")
+    parser.add_argument("--prometheus", help="файл для метрик запуска в текстовом формате Prometheus")
+    return parser.parse_args(argv)
+
+def run(args: argparse.Namespace) -> None:
+    """Выполняет анализ с заданными параметрами; ошибки выбрасываются дальше"""
+    # Загружаем данные о местах
+    print("Загрузка данных о местах...")
+    with metrics.stage("load_places") as stage:
+        places = load_places(args.input)
+        stage["elements"] = len(places)
+    print(f"Загружено {len(places)} мест")
+    
+    # Создаем директорию для результатов анализа
+    os.makedirs(args.output_dir, exist_ok=True)
+    
+    # Диаграммы строятся в пуле процессов, пока здесь готовится текстовый анализ
+    with ChartRunner(args.chart_workers, enabled=not args.report_only) as charts:
         # Анализируем типы мест
         print("\nАнализ типов мест...")
-        analyze_place_types(places)
+        with metrics.stage("analyze_place_types"):
+            analyze_place_types(places, charts, args.output_dir)
         
         # Анализируем время посещения
         print("\nАнализ времени посещения...")
-        analyze_visit_time(places)
+        with metrics.stage("analyze_visit_time"):
+            analyze_visit_time(places, charts, args.output_dir)
         
         # Анализируем географическое распределение
         print("\nАнализ географического распределения...")
-        analyze_location_clusters(places)
+        with metrics.stage("analyze_location_clusters"):
+            clusters = analyze_location_clusters(places, charts, args.map_mode, args.cluster_radius,
+                                                 args.cluster_min_places, args.output_dir, args.city_title)
         
         # Генерируем отчет
         print("\nГенерация отчета...")
-        generate_report(places)
-        
-        print("\nАнализ завершен. Результаты сохранены в директории", OUTPUT_DIR)
-        
+        with metrics.stage("generate_report"):
+            generate_report(places, clusters, args.output_dir, args.city_title)
+    
+    print("\nАнализ завершен. Результаты сохранены в директории", args.output_dir)
+
+def main():
+    args = parse_args()
+    metrics.script = "analyze_places"
+    try:
+        run(args)
     except Exception as e:
         print(f"Ошибка: {e}")
+    metrics.save(args.metrics, args.prometheus)
 
 if __name__ == "__main__":
     main()
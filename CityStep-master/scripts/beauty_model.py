@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+from datetime import date
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+import numpy as np
+
+from spatial_index import SpatialIndex
+
+# Константы
+DATA_DIR = "data"
+LABELLED_FILE = os.path.join(DATA_DIR, "moscow_beautiful_places.json")
+MODEL_FILE = os.path.join(DATA_DIR, "beauty_model.json")
+DENSITY_RADIUS = 500.0  # в метрах: соседи в этом радиусе дают признак плотности
+MATCH_DISTANCE = 200.0  # в метрах: насколько размеченное место может отстоять от объекта OSM
+MAX_AGE = 500  # в годах: старше этого возраст не учитывается
+RIDGE = 1.0  # регуляризация весов (свободный член не штрафуется)
+MAX_SCORE = 10.0
+
+# Признаки места и оценки, которые по ним предсказываются
+FEATURES = ["heritage", "wikipedia", "wikidata", "historic", "architect", "age", "tag_count", "density"]
+TARGETS = ["beauty_score", "popularity", "historical_value", "architectural_value"]
+
+# Веса по умолчанию, если обучить модель не на чем (нет сохраненной модели и ни одно
+# размеченное место не найдено среди собранных): оценки растут с охранным статусом,
+# историческими тегами, возрастом и известностью места
+DEFAULT_WEIGHTS = {
+    "beauty_score": {"heritage": 1.5, "wikipedia": 0.5, "wikidata": 0.3, "historic": 1.0, "architect": 1.0,
+                     "age": 0.5, "tag_count": 0.3, "density": 0.2, "intercept": 4.0},
+    "popularity": {"heritage": 0.5, "wikipedia": 1.5, "wikidata": 0.5, "historic": 0.5, "architect": 0.3,
+                   "age": 0.2, "tag_count": 0.5, "density": 0.5, "intercept": 3.0},
+    "historical_value": {"heritage": 2.0, "wikipedia": 0.5, "wikidata": 0.3, "historic": 2.0, "architect": 0.5,
+                         "age": 1.0, "tag_count": 0.2, "density": 0.0, "intercept": 2.0},
+    "architectural_value": {"heritage": 1.5, "wikipedia": 0.3, "wikidata": 0.2, "historic": 0.5, "architect": 2.0,
+                            "age": 0.5, "tag_count": 0.2, "density": 0.1, "intercept": 2.5}
+}
+
+# Год в start_date: "1890", "~1890", "1890s", "1890-05-12" или век: "C18"
+YEAR_PATTERN = re.compile(r"(\d{4})|C(\d{1,2})")
+
+# Функция для определения возраста постройки
+def building_age(start_date: str, year: int) -> float:
+    """Возвращает возраст по тегу start_date в сотнях лет (0, если дата не распознана)"""
+    match = YEAR_PATTERN.search(start_date)
+    if not match:
+        return 0.0
+    built = int(match.group(1)) if match.group(1) else int(match.group(2)) * 100 - 50
+    return min(max(year - built, 0), MAX_AGE) / 100
+
+# Функция для расчета признаков по тегам OSM
+def tag_features(tags: Dict[str, str], year: int) -> List[float]:
+    """Возвращает признаки места без плотности в порядке FEATURES"""
+    return [
+        float(any(key.startswith("heritage") for key in tags)),
+        float(any(key == "wikipedia" or key.startswith("wikipedia:") for key in tags)),
+        float("wikidata" in tags),
+        float("historic" in tags),
+        float("architect" in tags),
+        building_age(tags.get("start_date", ""), year),
+        float(np.log1p(len(tags)))
+    ]
+
+# Функция для расчета признаков всех мест
+def feature_matrix(places: List[Dict[str, Any]], radius: float = DENSITY_RADIUS,
+                   area: Optional[Tuple[Iterable[float], Iterable[float]]] = None) -> np.ndarray:
+    """Возвращает матрицу признаков (количество мест, len(FEATURES)).
+
+    Плотность - логарифм количества других мест в радиусе radius, соседи
+    всех мест находятся одним пакетным запросом к пространственному индексу.
+    Если places - только часть мест области (например, измененные при
+    инкрементальном сборе), в area передаются широты и долготы всех мест
+    области вместе с places, и соседи ищутся среди них.
+    """
+    year = date.today().year
+    matrix = np.zeros((len(places), len(FEATURES)))
+    if not places:
+        return matrix
+
+    matrix[:, :-1] = [tag_features(place.get("tags", {}), year) for place in places]
+    latitudes = np.array([place["latitude"] for place in places], dtype=np.float64)
+    longitudes = np.array([place["longitude"] for place in places], dtype=np.float64)
+    index = SpatialIndex(latitudes, longitudes) if area is None else SpatialIndex(*area)
+    neighbours = index.query_radius(latitudes, longitudes, radius)
+    matrix[:, -1] = np.log1p([len(found) - 1 for found in neighbours])
+    return matrix
+
+# Линейная модель оценок места
+class BeautyModel:
+    """Линейная модель: оценки места = [признаки, 1] @ weights.
+
+    weights - матрица (len(FEATURES) + 1, len(TARGETS)), последняя строка -
+    свободные члены. Все оценки обучаются одним решением задачи
+    наименьших квадратов.
+    """
+
+    def __init__(self, weights: np.ndarray, samples: int = 0):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, features: np.ndarray, targets: np.ndarray, ridge: float = RIDGE) -> "BeautyModel":
+        """Подбирает веса гребневой регрессией.
+
+        Регуляризация добавляется строками sqrt(ridge) * I к матрице
+        признаков, поэтому веса находятся одним вызовом lstsq даже когда
+        размеченных мест меньше, чем признаков.
+        """
+        count, width = features.shape
+        design = np.hstack([features, np.ones((count, 1))])
+        penalty = np.hstack([np.sqrt(ridge) * np.eye(width), np.zeros((width, 1))])
+        weights = np.linalg.lstsq(np.vstack([design, penalty]),
+                                  np.vstack([targets, np.zeros((width, targets.shape[1]))]), rcond=None)[0]
+        return cls(weights, count)
+
+    @classmethod
+    def from_weights(cls, weights: Dict[str, Dict[str, float]], samples: int = 0) -> "BeautyModel":
+        """Создает модель из весов в формате файла модели: {оценка: {признак или intercept: вес}}"""
+        return cls(np.array([[weights[target][name] for target in TARGETS] for name in FEATURES + ["intercept"]]),
+                   samples)
+
+    @classmethod
+    def default(cls) -> "BeautyModel":
+        """Возвращает модель с весами по умолчанию"""
+        return cls.from_weights(DEFAULT_WEIGHTS)
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Возвращает оценки (количество мест, len(TARGETS)) в диапазоне от 0 до 10"""
+        scores = features @ self.weights[:-1] + self.weights[-1]
+        return np.clip(scores, 0.0, MAX_SCORE)
+
+    def save(self, path: str) -> None:
+        """Сохраняет веса модели в JSON-файл"""
+        model = {
+            "features": FEATURES,
+            "targets": TARGETS,
+            "samples": self.samples,
+            "weights": {target: dict(zip(FEATURES + ["intercept"], np.round(self.weights[:, i], 6).tolist()))
+                        for i, target in enumerate(TARGETS)}
+        }
+        # Пишем во временный файл и переименовываем, чтобы параллельные сборщики
+        # не прочитали недописанную модель
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(model, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BeautyModel"]:
+        """Читает модель из файла или возвращает None, если признаки или оценки не совпадают с текущими"""
+        with open(path, "r", encoding="utf-8") as f:
+            model = json.load(f)
+        if model.get("features") != FEATURES or model.get("targets") != TARGETS:
+            return None
+        return cls.from_weights(model["weights"], model.get("samples", 0))
+
+# Функция для сопоставления размеченных мест с собранными
+def match_labelled(labelled: List[Dict[str, Any]], places: List[Dict[str, Any]],
+                   max_distance: float = MATCH_DISTANCE) -> np.ndarray:
+    """Для каждого размеченного места возвращает номер собранного места или -1.
+
+    Размеченные места не содержат тегов OSM, поэтому их признаки берутся у
+    собранного места рядом: с тем же названием, а если такого нет - у
+    ближайшего не дальше max_distance метров.
+    """
+    matches = np.full(len(labelled), -1, dtype=np.int64)
+    if not labelled or not places:
+        return matches
+
+    index = SpatialIndex([place["latitude"] for place in places], [place["longitude"] for place in places])
+    nearby = index.query_radius([item["latitude"] for item in labelled], [item["longitude"] for item in labelled],
+                                max_distance, sort=True)
+    for i, (item, found) in enumerate(zip(labelled, nearby)):
+        if not len(found):
+            continue
+        name = item["name"].casefold()
+        same_name = [j for j in found.tolist() if places[j]["name"].casefold() == name]
+        matches[i] = same_name[0] if same_name else found[0]
+    return matches
+
+# Функция для обучения модели по размеченным местам
+def fit_beauty_model(places: List[Dict[str, Any]], features: np.ndarray,
+                     labelled_file: str = LABELLED_FILE) -> BeautyModel:
+    """Обучает модель на размеченных вручную местах, найденных среди собранных"""
+    with open(labelled_file, "r", encoding="utf-8") as f:
+        labelled = json.load(f)
+
+    matches = match_labelled(labelled, places)
+    found = matches >= 0
+    if not found.any():
+        raise ValueError(f"ни одно место из {labelled_file} не найдено среди собранных мест")
+
+    targets = np.array([[item[target] for target in TARGETS] for item in labelled], dtype=np.float64)
+    return BeautyModel.fit(features[matches[found]], targets[found])
+
+# Функция для получения модели оценок
+def beauty_model_for(places: List[Dict[str, Any]], features: np.ndarray, model_file: str = MODEL_FILE,
+                     labelled_file: str = LABELLED_FILE, refit: bool = False) -> BeautyModel:
+    """Читает сохраненную модель, а если ее нет (или refit=True) - обучает и сохраняет.
+
+    Если обучить модель не на чем (например, для другого города без
+    сохраненной модели), возвращает модель с весами по умолчанию и не
+    сохраняет ее.
+    """
+    if not refit and os.path.exists(model_file):
+        model = BeautyModel.load(model_file)
+        if model is not None:
+            return model
+
+    try:
+        model = fit_beauty_model(places, features, labelled_file)
+    except (OSError, ValueError) as e:
+        print(f"Не удалось обучить модель оценок: {e}. Оценки посчитаны по тегам OSM с весами по умолчанию")
+        return BeautyModel.default()
+    os.makedirs(os.path.dirname(model_file) or ".", exist_ok=True)
+    model.save(model_file)
+    print(f"Модель оценок обучена на {model.samples} размеченных местах и сохранена в файл {model_file}")
+    return model
+
+# Функция для оценки мест
+def score_places(places: Iterable[Dict[str, Any]], model_file: str = MODEL_FILE,
+                 labelled_file: str = LABELLED_FILE, refit: bool = False,
+                 area: Optional[Tuple[Iterable[float], Iterable[float]]] = None) -> List[Dict[str, Any]]:
+    """Добавляет местам оценки TARGETS, посчитанные моделью, и возвращает список мест.
+
+    Плотность зависит от всех мест сразу, поэтому поток мест собирается в
+    список, а признаки и оценки считаются для всех мест за один проход
+    (area - координаты всех мест области, см. feature_matrix).
+    """
+    places = list(places)
+    if not places:
+        return places
+
+    features = feature_matrix(places, area=area)
+    scores = np.round(beauty_model_for(places, features, model_file, labelled_file, refit).predict(features), 1)
+    for place, row in zip(places, scores.tolist()):
+        place.update(zip(TARGETS, row))
+    return places
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+import numpy as np
+
+import analyze_beautiful_places as beauty
+import analyze_moscow_places as analysis
+import collect_moscow_places as collector
+from chart_runner import ChartRunner
+from json_stream import iter_records
+from place_store import PlaceStore, write_place_store
+from response_cache import ResponseCache
+from synthetic_data import write_overpass_response, write_places
+
+# Константы
+DATA_DIR = "data"
+BENCHMARK_DIR = os.path.join(DATA_DIR, "benchmarks")
+DEFAULT_SIZES = [100, 1000, 10000]
+REGRESSION_THRESHOLD = 1.2  # замедление больше чем на 20% считается регрессией
+BENCHMARK_BBOX = "(55.55,37.35,55.95,37.85)"
+
+# Одна категория со всеми тегами сборщика: под нее подходит любой синтетический элемент
+BENCHMARK_CATEGORY = {"name": "attraction", "tags": [tag for category in collector.PLACE_CATEGORIES
+                                                     for tag in category["tags"]]}
+
+# Функция для измерения времени и памяти
+def measure(function: Callable[[], Any], repeat: int = 1, memory: bool = True) -> Dict[str, Any]:
+    """Выполняет function repeat раз и возвращает лучшее и среднее время и пиковую память.
+
+    Время меряется без трассировки памяти, а пиковый объем выделенной
+    Python-памяти (включая массивы numpy) - отдельным запуском под tracemalloc,
+    который сам замедляет выполнение. Вывод функции подавляется.
+    """
+    seconds, cpu_seconds = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            started, cpu_started = time.perf_counter(), time.process_time()
+            function()
+            seconds.append(time.perf_counter() - started)
+            cpu_seconds.append(time.process_time() - cpu_started)
+
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                function()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    return {
+        "seconds": round(min(seconds), 6),
+        "mean_seconds": round(sum(seconds) / len(seconds), 6),
+        "cpu_seconds": round(min(cpu_seconds), 6),
+        "peak_bytes": peak,
+        "runs": repeat
+    }
+
+# Функция для подготовки тестов сбора
+def collection_benchmarks(workdir: str, size: int, seed: int) -> List[Tuple[str, Callable[[], Any]]]:
+    """Кладет синтетический ответ Overpass API в офлайн-кэш и возвращает тесты стадий сбора"""
+    cache = ResponseCache(os.path.join(workdir, "cache"), max_bytes=sys.maxsize, offline=True)
+    collector.response_cache = cache
+    query = collector.plan_queries([BENCHMARK_CATEGORY], BENCHMARK_BBOX)[0]
+    key = cache.make_key(collector.OVERPASS_API_URL, query)
+    tmp_path = cache.new_temp_path(key)
+    write_overpass_response(tmp_path, size, seed)
+    cache.put_file(key, tmp_path)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        places = collector.get_places_by_category(BENCHMARK_CATEGORY, BENCHMARK_BBOX)
+    output_file = os.path.join(workdir, "collected_places.json")
+    sql_file = os.path.join(workdir, "insert_places.sql")
+    return [
+        ("collect.get_places_by_category", lambda: collector.get_places_by_category(BENCHMARK_CATEGORY,
+                                                                                      BENCHMARK_BBOX)),
+        ("collect.process_and_save_places", lambda: collector.process_and_save_places(places, output_file)),
+        ("collect.generate_sql_script", lambda: collector.generate_sql_script(places, sql_file))
+    ]
+
+# Функция для подготовки тестов анализа мест
+def analysis_benchmarks(workdir: str, size: int, seed: int, charts: ChartRunner) -> List[Tuple[str, Callable[[], Any]]]:
+    """Создает синтетические места и возвращает тесты analyze_moscow_places.py"""
+    json_file = os.path.join(workdir, "moscow_places.json")
+    store_path = os.path.join(workdir, "moscow_places.store")
+    write_places(json_file, size, seed)
+    write_place_store(iter_records(json_file), store_path)
+    places = PlaceStore(store_path)
+
+    output_dir = os.path.join(workdir, "analysis")
+    os.makedirs(output_dir, exist_ok=True)
+    clusters: Dict[str, Any] = {}
+
+    def location_clusters():
+        clusters.update(analysis.analyze_location_clusters(places, charts, output_dir=output_dir))
+
+    return [
+        ("store.write_place_store", lambda: write_place_store(iter_records(json_file), store_path)),
+        ("analyze.analyze_place_types", lambda: analysis.analyze_place_types(places, charts, output_dir)),
+        ("analyze.analyze_visit_time", lambda: analysis.analyze_visit_time(places, charts, output_dir)),
+        ("analyze.analyze_location_clusters", location_clusters),
+        ("analyze.generate_report", lambda: analysis.generate_report(places, clusters, output_dir))
+    ]
+
+# Функция для подготовки тестов анализа красивых мест
+def beauty_benchmarks(workdir: str, size: int, seed: int, charts: ChartRunner) -> List[Tuple[str, Callable[[], Any]]]:
+    """Создает синтетические красивые места и возвращает тесты analyze_beautiful_places.py"""
+    json_file = os.path.join(workdir, "moscow_beautiful_places.json")
+    store_path = os.path.join(workdir, "moscow_beautiful_places.store")
+    write_places(json_file, size, seed, beautiful=True)
+    write_place_store(iter_records(json_file), store_path)
+    places = PlaceStore(store_path)
+    stats = beauty.BeautyStats(places)
+
+    output_dir = os.path.join(workdir, "beauty_analysis")
+    os.makedirs(output_dir, exist_ok=True)
+    return [
+        ("beauty.BeautyStats", lambda: beauty.BeautyStats(places)),
+        ("beauty.analyze_beauty_scores", lambda: beauty.analyze_beauty_scores(places, stats, charts, output_dir)),
+        ("beauty.analyze_beauty_by_type", lambda: beauty.analyze_beauty_by_type(stats, charts, output_dir)),
+        ("beauty.analyze_beauty_factors", lambda: beauty.analyze_beauty_factors(stats, charts, output_dir)),
+        ("beauty.analyze_best_seasons", lambda: beauty.analyze_best_seasons(stats, charts, output_dir)),
+        ("beauty.create_beauty_map", lambda: beauty.create_beauty_map(places, charts, output_dir=output_dir)),
+        ("beauty.generate_beauty_report", lambda: beauty.generate_beauty_report(places, stats, output_dir))
+    ]
+
+# Функция для описания окружения
+def environment() -> Dict[str, Any]:
+    """Возвращает версии Python и библиотек, платформу и текущий коммит"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit
+    }
+
+# Функция для поиска прошлого результата
+def latest_results(output_dir: str) -> Optional[str]:
+    """Возвращает путь к последнему сохраненному результату или None"""
+    files = sorted(glob.glob(os.path.join(output_dir, "benchmark_*.json")))
+    return files[-1] if files else None
+
+# Функция для сравнения с прошлым результатом
+def compare(results: List[Dict[str, Any]], previous: Dict[str, Any],
+            threshold: float = REGRESSION_THRESHOLD) -> List[Dict[str, Any]]:
+    """Добавляет к результатам отношение времени к прошлому запуску и возвращает регрессии"""
+    before = {(item["stage"], item["size"]): item["seconds"] for item in previous["results"]}
+    regressions = []
+    for item in results:
+        seconds = before.get((item["stage"], item["size"]))
+        if not seconds:
+            continue
+        item["ratio"] = round(item["seconds"] / seconds, 3)
+        if item["ratio"] > threshold:
+            regressions.append(item)
+    return regressions
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры тестов производительности"""
+    parser = argparse.ArgumentParser(description="Тесты производительности сбора и анализа на синтетических данных")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="размеры наборов данных (от 100 до 1000000 элементов)")
+    parser.add_argument("--stages", nargs="+", default=["collect", "store", "analyze", "beauty"],
+                        help="какие тесты запускать: префиксы названий, например collect или beauty.generate")
+    parser.add_argument("--repeat", type=int, default=3, help="сколько раз повторять каждый тест")
+    parser.add_argument("--seed", type=int, default=0, help="начальное значение генератора данных")
+    parser.add_argument("--no-memory", action="store_true", help="не измерять пиковую память")
+    parser.add_argument("--no-charts", action="store_true", help="не строить диаграммы в тестах анализа")
+    parser.add_argument("--output-dir", default=BENCHMARK_DIR, help="директория результатов")
+    parser.add_argument("--compare", help="файл результатов для сравнения (по умолчанию - последний в --output-dir)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="завершиться с ошибкой, если какой-либо тест замедлился больше чем на 20%%")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    previous_file = args.compare or latest_results(args.output_dir)
+    results: List[Dict[str, Any]] = []
+
+    print(f"{'Тест':<40} {'Размер':>8} {'Время, с':>10} {'Память, МБ':>11}")
+    # Диаграммы строятся в текущем процессе, чтобы их время вошло в измерение
+    charts = ChartRunner(1, enabled=not args.no_charts)
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix="citystep_benchmark_") as workdir:
+            benchmarks = []
+            if any(stage.startswith("collect") for stage in args.stages):
+                benchmarks += collection_benchmarks(workdir, size, args.seed)
+            if any(stage.startswith(("store", "analyze")) for stage in args.stages):
+                benchmarks += analysis_benchmarks(workdir, size, args.seed, charts)
+            if any(stage.startswith("beauty") for stage in args.stages):
+                benchmarks += beauty_benchmarks(workdir, size, args.seed, charts)
+
+            for stage, function in benchmarks:
+                if not stage.startswith(tuple(args.stages)):
+                    continue
+                result = dict(stage=stage, size=size, **measure(function, args.repeat, not args.no_memory))
+                results.append(result)
+                memory = f"{result['peak_bytes'] / 2 ** 20:11.1f}" if result["peak_bytes"] is not None else f"{'-':>11}"
+                print(f"{stage:<40} {size:>8} {result['seconds']:10.3f} {memory}")
+
+    regressions = []
+    if previous_file:
+        with open(previous_file, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f))
+        compared = [item for item in results if "ratio" in item]
+        if compared:
+            print(f"\nСравнение с {previous_file}:")
+        for item in compared:
+            mark = "  <- регрессия" if item in regressions else ""
+            print(f"{item['stage']:<40} {item['size']:>8} {item['ratio']:8.2f}x{mark}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    created = datetime.now()
+    output_file = os.path.join(args.output_dir, f"benchmark_{created:%Y%m%d_%H%M%S}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump({"created": created.isoformat(timespec="seconds"), "environment": environment(),
+                   "repeat": args.repeat, "seed": args.seed, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в файл {output_file}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+import analyze_beautiful_places as beauty
+import analyze_moscow_places as analysis
+import collect_moscow_places as collector
+from metrics import metrics
+
+# Константы
+CITIES_DIR = os.path.join("data", "cities")
+SUMMARY_FILE = "build_summary.json"
+LOG_FILE = "build.log"
+JOBS = min(4, os.cpu_count() or 1)
+
+# Параметры сборщика по умолчанию: полный набор мест и один поток на город,
+# чтобы одновременных запросов к Overpass было не больше, чем городов в работе
+COLLECT_DEFAULTS = ["--limit", "0", "--workers", "1"]
+
+# Общий ограничитель частоты запросов в рабочем процессе (задается init_worker)
+shared_limiter: Optional[collector.RateLimiter] = None
+
+# Функция для чтения списка городов
+def read_cities(cities: Optional[List[str]], cities_file: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+    """Возвращает пары (город, директория результатов или None) из параметров и файла.
+
+    Запись вида "Казань, Россия=data/kazan" задает директорию города явно.
+    В файле - по одному городу на строку, пустые строки и строки с # пропускаются.
+    """
+    entries = list(cities or [])
+    if cities_file:
+        with open(cities_file, "r", encoding="utf-8") as f:
+            entries += [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+    result = []
+    for entry in entries:
+        name, _, output_dir = entry.partition("=")
+        result.append((name.strip(), output_dir.strip() or None))
+    return result
+
+# Функция для инициализации рабочего процесса
+def init_worker(limiter: collector.RateLimiter) -> None:
+    """Запоминает ограничитель частоты запросов, общий для всех процессов"""
+    global shared_limiter
+    shared_limiter = limiter
+
+# Функция для параметров анализа города
+def analysis_argv(places_file: str, output_dir: str, city_name: str, report_only: bool) -> List[str]:
+    """Возвращает параметры скрипта анализа для мест города"""
+    # Города и так собираются параллельно, поэтому диаграммы строятся в рабочем
+    # процессе города (до Python 3.9 процессы пула не могут запускать свои процессы)
+    argv = ["--input", places_file, "--output-dir", output_dir, "--chart-workers", "1",
+            "--city-title", f"города {city_name.split(',')[0].strip()}"]
+    if report_only:
+        argv.append("--report-only")
+    return argv
+
+# Функция для сборки набора данных одного города
+def build_city(city_name: str, output_dir: str, collect_args: argparse.Namespace,
+               analyze: bool = True, report_only: bool = False) -> Dict[str, Any]:
+    """Собирает места города, считает оценки и строит анализ в директории output_dir.
+
+    Выполняется в рабочем процессе. Вывод пишется в build.log города, метрики -
+    в metrics.json. Ошибка не выбрасывается, а попадает в результат, чтобы
+    остальные города продолжили сборку.
+    """
+    metrics.reset("build_city")
+    started = time.monotonic()
+    result: Dict[str, Any] = {"city": city_name, "output_dir": output_dir, "status": "ok"}
+    os.makedirs(output_dir, exist_ok=True)
+
+    with open(os.path.join(output_dir, LOG_FILE), "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        try:
+            collector.configure(collect_args, shared_limiter)
+            collector.collect_city_resumable(city_name, collect_args, output_dir)
+
+            if analyze:
+                places_file = collector.places_file_for(output_dir)
+                analysis.run(analysis.parse_args(analysis_argv(places_file, os.path.join(output_dir, "analysis"),
+                                                               city_name, report_only)))
+                # Анализ красоты возможен, только если сборщик посчитал оценки
+                if collect_args.score:
+                    beauty.run(beauty.parse_args(analysis_argv(places_file,
+                                                               os.path.join(output_dir, "beauty_analysis"),
+                                                               city_name, report_only)))
+        except Exception as e:
+            print(f"Ошибка при сборке города {city_name}: {e}")
+            result.update(status="error", error=f"{e.__class__.__name__}: {e}")
+
+        collected = [stage["elements"] for stage in metrics.stages if stage["name"] == "collect"]
+        result["places"] = collected[-1] if collected else None
+        result["retries"] = sum(total["retries"] for total in metrics.request_totals().values())
+        result["seconds"] = round(time.monotonic() - started, 1)
+        result["finished"] = datetime.now().isoformat(timespec="seconds")
+        metrics.save(os.path.join(output_dir, "metrics.json"))
+
+    return result
+
+# Функция для загрузки итогов прошлого запуска
+def load_summary(path: str) -> Dict[str, Dict[str, Any]]:
+    """Возвращает итоги по городам из файла прошлого запуска"""
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        return {result["city"]: result for result in json.load(f)["cities"]}
+
+# Функция для сохранения итогов
+def save_summary(path: str, results: Dict[str, Dict[str, Any]]) -> None:
+    """Сохраняет итоги по городам (через временный файл)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"updated": datetime.now().isoformat(timespec="seconds"), "cities": list(results.values())},
+                  f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> Tuple[argparse.Namespace, argparse.Namespace]:
+    """Разбирает параметры сборки и параметры сборщика, переданные дальше"""
+    parser = argparse.ArgumentParser(
+        description="Сборка наборов данных для нескольких городов: сбор мест, оценки и анализ",
+        epilog="Остальные параметры передаются сборщику collect_moscow_places.py, "
+               "например --tile-depth 3 --score --enrich")
+    parser.add_argument("--cities", nargs="+",
+                        help="города, например \"Казань, Россия\" или \"Казань, Россия=data/kazan\"")
+    parser.add_argument("--cities-file", help="файл со списком городов, по одному на строку")
+    parser.add_argument("--output-dir", default=CITIES_DIR,
+                        help="директория, в которой создаются директории городов")
+    parser.add_argument("--jobs", type=int, default=JOBS, help="сколько городов собирать одновременно (процессов)")
+    parser.add_argument("--rate", type=float, default=collector.REQUESTS_PER_SECOND,
+                        help="общая для всех процессов частота запросов к Overpass API и Nominatim в секунду")
+    parser.add_argument("--burst", type=int, default=collector.RATE_LIMIT_BURST,
+                        help="допустимая пачка запросов сверх общей частоты")
+    parser.add_argument("--resume", action="store_true",
+                        help="пропустить собранные города и продолжить прерванные с контрольных точек")
+    parser.add_argument("--no-analysis", action="store_true", help="только сбор, без анализа")
+    parser.add_argument("--report-only", action="store_true", help="анализ без диаграмм и карт")
+    args, collect_argv = parser.parse_known_args()
+
+    args.cities = read_cities(args.cities, args.cities_file)
+    if not args.cities:
+        parser.error("не задан ни один город (--cities или --cities-file)")
+
+    collect_args = collector.parse_args(COLLECT_DEFAULTS + collect_argv + (["--resume"] if args.resume else []))
+    return args, collect_args
+
+# Основная функция
+def main():
+    args, collect_args = parse_args()
+    summary_file = os.path.join(args.output_dir, SUMMARY_FILE)
+    results = load_summary(summary_file) if args.resume else {}
+
+    jobs = []
+    output_dirs = set()
+    for city_name, output_dir in args.cities:
+        output_dir = output_dir or os.path.join(args.output_dir, collector.city_slug(city_name))
+        if output_dir in output_dirs:
+            sys.exit(f"Директория {output_dir} задана для нескольких городов")
+        output_dirs.add(output_dir)
+
+        if results.get(city_name, {}).get("status") == "ok":
+            print(f"Город {city_name} уже собран, пропускаем")
+            continue
+        jobs.append((city_name, output_dir))
+
+    print(f"Городов к сборке: {len(jobs)}, процессов: {args.jobs}, "
+          f"общая частота запросов: {args.rate} в секунду")
+    limiter = collector.SharedRateLimiter(args.rate, args.burst)
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs), initializer=init_worker,
+                             initargs=(limiter,)) as executor:
+        futures = [executor.submit(build_city, city_name, output_dir, collect_args,
+                                   not args.no_analysis, args.report_only)
+                   for city_name, output_dir in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["city"]] = result
+            save_summary(summary_file, results)
+            if result["status"] == "ok":
+                print(f"{result['city']}: {result['places']} мест за {result['seconds']:.0f} с "
+                      f"-> {result['output_dir']}")
+            else:
+                print(f"{result['city']}: ошибка {result['error']} (подробности в "
+                      f"{os.path.join(result['output_dir'], LOG_FILE)})")
+
+    failed = [result["city"] for result in results.values() if result["status"] != "ok"]
+    print(f"\nСборка завершена за {time.monotonic() - started:.0f} с, итоги сохранены в файл {summary_file}")
+    if failed:
+        print(f"Не удалось собрать города: {', '.join(failed)}; повторите запуск с --resume")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
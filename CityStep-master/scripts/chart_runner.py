@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import List, Callable, Optional
+
+from metrics import metrics
+
+# Константы
+CHART_WORKERS = min(4, os.cpu_count() or 1)
+
+# Функция для импорта matplotlib
+def pyplot():
+    """Импортирует matplotlib.pyplot с неинтерактивным бэкендом Agg.
+
+    matplotlib импортируется только при построении первой диаграммы, поэтому
+    запуск без диаграмм (--report-only) не тратит время на его загрузку.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+# Построение диаграмм
+class ChartRunner:
+    """Строит независимые диаграммы в пуле процессов.
+
+    Функция диаграммы должна быть объявлена на уровне модуля, сама
+    получать pyplot через pyplot() и сохранять результат в файл, а ее
+    аргументы должны сериализоваться pickle (хранилище мест передается
+    по пути и заново отображается в память в рабочем процессе).
+    При workers <= 1 диаграммы строятся сразу в текущем процессе,
+    при enabled=False не строятся вовсе.
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, enabled: bool = True):
+        self.workers = workers
+        self.enabled = enabled
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.futures: List[Future] = []
+        self.count = 0
+        self.started = time.monotonic()
+
+    def submit(self, chart: Callable, *args, **kwargs) -> None:
+        """Ставит диаграмму в очередь на построение"""
+        if not self.enabled:
+            return
+
+        self.count += 1
+        if self.workers <= 1:
+            chart(*args, **kwargs)
+            return
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.futures.append(self.executor.submit(chart, *args, **kwargs))
+
+    def close(self) -> None:
+        """Дожидается всех диаграмм и пробрасывает первую ошибку.
+
+        Время ожидания записывается в метрики как стадия charts.
+        """
+        with metrics.stage("charts") as stage:
+            stage["elements"] = self.count
+            try:
+                for future in self.futures:
+                    future.result()
+            finally:
+                self.discard()
+
+        if self.count:
+            print(f"Построено диаграмм: {self.count} за {time.monotonic() - self.started:.1f} с")
+
+    def discard(self) -> None:
+        """Отменяет еще не начатые диаграммы"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.futures = []
+
+    def __enter__(self) -> "ChartRunner":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -2,16 +2,107 @@
 # -*- coding: utf-8 -*-
 
 import requests
+import argparse
+import heapq
 import json
+import math
+import numbers
+import queue
+import re
+import shutil
+import sys
+import threading
 import time
 import os
-from typing import List, Dict, Any, Optional
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable, Iterator
+
+import numpy as np
+
+from beauty_model import TARGETS as SCORE_FIELDS, MODEL_FILE, score_places
+from enrichment import create_enricher
+from json_stream import JsonArrayStream, iter_records
+from metrics import metrics, count_bytes
+from pg_loader import PostgresLoader, LOAD_METHODS, PLACE_COLUMNS, csv_line, format_number
+from place_store import PlaceStoreWriter, store_path_for, open_place_store
+from resilience import (RateLimiter, SharedRateLimiter, RetryPolicy, CircuitBreaker, QueryCheckpoint,
+                        RETRY_STATUSES, MAX_RETRIES)
+from response_cache import ResponseCache, CacheMiss, DEFAULT_CACHE_DIR, DEFAULT_TTL, DEFAULT_MAX_BYTES
+from street_graph import (StreetGraph, StreetGraphBuilder, STREET_CATEGORIES, STREET_QUERY_OPTIONS, GRAPH_FILE,
+                          MAX_WALKING_PLACES, save_walking_matrix, walking_matrix_path)
 
 # Константы
-OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
-NOMINATIM_API_URL = "https://nominatim.openstreetmap.org/search"
+# Адреса API можно заменить, например на локальный fake_osm_server.py
+OVERPASS_API_URL = os.environ.get("OVERPASS_API_URL", "https://overpass-api.de/api/interpreter")
+NOMINATIM_API_URL = os.environ.get("NOMINATIM_API_URL", "https://nominatim.openstreetmap.org/search")
 OUTPUT_DIR = "data"
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "moscow_places.json")
+CITY_PLACES_FILE = "places.json"  # файл мест в директории города
+DEFAULT_CITY = "Москва, Россия"
+MAX_PLACES = 200
+
+# Состояние инкрементального сбора: время последней синхронизации и версии
+# известных элементов. Время берется с запасом, потому что данные Overpass
+# отстают от основной базы OSM на несколько минут
+SYNC_STATE_FILE = "collect_state.json"
+SYNC_OVERLAP = timedelta(hours=1)
+
+# Контрольные точки: элементы завершенных запросов города (в его директории
+# результатов) и список уже собранных городов для продолжения сбора
+CHECKPOINT_DIR = "checkpoint"
+PROGRESS_FILE = os.path.join(OUTPUT_DIR, "collect_progress.json")
+
+# Параметры параллельного сбора: публичный Overpass выделяет на один IP
+# пару слотов, поэтому по умолчанию держим два потока и не больше
+# одного запроса в секунду
+MAX_WORKERS = 2
+REQUESTS_PER_SECOND = 1.0
+RATE_LIMIT_BURST = 2
+
+# Таймаут объединенного запроса на стороне Overpass (в секундах)
+OVERPASS_TIMEOUT = 180
+
+# Таймауты HTTP-запросов (в секундах): установка соединения и ожидание
+# очередной порции ответа, пока Overpass выполняет запрос
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = OVERPASS_TIMEOUT + 30
+
+# Размер фрагмента при потоковом чтении ответа (в байтах)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Сколько элементов может ждать обработки между потоками сбора и основным потоком
+PIPELINE_QUEUE_SIZE = 1000
+
+# Область запроса Overpass, по которой запросы различаются в метриках
+BBOX_PATTERN = re.compile(r"\((-?[\d.]+,-?[\d.]+,-?[\d.]+,-?[\d.]+)\)")
+
+# Форматы результатов сбора
+OUTPUT_FORMATS = ["json", "jsonl", "sql", "store"]
+
+# Форматы SQL-скрипта и количество строк в одном многострочном INSERT
+SQL_FORMATS = ["insert", "multirow", "upsert", "copy"]
+SQL_BATCH_SIZE = 500
+
+# Миграция, добавляющая столбец osm_id в базы, созданные по старой схеме
+OSM_ID_MIGRATION = "frontend-new/db/migrations/001_places_osm_id.sql"
+
+# Порядок типов элементов в выводе Overpass API
+ELEMENT_TYPE_ORDER = {"node": 0, "way": 1, "relation": 2}
+
+# Параметры разбиения области на тайлы: тайл делится на четыре части,
+# если ответ превысил лимит элементов или Overpass не уложился в таймаут
+MAX_TILE_ELEMENTS = 5000
+MAX_TILE_DEPTH = 0
+
+# Запись кэша вместо ответа по тайлу, который пришлось разбить: неполный
+# ответ не сохраняется, а повторный сбор сразу переходит к дочерним тайлам
+SPLIT_MARKER = b'{"citystep_split": true}'
+
+# Границы области: (юг, запад, север, восток)
+Bounds = Tuple[float, float, float, float]
 
 # Категории мест для поиска
 PLACE_CATEGORIES = [
@@ -27,74 +118,540 @@ PLACE_CATEGORIES = [
     {"name": "viewpoint", "tags": ["tourism=viewpoint"]},
 ]
 
+# Общая сессия и ограничитель для всех потоков сбора
+session = requests.Session()
+session.headers["User-Agent"] = "CityStep-collector/1.0"
+rate_limiter = RateLimiter(REQUESTS_PER_SECOND, RATE_LIMIT_BURST)
+
+# Кэш ответов внешних API (None - кэш отключен)
+response_cache: Optional[ResponseCache] = None
+
+# Повторы запросов и выключатели: если сервис отказывает подряд, запросы
+# к нему прекращаются, а не ждут таймаутов
+retry_policy = RetryPolicy()
+overpass_breaker = CircuitBreaker("Overpass API")
+nominatim_breaker = CircuitBreaker("Nominatim")
+
+# Контрольная точка собираемого города (None - не сохраняется)
+checkpoint: Optional[QueryCheckpoint] = None
+
+# Функция для приостановки запросов всех потоков
+def pause_requests(error: BaseException, delay: float) -> None:
+    """После ответа 429 приостанавливает запросы всех потоков, а не только повторяемый"""
+    response = getattr(error, "response", None)
+    if response is not None and response.status_code == 429:
+        rate_limiter.pause(delay)
+
+# Функция для выполнения HTTP-запроса с учетом кэша
+def request_json(method: str, url: str, cache_query: str,
+                 is_complete: Callable[[Any], bool] = lambda data: True,
+                 use_cache: bool = True, **kwargs) -> Any:
+    """Возвращает JSON-ответ из кэша или выполняет запрос и сохраняет ответ в кэш.
+    
+    Неполные ответы (is_complete вернула False) в кэш не попадают. Временные
+    ошибки повторяются по retry_policy.
+    """
+    is_nominatim = url == NOMINATIM_API_URL
+    with metrics.request("nominatim" if is_nominatim else "overpass") as record:
+        key = None
+        if response_cache is not None and use_cache:
+            key = response_cache.make_key(url, cache_query)
+            body = response_cache.get(key)
+            if body is not None:
+                record.update(cached=True, bytes=len(body))
+                return json.loads(body)
+            if response_cache.offline:
+                raise CacheMiss(f"В кэше нет ответа на запрос к {url}")
+        
+        def send() -> requests.Response:
+            rate_limiter.acquire()
+            response = session.request(method, url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+            record.update(status=response.status_code, bytes=record["bytes"] + len(response.content))
+            response.raise_for_status()
+            return response
+        
+        response = retry_policy.call(send, record, nominatim_breaker if is_nominatim else overpass_breaker,
+                                     on_retry=pause_requests)
+        data = response.json()
+        
+        if key is not None and is_complete(data):
+            response_cache.put(key, response.content)
+        
+        return data
+
 # Функция для выполнения запроса к Overpass API
-def query_overpass(query: str) -> Dict[str, Any]:
+def query_overpass(query: str, use_cache: bool = True) -> Dict[str, Any]:
     """Выполняет запрос к Overpass API и возвращает результат в формате JSON"""
-    response = requests.post(OVERPASS_API_URL, data={"data": query})
-    response.raise_for_status()
-    return response.json()
+    return request_json("POST", OVERPASS_API_URL, query,
+                        is_complete=lambda data: "remark" not in data,
+                        use_cache=use_cache, data={"data": query})
 
-# Функция для получения мест по категории
-def get_places_by_category(category: Dict[str, Any], city_bbox: str) -> List[Dict[str, Any]]:
-    """Получает места по заданной категории в пределах указанной области"""
-    places = []
-    
-    for tag in category["tags"]:
-        key, value = tag.split("=")
-        
-        # Формируем запрос к Overpass API
-        query = f"""
-        [out:json][timeout:60];
-        (
-          node["{key}"="{value}"]{city_bbox};
-          way["{key}"="{value}"]{city_bbox};
-          relation["{key}"="{value}"]{city_bbox};
-        );
-        out center;
-        """
+# Функция для составления объединенных запросов к Overpass API
+def plan_queries(categories: List[Dict[str, Any]], city_bbox: str, max_queries: int = 1,
+                 newer: Optional[str] = None, output: str = "center",
+                 selector: str = "nwr", filters: str = '["name"]') -> List[str]:
+    """Объединяет теги всех категорий в один или несколько union-запросов.
+    
+    newer ограничивает выборку элементами, измененными после указанного
+    времени, output задает режим вывода Overpass (center, center meta, ids, geom).
+    selector - типы элементов (nwr, way), filters - дополнительные условия
+    на теги (по умолчанию только элементы с названием).
+    """
+    # Группируем значения тегов по ключу, чтобы каждый ключ дал одно
+    # регулярное выражение вместо отдельного запроса на каждое значение
+    values_by_key: Dict[str, List[str]] = {}
+    for category in categories:
+        for tag in category["tags"]:
+            key, value = tag.split("=")
+            values = values_by_key.setdefault(key, [])
+            if value not in values:
+                values.append(value)
+    
+    # Распределяем ключи по запросам как можно равномернее
+    groups: List[List[str]] = [[] for _ in range(max(1, min(max_queries, len(values_by_key))))]
+    for i, key in enumerate(values_by_key):
+        groups[i % len(groups)].append(key)
+    
+    newer_filter = f'(newer:"{newer}")' if newer else ""
+    
+    queries = []
+    for keys in groups:
+        statements = "\n".join(
+            f'  {selector}["{key}"~"^({"|".join(values_by_key[key])})$"]{filters}{city_bbox}{newer_filter};'
+            for key in keys
+        )
+        queries.append(f"""
+[out:json][timeout:{OVERPASS_TIMEOUT}];
+(
+{statements}
+);
+out {output};
+""")
+    
+    return queries
+
+# Функция для преобразования элемента OSM в место
+def element_to_place(element: Dict[str, Any], category_name: str) -> Optional[Dict[str, Any]]:
+    """Формирует информацию о месте из элемента OSM или возвращает None"""
+    # Пропускаем элементы без имени
+    if "tags" not in element or "name" not in element["tags"]:
+        return None
+    
+    # Получаем координаты
+    if element["type"] == "node":
+        lat, lon = element["lat"], element["lon"]
+    else:  # way или relation
+        lat, lon = element.get("center", {}).get("lat"), element.get("center", {}).get("lon")
+    
+    if not lat or not lon:
+        return None
+    
+    return {
+        "id": element["id"],
+        "osm_type": element["type"],
+        "version": element.get("version"),
+        "name": element["tags"]["name"],
+        "type": category_name,
+        "latitude": lat,
+        "longitude": lon,
+        "tags": element["tags"],
+        "estimated_time": estimate_visit_time(category_name),
+        "description": element["tags"].get("description", ""),
+        "image_url": element["tags"].get("image") or ""
+    }
+
+# Функция для потокового чтения ответа Overpass API
+def stream_overpass(query: str, sink: Callable[[Dict[str, Any]], None], limit: Optional[int] = None,
+                    retry_statuses: Iterable[int] = RETRY_STATUSES) -> Tuple[int, Dict[str, Any]]:
+    """Выполняет запрос и передает элементы ответа в sink по одному.
+    
+    Ответ разбирается по мере поступления, поэтому ни тело ответа, ни полный
+    список элементов не держатся в памяти. Если limit задан, чтение
+    прекращается после limit элементов. Ответы с кодами из retry_statuses
+    и обрывы соединения повторяются; если ответ оборвался посередине,
+    элементы прерванной попытки придут в sink повторно. Возвращает
+    количество элементов и остальные поля ответа (например, remark).
+    """
+    bbox = BBOX_PATTERN.search(query)
+    with metrics.request("overpass", bbox=bbox.group(1) if bbox else "") as record:
+        count, fields = _stream_overpass(query, sink, limit, record, retry_statuses)
+        record["elements"] = count
+        return count, fields
+
+# Функция для чтения ответа Overpass API из кэша или из сети
+def _stream_overpass(query: str, sink: Callable[[Dict[str, Any]], None], limit: Optional[int],
+                     record: Dict[str, Any], retry_statuses: Iterable[int]) -> Tuple[int, Dict[str, Any]]:
+    key = None
+    if response_cache is not None:
+        key = response_cache.make_key(OVERPASS_API_URL, query)
+        path = response_cache.get_path(key)
+        if path is not None:
+            with open(path, "rb") as f:
+                split = f.read(len(SPLIT_MARKER) + 1) == SPLIT_MARKER
+                # Отметка о разбиении годится, только если тайл и сейчас можно разбить
+                if not split or limit is not None:
+                    record["cached"] = True
+                    if split:
+                        return 0, {"split": True}
+                    f.seek(0)
+                    return parse_overpass_stream(count_bytes(iter(lambda: f.read(STREAM_CHUNK_SIZE), b""), record),
+                                                 sink, limit)
+        if response_cache.offline:
+            raise CacheMiss(f"В кэше нет ответа на запрос к {OVERPASS_API_URL}")
+    
+    return retry_policy.call(lambda: _download_overpass(query, sink, limit, record, key), record,
+                             overpass_breaker, retry_statuses, pause_requests)
+
+# Функция для одной попытки загрузки ответа Overpass API
+def _download_overpass(query: str, sink: Callable[[Dict[str, Any]], None], limit: Optional[int],
+                       record: Dict[str, Any], key: Optional[str]) -> Tuple[int, Dict[str, Any]]:
+    rate_limiter.acquire()
+    with session.post(OVERPASS_API_URL, data={"data": query}, stream=True,
+                      timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+        record["status"] = response.status_code
+        response.raise_for_status()
+        chunks = count_bytes(response.iter_content(STREAM_CHUNK_SIZE), record)
+        
+        if key is None:
+            return parse_overpass_stream(chunks, sink, limit)
         
+        # Параллельно с разбором пишем ответ во временный файл и переносим
+        # его в кэш, только если ответ дочитан до конца и полный
+        tmp_path = response_cache.new_temp_path(key)
         try:
-            print(f"Запрос мест с тегом {tag}...")
-            result = query_overpass(query)
-            
-            for element in result.get("elements", []):
-                # Пропускаем элементы без имени
-                if "tags" not in element or "name" not in element["tags"]:
-                    continue
-                
-                # Получаем координаты
-                if element["type"] == "node":
-                    lat, lon = element["lat"], element["lon"]
-                else:  # way или relation
-                    lat, lon = element.get("center", {}).get("lat"), element.get("center", {}).get("lon")
-                
-                if not lat or not lon:
-                    continue
+            with open(tmp_path, "wb") as tmp:
+                def tee():
+                    for chunk in chunks:
+                        tmp.write(chunk)
+                        yield chunk
                 
-                # Формируем информацию о месте
-                place = {
-                    "id": element["id"],
-                    "name": element["tags"]["name"],
-                    "type": category["name"],
-                    "latitude": lat,
-                    "longitude": lon,
-                    "tags": element["tags"],
-                    "estimated_time": estimate_visit_time(category["name"]),
-                    "description": element["tags"].get("description", ""),
-                    "image_url": element["tags"].get("image") or ""
-                }
-                
-                # Добавляем место в список, если его еще нет
-                if not any(p["id"] == place["id"] for p in places):
-                    places.append(place)
-            
-            # Делаем паузу, чтобы не перегружать API
-            time.sleep(1)
+                count, fields = parse_overpass_stream(tee(), sink, limit)
             
+            if limit is not None and (count >= limit or is_truncated(fields)):
+                mark_split(query)
+            elif "remark" not in fields and (limit is None or count < limit):
+                response_cache.put_file(key, tmp_path)
+            return count, fields
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+# Функция для отметки в кэше, что тайл разбит
+def mark_split(query: str) -> None:
+    """Сохраняет в кэш вместо ответа отметку о разбиении тайла"""
+    if response_cache is not None:
+        response_cache.put(response_cache.make_key(OVERPASS_API_URL, query), SPLIT_MARKER)
+
+# Функция для проверки, оборвал ли Overpass ответ
+def is_truncated(fields: Dict[str, Any]) -> bool:
+    """Проверяет, сообщает ли remark ответа о таймауте или нехватке памяти"""
+    remark = fields.get("remark", "")
+    return "timed out" in remark or "out of memory" in remark
+
+# Функция для разбора потока ответа Overpass API
+def parse_overpass_stream(chunks, sink: Callable[[Dict[str, Any]], None],
+                          limit: Optional[int] = None) -> Tuple[int, Dict[str, Any]]:
+    """Разбирает элементы из потока байтов и передает их в sink"""
+    stream = JsonArrayStream(chunks)
+    count = 0
+    
+    for element in stream:
+        sink(element)
+        count += 1
+        if limit is not None and count >= limit:
+            break
+    
+    return count, stream.fields
+
+# Функция для выполнения одного объединенного запроса
+def fetch_elements(query: str, sink: Callable[[Dict[str, Any]], None],
+                   can_split: bool = False) -> Tuple[int, bool]:
+    """Выполняет запрос к Overpass API и передает найденные элементы в sink.
+    
+    Возвращает количество элементов и признак полноты ответа. Ответ неполный,
+    если Overpass не уложился в таймаут или в память, либо элементов
+    не меньше MAX_TILE_ELEMENTS; тогда тайл имеет смысл разбить на части.
+    Если тайл можно разбить (can_split), большой ответ не дочитывается.
+    
+    Временные ошибки повторяются, а ошибка, оставшаяся после повторов,
+    выбрасывается дальше и останавливает сбор города, чтобы часть мест
+    не пропала молча. Завершенные запросы сохраняются в контрольную точку
+    и при повторном запуске берутся из нее без обращения к сети.
+    """
+    writer = None
+    if checkpoint is not None:
+        saved = checkpoint.replay(query, sink)
+        if saved is not None:
+            return saved
+        writer = checkpoint.writer(query)
+    
+    try:
+        count, complete = _fetch_elements(query, writer.wrap(sink) if writer is not None else sink, can_split)
+        if writer is not None:
+            writer.commit(count, complete)
+        return count, complete
+    finally:
+        if writer is not None:
+            writer.discard()
+
+# Функция для выполнения запроса и проверки полноты ответа
+def _fetch_elements(query: str, sink: Callable[[Dict[str, Any]], None], can_split: bool) -> Tuple[int, bool]:
+    # Большой тайл Overpass обрывает по таймауту (504): его выгоднее разбить, чем повторять
+    retry_statuses = RETRY_STATUSES - {504} if can_split else RETRY_STATUSES
+    try:
+        count, fields = stream_overpass(query, sink, MAX_TILE_ELEMENTS if can_split else None, retry_statuses)
+    except requests.ReadTimeout as e:
+        if not can_split:
+            raise
+        print(f"Превышено время ожидания ответа Overpass API: {e}")
+        mark_split(query)
+        return 0, False
+    except requests.HTTPError as e:
+        if not can_split or e.response is None or e.response.status_code != 504:
+            raise
+        print("Overpass API не уложился в таймаут")
+        mark_split(query)
+        return 0, False
+    
+    if fields.get("split"):
+        print("Тайл был разбит при прошлом сборе, запрашиваем дочерние тайлы")
+        return count, False
+    if is_truncated(fields):
+        print(f"Неполный ответ Overpass API: {fields['remark']}")
+        return count, False
+    if count >= MAX_TILE_ELEMENTS:
+        print(f"Получено {count} элементов, это не меньше лимита тайла")
+        return count, False
+    
+    print(f"Получено {count} элементов")
+    return count, True
+
+# Функция для форматирования границ области для Overpass API
+def format_bbox(bounds: Bounds) -> str:
+    """Возвращает границы области в формате bbox для Overpass API"""
+    return "({},{},{},{})".format(*bounds)
+
+# Функция для разбора bbox в формате Overpass API
+def parse_bbox(city_bbox: str) -> Bounds:
+    """Преобразует строку bbox Overpass API в границы области"""
+    south, west, north, east = (float(x) for x in city_bbox.strip("()").split(","))
+    return south, west, north, east
+
+# Функция для разбиения области на четыре тайла
+def split_bounds(bounds: Bounds) -> List[Bounds]:
+    """Делит область на четыре равные части (узел квадродерева)"""
+    south, west, north, east = bounds
+    mid_lat = (south + north) / 2
+    mid_lon = (west + east) / 2
+    return [
+        (south, west, mid_lat, mid_lon),
+        (south, mid_lon, mid_lat, east),
+        (mid_lat, west, north, mid_lon),
+        (mid_lat, mid_lon, north, east),
+    ]
+
+# Функция для сбора элементов по адаптивному квадродереву тайлов
+def fetch_tiled_elements(categories: List[Dict[str, Any]], bounds: Bounds,
+                         sink: Callable[[Dict[str, Any]], None], max_workers: int = MAX_WORKERS,
+                         max_queries: int = 1, max_depth: int = MAX_TILE_DEPTH, **query_options) -> int:
+    """Параллельно запрашивает тайлы области и дробит те, ответ по которым неполный.
+    
+    Элементы передаются в sink из рабочих потоков. Если sink выбрасывает
+    исключение, еще не начатые запросы отменяются. Элементы неполного тайла
+    тоже попадают в sink, поэтому sink должен пропускать повторы, которые
+    придут из дочерних тайлов. Возвращает количество полученных элементов.
+    """
+    query_count = len(plan_queries(categories, format_bbox(bounds), max_queries, **query_options))
+    total = 0
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Каждая задача - это один объединенный запрос для одного тайла
+        def submit(tile: Bounds, depth: int, group: int):
+            query = plan_queries(categories, format_bbox(tile), max_queries, **query_options)[group]
+            return executor.submit(fetch_elements, query, sink, depth < max_depth)
+        
+        pending = {submit(bounds, 0, group): (bounds, 0, group) for group in range(query_count)}
+        
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, depth, group = pending.pop(future)
+                    count, complete = future.result()
+                    total += count
+                    
+                    if complete:
+                        continue
+                    if depth < max_depth:
+                        print(f"Разбиваем тайл {format_bbox(tile)} на 4 части (уровень {depth + 1})")
+                        for child in split_bounds(tile):
+                            pending[submit(child, depth + 1, group)] = (child, depth + 1, group)
+                    else:
+                        # Глубже дробить нельзя, поэтому берем то, что вернул Overpass
+                        print(f"Тайл {format_bbox(tile)} достиг максимальной глубины разбиения, ответ может быть неполным")
+        except BaseException:
+            # Не начинаем запросы, результаты которых уже никому не нужны
+            for future in pending:
+                future.cancel()
+            raise
+    
+    return total
+
+# Признак конца потока элементов
+class StreamEnd:
+    """Последний элемент очереди; содержит ошибку сбора, если она была"""
+
+    def __init__(self, error: Optional[Exception] = None):
+        self.error = error
+
+class PipelineClosed(Exception):
+    """Потребитель потока элементов завершил работу, сбор нужно прекратить"""
+
+# Поток элементов из рабочих потоков сбора
+def iter_tiled_elements(categories: List[Dict[str, Any]], bounds: Bounds, max_workers: int = MAX_WORKERS,
+                        max_queries: int = 1, max_depth: int = MAX_TILE_DEPTH,
+                        **query_options) -> Iterator[Dict[str, Any]]:
+    """Выдает элементы OSM по мере их получения из параллельных запросов по тайлам.
+    
+    Рабочие потоки складывают элементы в ограниченную очередь, поэтому если
+    следующие этапы не успевают, чтение ответов приостанавливается. Если
+    генератор закрыли раньше времени (например, набран лимит мест),
+    оставшиеся запросы отменяются.
+    """
+    elements: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    closed = threading.Event()
+    
+    def put(item) -> None:
+        while not closed.is_set():
+            try:
+                elements.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineClosed()
+    
+    def produce() -> None:
+        error = None
+        try:
+            fetch_tiled_elements(categories, bounds, put, max_workers, max_queries, max_depth, **query_options)
+        except PipelineClosed:
+            return
         except Exception as e:
-            print(f"Ошибка при запросе мест с тегом {tag}: {e}")
+            error = e
+        try:
+            put(StreamEnd(error))
+        except PipelineClosed:
+            pass
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = elements.get()
+            if isinstance(item, StreamEnd):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        closed.set()
+        producer.join()
+
+# Распределение элементов по категориям и устранение дубликатов
+class PlaceClassifier:
+    """Превращает поток элементов OSM в поток мест без дубликатов.
+    
+    Один элемент может прийти несколько раз, если у него есть теги
+    с разными ключами или он попал в пересекающиеся тайлы, - повторы
+    пропускаются по ключу (тип элемента, id). Элемент, подходящий под
+    несколько категорий, становится одним местом: тип и время посещения
+    берутся из первой категории в порядке categories, а все категории
+    сохраняются в поле categories. В памяти хранятся только ключи
+    уже выданных мест.
+    """
+
+    def __init__(self, categories: List[Dict[str, Any]]):
+        self.categories = categories
+        self.seen: set = set()
+        self.counts = [0] * len(categories)
+        self.repeats = 0
+        self.duplicates = 0
+        
+        # Для каждого тега - список (номер категории, номер тега в категории)
+        self.tag_positions: Dict[str, List[Tuple[int, int]]] = {}
+        for category_index, category in enumerate(categories):
+            for tag_index, tag in enumerate(category["tags"]):
+                self.tag_positions.setdefault(tag, []).append((category_index, tag_index))
+
+    def match(self, tags: Dict[str, str]) -> Dict[int, int]:
+        """Возвращает для каждой подходящей категории номер первого совпавшего тега"""
+        matches: Dict[int, int] = {}
+        for key, value in tags.items():
+            for category_index, tag_index in self.tag_positions.get(f"{key}={value}", ()):
+                if tag_index < matches.get(category_index, len(self.categories[category_index]["tags"])):
+                    matches[category_index] = tag_index
+        return matches
+
+    def __call__(self, elements: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for element in elements:
+            element_key = (element["type"], element["id"])
+            if element_key in self.seen:
+                self.repeats += 1
+                continue
+            
+            matches = self.match(element.get("tags", {}))
+            if not matches:
+                continue
+            
+            category_indexes = sorted(matches)
+            place = element_to_place(element, self.categories[category_indexes[0]]["name"])
+            if place is None:
+                continue
+            
+            self.seen.add(element_key)
+            place["categories"] = [self.categories[i]["name"] for i in category_indexes]
+            for category_index in category_indexes:
+                self.counts[category_index] += 1
+            self.duplicates += len(category_indexes) - 1
+            yield place
+
+    def order_key(self, place: Dict[str, Any]) -> tuple:
+        """Ключ детерминированного порядка мест.
+        
+        Порядок такой же, как при отдельных запросах по категориям: по первой
+        категории, затем по первому совпавшему тегу категории, затем по типу
+        и id элемента (так сортирует вывод Overpass).
+        """
+        matches = self.match(place["tags"])
+        category_index = min(matches)
+        return (category_index, matches[category_index],
+                ELEMENT_TYPE_ORDER.get(place["osm_type"], 3), place["id"])
+
+    def report(self) -> None:
+        """Выводит статистику по категориям и дубликатам"""
+        for category, count in zip(self.categories, self.counts):
+            print(f"Найдено {count} мест категории {category['name']}")
+        print(f"Всего найдено {len(self.seen)} мест, объединено дубликатов: {self.duplicates}")
+        if self.repeats:
+            print(f"Пропущено повторов из пересекающихся запросов и тайлов: {self.repeats}")
+
+# Функция для упорядочивания потока мест
+def order_places(places: Iterable[Dict[str, Any]], key: Callable[[Dict[str, Any]], tuple],
+                 limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Возвращает места в детерминированном порядке.
     
-    return places
+    При заданном лимите в памяти хранится не больше limit мест (heapq).
+    """
+    if limit:
+        return heapq.nsmallest(limit, places, key=key)
+    return sorted(places, key=key)
+
+# Функция для получения мест по категории
+def get_places_by_category(category: Dict[str, Any], city_bbox: str) -> List[Dict[str, Any]]:
+    """Получает места по заданной категории в пределах указанной области"""
+    classifier = PlaceClassifier([category])
+    return order_places(classifier(iter_tiled_elements([category], parse_bbox(city_bbox))),
+                        classifier.order_key)
 
 # Функция для оценки времени посещения места
 def estimate_visit_time(place_type: str) -> int:
@@ -115,63 +672,269 @@ def estimate_visit_time(place_type: str) -> int:
     return time_estimates.get(place_type, 60)
 
 # Функция для получения границ города
-def get_city_bbox(city_name: str) -> str:
-    """Получает границы города в формате bbox для Overpass API"""
+def get_city_bounds(city_name: str) -> Bounds:
+    """Получает границы города через Nominatim API"""
     params = {
         "q": city_name,
         "format": "json",
         "limit": 1
     }
     
-    response = requests.get(NOMINATIM_API_URL, params=params)
-    response.raise_for_status()
-    data = response.json()
+    data = request_json("GET", NOMINATIM_API_URL, json.dumps(params, sort_keys=True, ensure_ascii=False),
+                        params=params)
     
     if not data:
         raise ValueError(f"Город {city_name} не найден")
     
     bbox = data[0]["boundingbox"]
-    return f"({bbox[0]},{bbox[2]},{bbox[1]},{bbox[3]})"
+    return float(bbox[0]), float(bbox[2]), float(bbox[1]), float(bbox[3])
 
-# Функция для обработки и сохранения данных
-def process_and_save_places(places: List[Dict[str, Any]], output_file: str) -> None:
-    """Обрабатывает и сохраняет данные о местах в JSON-файл"""
-    # Создаем директорию, если она не существует
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+# Функция для получения границ города в формате Overpass API
+def get_city_bbox(city_name: str) -> str:
+    """Получает границы города в формате bbox для Overpass API"""
+    return format_bbox(get_city_bounds(city_name))
+
+# Функция для получения стабильного идентификатора объекта OSM
+def get_osm_id(place: Dict[str, Any]) -> str:
+    """Возвращает идентификатор места вида node/123"""
+    return f"{place['osm_type']}/{place['id']}"
+
+# Функция для преобразования места в запись базы данных
+def process_place(place: Dict[str, Any]) -> Dict[str, Any]:
+    """Формирует запись для таблицы places из собранного места"""
+    # Формируем описание на основе доступных тегов
+    description = place["description"]
+    if not description and "description:ru" in place["tags"]:
+        description = place["tags"]["description:ru"]
+    if not description and "wikipedia" in place["tags"]:
+        description = f"Подробнее: {place['tags']['wikipedia']}"
+    if not description:
+        description = f"Место категории: {place['type']}"
+    
+    # Преобразуем тип места в соответствии с требованиями базы данных
+    db_type = map_type_to_db_type(place["type"])
     
-    # Преобразуем данные в формат для базы данных
-    processed_places = []
+    record = {
+        "osm_id": get_osm_id(place),
+        "name": place["name"],
+        "description": description,
+        "type": db_type,
+        "latitude": place["latitude"],
+        "longitude": place["longitude"],
+        "estimated_time": place["estimated_time"],
+        "image_url": place["image_url"]
+    }
     
+    # Оценки есть только у мест, прошедших score_places (параметр --score)
+    for field in SCORE_FIELDS:
+        if field in place:
+            record[field] = place[field]
+    return record
+
+# Базовый класс выходного файла
+class RecordSink(ABC):
+    """Записывает поток записей о местах в файл по одной, не накапливая их.
+    
+    Запись идет во временный файл, который заменяет результат только после
+    успешного завершения, поэтому ошибка сбора не портит прошлые результаты.
+    Наследники реализуют write_record и при необходимости begin и end.
+    """
+
+    description = "Данные сохранены в файл"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.count = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+        self.begin()
+
+    def begin(self) -> None:
+        pass
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.write_record(record)
+        self.count += 1
+
+    @abstractmethod
+    def write_record(self, record: Dict[str, Any]) -> None:
+        """Пишет одну запись в файл"""
+
+    def end(self) -> None:
+        pass
+
+    def close(self) -> None:
+        try:
+            self.end()
+            self.file.close()
+        except BaseException:
+            self.discard()
+            raise
+        os.replace(self.tmp_path, self.path)
+        print(f"{self.description} {self.path}")
+
+    def discard(self) -> None:
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+# Запись в JSON-массив
+class JsonArraySink(RecordSink):
+    """Пишет записи в JSON-массив в том же виде, что json.dump(..., indent=2)"""
+
+    def write_record(self, record: Dict[str, Any]) -> None:
+        text = json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self.file.write(("[\n  " if self.count == 0 else ",\n  ") + text)
+
+    def end(self) -> None:
+        self.file.write("\n]" if self.count else "[]")
+
+# Запись в JSON Lines
+class JsonLinesSink(RecordSink):
+    """Пишет по одной записи в строке (формат JSON Lines)"""
+
+    def write_record(self, record: Dict[str, Any]) -> None:
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+# Запись в SQL-скрипт
+class SqlSink(RecordSink):
+    """Пишет SQL-скрипт для загрузки записей в таблицу places.
+    
+    Форматы:
+    - insert - отдельный INSERT для каждой записи;
+    - multirow - многострочные INSERT по batch_size строк в одной транзакции;
+    - upsert - то же, но с ON CONFLICT (osm_id) DO UPDATE, скрипт можно
+      выполнять повторно;
+    - copy - COPY ... FROM STDIN с данными в CSV (для psql).
+    В памяти хранится не больше одной пачки строк.
+    """
+
+    description = "SQL-скрипт сохранен в файл"
+
+    def __init__(self, path: str, sql_format: str = "insert", batch_size: int = SQL_BATCH_SIZE):
+        self.sql_format = sql_format
+        self.batch_size = max(1, batch_size)
+        self.batch: List[str] = []
+        super().__init__(path)
+
+    def begin(self) -> None:
+        self.file.write("-- SQL-скрипт для добавления мест в базу данных\n")
+        self.file.write(f"-- Для базы без столбца places.osm_id сначала выполните {OSM_ID_MIGRATION}\n\n")
+        
+        if self.sql_format == "copy":
+            self.file.write(f"COPY places ({', '.join(PLACE_COLUMNS)}) FROM STDIN WITH (FORMAT csv);\n")
+        elif self.sql_format != "insert":
+            self.file.write("BEGIN;\n")
+
+    def write_record(self, record: Dict[str, Any]) -> None:
+        if self.sql_format == "insert":
+            self.file.write(f"""INSERT INTO places ({", ".join(PLACE_COLUMNS)})
+VALUES {sql_values(record)};
+""")
+        elif self.sql_format == "copy":
+            self.file.write(csv_line(record[column] for column in PLACE_COLUMNS))
+        else:
+            self.batch.append(sql_values(record))
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+    def flush(self) -> None:
+        """Записывает накопленную пачку строк одним INSERT"""
+        if not self.batch:
+            return
+        
+        self.file.write(f"INSERT INTO places ({', '.join(PLACE_COLUMNS)})\nVALUES\n  ")
+        self.file.write(",\n  ".join(self.batch))
+        if self.sql_format == "upsert":
+            self.file.write(f"\n{sql_upsert_clause()}")
+        self.file.write(";\n")
+        self.batch = []
+
+    def end(self) -> None:
+        if self.sql_format == "copy":
+            self.file.write("\\.\n")
+        elif self.sql_format != "insert":
+            self.flush()
+            self.file.write("COMMIT;\n")
+
+# Запись в столбцовое хранилище
+class PlaceStoreSink(PlaceStoreWriter):
+    """Пишет записи в столбцовое хранилище для скриптов анализа"""
+
+    def close(self) -> None:
+        super().close()
+        print(f"Столбцовое хранилище сохранено в {self.path}")
+
+# Функция для создания выходных файлов города
+def create_sinks(formats: List[str], output_dir: str, output_file: str, sql_format: str = "insert",
+                 batch_size: int = SQL_BATCH_SIZE, database_url: Optional[str] = None,
+                 load_method: str = "copy", max_workers: int = MAX_WORKERS) -> list:
+    """Создает выходные файлы выбранных форматов и, если задана база данных, загрузчик в Postgres"""
+    sinks: list = []
+    # Загрузчик создаем первым: без базы данных нет смысла начинать сбор
+    if database_url:
+        sinks.append(PostgresLoader(database_url, columns=PLACE_COLUMNS, method=load_method,
+                                    chunk_size=batch_size, max_workers=max_workers))
+    if "json" in formats:
+        sinks.append(JsonArraySink(output_file))
+    if "jsonl" in formats:
+        sinks.append(JsonLinesSink(os.path.splitext(output_file)[0] + ".jsonl"))
+    if "sql" in formats:
+        sinks.append(SqlSink(os.path.join(output_dir, "insert_places.sql"), sql_format, batch_size))
+    if "store" in formats:
+        sinks.append(PlaceStoreSink(store_path_for(output_file)))
+    return sinks
+
+# Функция для записи потока записей во все выходные файлы
+def write_records(records: Iterable[Dict[str, Any]], sinks: list) -> int:
+    """Передает каждую запись во все выходные файлы и загрузчики и возвращает количество записей"""
+    count = 0
+    try:
+        for record in records:
+            for sink in sinks:
+                sink.write(record)
+            count += 1
+    except BaseException:
+        discard_sinks(sinks)
+        raise
+    
+    for i, sink in enumerate(sinks):
+        try:
+            sink.close()
+        except BaseException:
+            # Например, не удалось дозагрузить пачку в Postgres: остальные
+            # выходные файлы не заменяют прошлые результаты
+            discard_sinks(sinks[i + 1:])
+            raise
+    return count
+
+# Функция для отмены записи в выходные файлы
+def discard_sinks(sinks: list) -> None:
+    """Отменяет запись во все выходные файлы и загрузчики; ошибка одного не мешает остальным"""
+    for sink in sinks:
+        try:
+            sink.discard()
+        except Exception as e:
+            print(f"Не удалось отменить запись ({sink.__class__.__name__}): {e}")
+
+# Функция для сохранения обработанных мест в JSON-файл
+def save_processed_places(processed_places: Iterable[Dict[str, Any]], output_file: str) -> None:
+    """Сохраняет записи о местах в JSON-файл"""
+    write_records(processed_places, [JsonArraySink(output_file)])
+
+# Функция для обработки и сохранения данных
+def process_and_save_places(places: Iterable[Dict[str, Any]], output_file: str) -> None:
+    """Обрабатывает и сохраняет данные о местах в JSON-файл"""
+    save_processed_places(map(process_place, places), output_file)
+
+# Функция для запоминания версий мест в потоке
+def track_versions(places: Iterable[Dict[str, Any]],
+                   versions: Dict[str, Optional[int]]) -> Iterator[Dict[str, Any]]:
+    """Пропускает места дальше, запоминая версию каждого элемента OSM"""
     for place in places:
-        # Формируем описание на основе доступных тегов
-        description = place["description"]
-        if not description and "description:ru" in place["tags"]:
-            description = place["tags"]["description:ru"]
-        if not description and "wikipedia" in place["tags"]:
-            description = f"Подробнее: {place['tags']['wikipedia']}"
-        if not description:
-            description = f"Место категории: {place['type']}"
-        
-        # Преобразуем тип места в соответствии с требованиями базы данных
-        db_type = map_type_to_db_type(place["type"])
-        
-        processed_place = {
-            "name": place["name"],
-            "description": description,
-            "type": db_type,
-            "latitude": place["latitude"],
-            "longitude": place["longitude"],
-            "estimated_time": place["estimated_time"],
-            "image_url": place["image_url"]
-        }
-        
-        processed_places.append(processed_place)
-    
-    # Сохраняем данные в файл
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(processed_places, f, ensure_ascii=False, indent=2)
-    
-    print(f"Данные сохранены в файл {output_file}")
+        versions[get_osm_id(place)] = place["version"]
+        yield place
 
 # Функция для преобразования типа места в тип базы данных
 def map_type_to_db_type(place_type: str) -> str:
@@ -191,58 +954,491 @@ def map_type_to_db_type(place_type: str) -> str:
     
     return type_mapping.get(place_type, "attraction")
 
+# Функция для разбора аргументов командной строки
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбирает параметры параллельного сбора (по умолчанию - из командной строки)"""
+    parser = argparse.ArgumentParser(description="Сбор данных о местах Москвы через OpenStreetMap")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="количество параллельных запросов к Overpass API")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="максимальное число запросов в секунду")
+    parser.add_argument("--queries", type=int, default=1,
+                        help="на сколько объединенных запросов разбить теги категорий")
+    parser.add_argument("--burst", type=int, default=RATE_LIMIT_BURST,
+                        help="допустимая пачка запросов сверх средней частоты")
+    parser.add_argument("--tile-depth", type=int, default=MAX_TILE_DEPTH,
+                        help="максимальная глубина разбиения области на тайлы (0 - без разбиения)")
+    parser.add_argument("--overpass-url", default=OVERPASS_API_URL,
+                        help="адрес Overpass API (по умолчанию OVERPASS_API_URL или публичный сервер)")
+    parser.add_argument("--nominatim-url", default=NOMINATIM_API_URL,
+                        help="адрес поиска Nominatim (по умолчанию NOMINATIM_API_URL или публичный сервер)")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="сколько раз повторять запрос при временных ошибках (429, 5xx, обрыв соединения)")
+    parser.add_argument("--resume", action="store_true",
+                        help="продолжить прерванный сбор: пропустить собранные города и взять завершенные "
+                             "запросы из контрольных точек")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="не сохранять контрольные точки сбора")
+    parser.add_argument("--cities", nargs="+", default=[DEFAULT_CITY],
+                        help="список городов для сбора, например \"Казань, Россия\"")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="директория кэша ответов Overpass и Nominatim")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL / 3600,
+                        help="срок жизни записей кэша в часах")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="максимальный размер кэша в мегабайтах")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="не использовать кэш ответов")
+    parser.add_argument("--offline", action="store_true",
+                        help="брать ответы только из кэша, не обращаясь к сети")
+    parser.add_argument("--incremental", action="store_true",
+                        help="загружать только изменения с прошлого запуска и формировать delta_places.sql")
+    parser.add_argument("--limit", type=int, default=MAX_PLACES,
+                        help="максимальное количество мест в результате (0 - без ограничения)")
+    parser.add_argument("--outputs", nargs="+", choices=OUTPUT_FORMATS, default=["json", "sql", "store"],
+                        help="форматы результатов: json, jsonl (JSON Lines), sql, store (столбцовое хранилище)")
+    parser.add_argument("--sql-format", choices=SQL_FORMATS, default="insert",
+                        help="формат SQL-скрипта: insert, multirow, upsert или copy")
+    parser.add_argument("--batch-size", type=int, default=SQL_BATCH_SIZE,
+                        help="количество строк в одном многострочном INSERT и в одной транзакции загрузки")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help="строка подключения к Postgres для загрузки мест напрямую (по умолчанию DATABASE_URL)")
+    parser.add_argument("--load-method", choices=LOAD_METHODS, default="copy",
+                        help="способ загрузки в Postgres: copy или values")
+    parser.add_argument("--stream", action="store_true",
+                        help="записывать места в порядке получения, не упорядочивая их")
+    parser.add_argument("--street-graph", action="store_true",
+                        help="загрузить пешеходную сеть области и посчитать пешеходные расстояния между местами")
+    parser.add_argument("--enrich", action="store_true",
+                        help="дополнить места описаниями и изображениями из Wikipedia и Wikidata")
+    parser.add_argument("--enrich-fixtures",
+                        help="JSON-файл с записанными ответами Wikipedia и Wikidata для обогащения без сети")
+    parser.add_argument("--metrics",
+                        help="JSON-файл для сводки метрик запуска (время, объем данных, элементы, повторы, память)")
+    parser.add_argument("--prometheus", help="файл для метрик запуска в текстовом формате Prometheus")
+    parser.add_argument("--score", action="store_true",
+                        help="посчитать оценки красоты, популярности и ценности мест по тегам OSM")
+    parser.add_argument("--beauty-model", default=MODEL_FILE,
+                        help="файл весов модели оценок (создается по размеченным местам, если его нет)")
+    parser.add_argument("--refit-model", action="store_true",
+                        help="заново обучить модель оценок на размеченных местах")
+    return parser.parse_args(argv)
+
+# Функция для определения путей к результатам по городу
+def get_city_output_dir(city_name: str, cities: List[str]) -> str:
+    """Возвращает директорию результатов: общую для одного города, отдельную для нескольких"""
+    if len(cities) == 1:
+        return OUTPUT_DIR
+    
+    return os.path.join(OUTPUT_DIR, city_slug(city_name))
+
+# Функция для получения имени директории города
+def city_slug(city_name: str) -> str:
+    """Возвращает имя директории города: \"Нижний Новгород, Россия\" -> нижний_новгород"""
+    return city_name.split(",")[0].strip().lower().replace(" ", "_")
+
+# Функция для получения пути к файлу мест в директории результатов
+def places_file_for(output_dir: str) -> str:
+    """Возвращает файл мест: data/moscow_places.json для директории data, иначе <output_dir>/places.json"""
+    if os.path.normpath(output_dir) == os.path.normpath(OUTPUT_DIR):
+        return OUTPUT_FILE
+    return os.path.join(output_dir, CITY_PLACES_FILE)
+
+# Функция для построения потока мест одного города
+def iter_city_places(bounds: Bounds, args: argparse.Namespace, classifier: PlaceClassifier,
+                     limit: Optional[int] = None, **query_options) -> Iterator[Dict[str, Any]]:
+    """Конвейер: запросы по тайлам -> разбор ответов -> устранение дубликатов -> порядок и лимит.
+    
+    Лимит по умолчанию - args.limit (0 - без ограничения). Сбор начинается
+    только при чтении первого места.
+    """
+    limit = args.limit if limit is None else limit
+    print(f"Поиск мест по {len(classifier.categories)} категориям...")
+    elements = iter_tiled_elements(classifier.categories, bounds, args.workers, args.queries, args.tile_depth,
+                                   **query_options)
+    places = classifier(elements)
+    
+    if args.stream:
+        # Места уходят дальше сразу, закрытие генератора по лимиту останавливает сбор
+        yield from islice(places, limit) if limit else places
+    else:
+        yield from order_places(places, classifier.order_key, limit)
+
+# Функция для загрузки графа улиц города
+def collect_street_graph(bounds: Bounds, args: argparse.Namespace, output_dir: str) -> StreetGraph:
+    """Загружает пешеходную сеть области тем же конвейером тайлов, что и места.
+    
+    Граф сохраняется в output_dir и при следующих запусках для той же
+    области читается с диска.
+    """
+    graph_file = os.path.join(output_dir, GRAPH_FILE)
+    if os.path.exists(graph_file):
+        graph = StreetGraph.load(graph_file)
+        if graph.bounds == tuple(bounds):
+            print(f"Граф улиц загружен из файла {graph_file}")
+            return graph
+    
+    print("Загрузка пешеходной сети...")
+    builder = StreetGraphBuilder(bounds)
+    for element in iter_tiled_elements(STREET_CATEGORIES, bounds, args.workers, 1, args.tile_depth,
+                                       **STREET_QUERY_OPTIONS):
+        builder.add(element)
+    
+    graph = builder.build()
+    os.makedirs(output_dir, exist_ok=True)
+    graph.save(graph_file)
+    print(f"Граф улиц: {len(graph)} узлов, {graph.edge_count} ребер, сохранен в файл {graph_file}")
+    return graph
+
+# Функция для расчета пешеходных расстояний между собранными местами
+def build_walking_distances(bounds: Bounds, args: argparse.Namespace, output_dir: str, output_file: str) -> None:
+    """Считает матрицу пешеходных расстояний и сохраняет ее рядом с файлом мест"""
+    graph = collect_street_graph(bounds, args, output_dir)
+    places = open_place_store(output_file)
+    
+    started = time.monotonic()
+    matrix = save_walking_matrix(places, graph, walking_matrix_path(output_file))
+    if matrix is None:
+        print(f"Мест больше {MAX_WALKING_PLACES}: матрица пешеходных расстояний не сохраняется, "
+              f"route_planner.py посчитает расстояния между кандидатами маршрута по графу")
+        return
+    print(f"Пешеходные расстояния между {len(places)} местами посчитаны за {time.monotonic() - started:.1f} с, "
+          f"недостижимых пар: {int((~np.isfinite(matrix)).sum())}")
+
+# Функция для сбора одного города
+def collect_city(city_name: str, args: argparse.Namespace, output_dir: str) -> None:
+    """Определяет границы города, собирает места и записывает их во все выходные файлы"""
+    output_file = places_file_for(output_dir)
+    
+    print(f"Получение границ города {city_name}...")
+    with metrics.stage("bounds", city=city_name):
+        bounds = get_city_bounds(city_name)
+    
+    state = load_sync_state(output_dir) if args.incremental else None
+    if state is not None and os.path.exists(output_file):
+        with metrics.stage("incremental", city=city_name):
+            update_city_incrementally(bounds, state, args, output_dir, output_file)
+    else:
+        collect_city_places(city_name, bounds, args, output_dir, output_file)
+    
+    if args.street_graph:
+        with metrics.stage("street_graph", city=city_name):
+            build_walking_distances(bounds, args, output_dir, output_file)
+
+# Функция для полного сбора мест города
+def collect_city_places(city_name: str, bounds: Bounds, args: argparse.Namespace, output_dir: str,
+                        output_file: str) -> None:
+    """Собирает все места города и записывает их во все выходные файлы"""
+    # Для инкрементального режима запоминаем время начала сбора
+    # и запрашиваем версии элементов
+    synced_at = datetime.now(timezone.utc) - SYNC_OVERLAP
+    query_options = {"output": "center meta"} if args.incremental else {}
+    
+    # Места проходят конвейер по одному и сразу записываются во все выходные файлы
+    classifier = PlaceClassifier(PLACE_CATEGORIES)
+    places = iter_city_places(bounds, args, classifier, **query_options)
+    versions: Dict[str, Optional[int]] = {}
+    if args.incremental:
+        places = track_versions(places, versions)
+    enricher = None
+    if args.enrich:
+        enricher = create_enricher(args.cache_dir, args.enrich_fixtures, args.workers, rate_limiter, retry_policy)
+        places = enricher(places)
+    if args.score:
+        places = score_places(places, args.beauty_model, refit=args.refit_model)
+    
+    with metrics.stage("collect", city=city_name) as stage:
+        count = write_records(map(process_place, places),
+                              create_sinks(args.outputs, output_dir, output_file, args.sql_format,
+                                           args.batch_size, args.database_url, args.load_method,
+                                           args.workers))
+        stage["elements"] = count
+    classifier.report()
+    if enricher is not None:
+        enricher.report()
+    print(f"Записано мест: {count}")
+    
+    if args.incremental:
+        save_sync_state(output_dir, synced_at, versions)
+
+# Функция для загрузки списка собранных городов
+def load_progress() -> Dict[str, str]:
+    """Возвращает собранные прошлым запуском города и время окончания их сбора"""
+    if not os.path.exists(PROGRESS_FILE):
+        return {}
+    
+    with open(PROGRESS_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)["cities"]
+
+# Функция для сохранения списка собранных городов
+def save_progress(progress: Dict[str, str]) -> None:
+    """Сохраняет список собранных городов (через временный файл)"""
+    os.makedirs(os.path.dirname(PROGRESS_FILE) or ".", exist_ok=True)
+    tmp_path = f"{PROGRESS_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"cities": progress}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, PROGRESS_FILE)
+
+# Функция для настройки обращений к внешним API
+def configure(args: argparse.Namespace, limiter: Optional[RateLimiter] = None) -> None:
+    """Задает адреса API, ограничитель частоты, повторы и кэш ответов по параметрам сборщика.
+    
+    limiter заменяет собственный ограничитель процесса, например общим
+    для нескольких процессов SharedRateLimiter.
+    """
+    global rate_limiter, response_cache, retry_policy, OVERPASS_API_URL, NOMINATIM_API_URL
+    OVERPASS_API_URL, NOMINATIM_API_URL = args.overpass_url, args.nominatim_url
+    rate_limiter = limiter or RateLimiter(args.rate, args.burst)
+    retry_policy = RetryPolicy(args.retries)
+    response_cache = None
+    if not args.no_cache:
+        response_cache = ResponseCache(args.cache_dir, args.cache_ttl * 3600,
+                                       args.cache_size * 1024 * 1024, args.offline)
+
+# Функция для сбора города с контрольной точкой
+def collect_city_resumable(city_name: str, args: argparse.Namespace, output_dir: str) -> None:
+    """Собирает город, сохраняя завершенные запросы в контрольную точку.
+    
+    Без --resume контрольная точка прошлого запуска удаляется. После
+    успешного сбора контрольная точка удаляется, при ошибке остается
+    на диске до следующего запуска с --resume.
+    """
+    global checkpoint
+    checkpoint_dir = os.path.join(output_dir, CHECKPOINT_DIR)
+    if not args.resume:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    if not args.no_checkpoint:
+        checkpoint = QueryCheckpoint(checkpoint_dir)
+        if len(checkpoint):
+            print(f"Продолжаем сбор: завершенных запросов в контрольной точке: {len(checkpoint)}")
+    
+    try:
+        collect_city(city_name, args, output_dir)
+        if checkpoint is not None:
+            if checkpoint.replayed:
+                print(f"Запросов, взятых из контрольной точки: {checkpoint.replayed}")
+            checkpoint.clear()
+    finally:
+        checkpoint = None
+
 # Основная функция
 def main():
-    try:
-        # Получаем границы Москвы
-        print("Получение границ Москвы...")
-        moscow_bbox = get_city_bbox("Москва, Россия")
-        
-        # Собираем места по категориям
-        all_places = []
-        
-        for category in PLACE_CATEGORIES:
-            print(f"Поиск мест категории {category['name']}...")
-            places = get_places_by_category(category, moscow_bbox)
-            print(f"Найдено {len(places)} мест категории {category['name']}")
-            all_places.extend(places)
+    args = parse_args()
+    configure(args)
+    metrics.script = "collect"
+    
+    # Без --resume сбор начинается заново
+    progress = load_progress() if args.resume else {}
+    failed = []
+    for city_name in args.cities:
+        if city_name in progress:
+            print(f"Город {city_name} уже собран {progress[city_name]}, пропускаем")
+            continue
         
-        print(f"Всего найдено {len(all_places)} мест")
+        try:
+            collect_city_resumable(city_name, args, get_city_output_dir(city_name, args.cities))
+        except Exception as e:
+            print(f"Ошибка при сборе мест города {city_name}: {e}")
+            failed.append(city_name)
+            continue
         
-        # Ограничиваем количество мест до 200
-        if len(all_places) > 200:
-            print(f"Ограничиваем количество мест до 200")
-            all_places = all_places[:200]
+        progress[city_name] = datetime.now().isoformat(timespec="seconds")
+        save_progress(progress)
+    
+    if response_cache is not None:
+        print(f"Кэш ответов: {response_cache.stats()}")
+    metrics.save(args.metrics, args.prometheus)
+    
+    if failed:
+        hint = "" if args.no_checkpoint else ", завершенные запросы сохранены: повторите запуск с --resume"
+        print(f"Не удалось собрать города: {', '.join(failed)}{hint}")
+        sys.exit(1)
+
+# Функция для загрузки состояния инкрементального сбора
+def load_sync_state(output_dir: str) -> Optional[Dict[str, Any]]:
+    """Загружает время последней синхронизации и версии известных элементов"""
+    state_file = os.path.join(output_dir, SYNC_STATE_FILE)
+    if not os.path.exists(state_file):
+        return None
+    
+    with open(state_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Функция для сохранения состояния инкрементального сбора
+def save_sync_state(output_dir: str, synced_at: datetime, versions: Dict[str, Optional[int]]) -> None:
+    """Сохраняет время синхронизации и версии элементов, попавших в результат"""
+    state = {
+        "last_sync": synced_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "elements": versions
+    }
+    
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, SYNC_STATE_FILE), "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+
+# Функция для получения идентификаторов всех актуальных мест области
+def fetch_present_ids(bounds: Bounds, max_queries: int = 1) -> set:
+    """Запрашивает только идентификаторы подходящих элементов (out ids).
+    
+    Запрос не кэшируется, а ошибки не подавляются: неполный список привел бы
+    к удалению существующих мест.
+    """
+    present = set()
+    
+    for query in plan_queries(PLACE_CATEGORIES, format_bbox(bounds), max_queries, output="ids"):
+        result = query_overpass(query, use_cache=False)
+        if "remark" in result:
+            raise RuntimeError(f"Неполный ответ Overpass API: {result['remark']}")
+        present.update(f"{e['type']}/{e['id']}" for e in result.get("elements", []))
+    
+    return present
+
+# Функция для инкрементального обновления данных города
+def update_city_incrementally(bounds: Bounds, state: Dict[str, Any], args: argparse.Namespace,
+                              output_dir: str, output_file: str) -> None:
+    """Загружает изменения с момента прошлой синхронизации и применяет их к результатам.
+    
+    Прошлые результаты читаются потоком в два прохода: сначала только
+    идентификаторы и координаты мест, затем записи по одной переписываются
+    в выходные файлы с примененными изменениями. В памяти держатся только
+    измененные места.
+    """
+    synced_at = datetime.now(timezone.utc) - SYNC_OVERLAP
+    versions: Dict[str, Optional[int]] = state["elements"]
+    
+    print(f"Поиск мест, измененных после {state['last_sync']}...")
+    classifier = PlaceClassifier(PLACE_CATEGORIES)
+    changed_places: Iterable[Dict[str, Any]] = iter_city_places(bounds, args, classifier, limit=0,
+                                                                newer=state["last_sync"], output="center meta")
+    enricher = None
+    if args.enrich:
+        enricher = create_enricher(args.cache_dir, args.enrich_fixtures, args.workers, rate_limiter, retry_policy)
+        changed_places = enricher(changed_places)
+    changed_places = list(changed_places)
+    classifier.report()
+    if enricher is not None:
+        enricher.report()
+    
+    print("Проверка удаленных мест...")
+    present = fetch_present_ids(bounds, args.queries)
+    deleted = [osm_id for osm_id in versions if osm_id not in present]
+    
+    # Координаты мест нужны для лимита и для плотности мест при расчете оценок
+    positions = {record["osm_id"]: (record["latitude"], record["longitude"])
+                 for record in iter_records(output_file)}
+    
+    # Применяем удаления и обновления; новые места добавляем, пока не
+    # достигнут лимит, обновленные сохраняют свою позицию в списке
+    for osm_id in deleted:
+        positions.pop(osm_id, None)
+        versions.pop(osm_id, None)
+    
+    updated: Dict[str, Dict[str, Any]] = {}
+    for place in changed_places:
+        osm_id = get_osm_id(place)
+        if osm_id not in versions and args.limit and len(positions) >= args.limit:
+            continue
+        if versions.get(osm_id) == place["version"] and osm_id in positions:
+            continue
         
-        # Обрабатываем и сохраняем данные
-        process_and_save_places(all_places, OUTPUT_FILE)
+        positions[osm_id] = (place["latitude"], place["longitude"])
+        versions[osm_id] = place["version"]
+        updated[osm_id] = place
+    
+    # Оценки измененных мест считаются так же, как при полном сборе;
+    # плотность - по всем местам города после изменений
+    if args.score and updated:
+        latitudes, longitudes = zip(*positions.values())
+        score_places(list(updated.values()), args.beauty_model, refit=args.refit_model,
+                     area=(latitudes, longitudes))
+    
+    upserts = {osm_id: process_place(place) for osm_id, place in updated.items()}
+    print(f"Обновлено или добавлено мест: {len(upserts)}, удалено: {len(deleted)}")
+    
+    def merged_records() -> Iterator[Dict[str, Any]]:
+        removed = set(deleted)
+        added = dict(upserts)
+        for record in iter_records(output_file):
+            if record["osm_id"] not in removed:
+                yield added.pop(record["osm_id"], record)
+        yield from added.values()
+    
+    # В базу данных уходят только изменения: upsert-ы и удаления. Загрузчик
+    # создаем первым: без базы данных нет смысла переписывать файлы
+    loader = None
+    if args.database_url:
+        loader = PostgresLoader(args.database_url, columns=PLACE_COLUMNS, method=args.load_method,
+                                chunk_size=args.batch_size, max_workers=args.workers)
+    
+    # Выходные файлы пишутся во временные и заменяют прошлые после чтения;
+    # JSON нужен всегда - из него читает следующий инкрементальный запуск
+    try:
+        write_records(merged_records(), create_sinks(list(args.outputs) + ["json"], output_dir, output_file,
+                                                     args.sql_format, args.batch_size))
+        generate_delta_sql_script(list(upserts.values()), deleted, os.path.join(output_dir, "delta_places.sql"))
+    except BaseException:
+        if loader is not None:
+            loader.discard()
+        raise
+    
+    if loader is not None:
+        loader.delete(deleted)
+        write_records(upserts.values(), [loader])
+    save_sync_state(output_dir, synced_at, versions)
+
+# Функция для экранирования строки в SQL
+def sql_quote(value: str) -> str:
+    """Возвращает строковый литерал SQL с экранированными кавычками"""
+    return "'" + value.replace("'", "''") + "'"
+
+# Функция для преобразования значения в литерал SQL
+def sql_literal(value: Any) -> str:
+    """Возвращает литерал SQL: None - NULL, bool - TRUE/FALSE, числа - без кавычек, строки - в кавычках"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, numbers.Real):
+        text = format_number(value)
+        return text if math.isfinite(value) else sql_quote(text)
+    return sql_quote(str(value))
+
+# Функция для формирования строки значений записи в SQL
+def sql_values(record: Dict[str, Any]) -> str:
+    """Возвращает значения столбцов PLACE_COLUMNS в виде (...) для VALUES"""
+    values = [sql_literal(record[column]) for column in PLACE_COLUMNS]
+    return f"({', '.join(values)})"
+
+# Функция для формирования условия upsert по идентификатору OSM
+def sql_upsert_clause() -> str:
+    """Возвращает ON CONFLICT, обновляющий все столбцы, кроме osm_id"""
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in PLACE_COLUMNS[1:])
+    return f"ON CONFLICT (osm_id) DO UPDATE SET {updates}"
+
+# Функция для генерации SQL-скрипта с инкрементальными изменениями
+def generate_delta_sql_script(records: List[Dict[str, Any]], deleted: List[str], sql_file: str) -> None:
+    """Генерирует SQL-скрипт с upsert-ами измененных мест и удалением исчезнувших"""
+    with open(sql_file, "w", encoding="utf-8") as f:
+        f.write("-- SQL-скрипт с изменениями мест с момента прошлой синхронизации\n")
+        f.write(f"-- Для базы без столбца places.osm_id сначала выполните {OSM_ID_MIGRATION}\n\n")
         
-        # Генерируем SQL-скрипт для добавления мест в базу данных
-        generate_sql_script(all_places)
+        for record in records:
+            f.write(f"""INSERT INTO places ({", ".join(PLACE_COLUMNS)})
+VALUES {sql_values(record)}
+{sql_upsert_clause()};
+""")
         
-    except Exception as e:
-        print(f"Ошибка: {e}")
+        if deleted:
+            f.write(f"DELETE FROM places WHERE osm_id IN ({', '.join(sql_quote(osm_id) for osm_id in deleted)});\n")
+    
+    print(f"SQL-скрипт с изменениями сохранен в файл {sql_file}")
 
 # Функция для генерации SQL-скрипта
-def generate_sql_script(places: List[Dict[str, Any]]) -> None:
+def generate_sql_script(places: Iterable[Dict[str, Any]],
+                        sql_file: str = os.path.join(OUTPUT_DIR, "insert_places.sql"),
+                        sql_format: str = "insert", batch_size: int = SQL_BATCH_SIZE) -> None:
     """Генерирует SQL-скрипт для добавления мест в базу данных"""
-    sql_file = os.path.join(OUTPUT_DIR, "insert_places.sql")
-    
-    with open(sql_file, "w", encoding="utf-8") as f:
-        f.write("-- SQL-скрипт для добавления мест в базу данных\n\n")
-        
-        for place in places:
-            # Экранируем одинарные кавычки в строках
-            name = place["name"].replace("'", "''")
-            description = place["description"].replace("'", "''")
-            image_url = place["image_url"].replace("'", "''")
-            
-            sql = f"""INSERT INTO places (name, description, type, latitude, longitude, estimated_time, image_url)
-VALUES ('{name}', '{description}', '{place["type"]}', {place["latitude"]}, {place["longitude"]}, {place["estimated_time"]}, '{image_url}');
-"""
-            f.write(sql)
-    
-    print(f"SQL-скрипт сохранен в файл {sql_file}")
+    write_records(map(process_place, places), [SqlSink(sql_file, sql_format, batch_size)])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+from urllib.parse import quote
+
+import requests
+
+from metrics import metrics
+from resilience import RateLimiter, RetryPolicy, CircuitBreaker, CircuitOpen
+from response_cache import DEFAULT_CACHE_DIR
+
+# Константы
+ENRICHMENT_CACHE_FILE = "enrichment.sqlite"
+MEMORY_CACHE = ":memory:"  # кэш SQLite в памяти - для ответов из файла, чтобы не смешивать их с настоящими
+ENRICH_WORKERS = 4
+ENRICH_CHUNK_SIZE = 500  # сколько мест потока обогащается за раз
+WIKIPEDIA_BATCH_SIZE = 20  # больше вступлений статей MediaWiki за один запрос не отдает
+WIKIDATA_BATCH_SIZE = 50
+DESCRIPTION_SENTENCES = 3
+DEFAULT_LANGUAGE = "ru"
+REQUEST_TIMEOUT = 30
+# Частота запросов при запуске из командной строки; сборщик передает свой
+# общий ограничитель, чтобы запросы к Википедии учитывались вместе с Overpass
+REQUESTS_PER_SECOND = 1.0
+RATE_LIMIT_BURST = 2
+WIKIPEDIA_API_URL = "https://{lang}.wikipedia.org/w/api.php"
+WIKIDATA_API_URL = "https://www.wikidata.org/w/api.php"
+COMMONS_FILE_URL = "https://commons.wikimedia.org/wiki/Special:FilePath/"
+LANGUAGE_PATTERN = re.compile(r"^[a-z]{2,3}(-[a-z]+)*$")
+
+# Функция для получения адреса изображения по тегу OSM
+def image_url_from_tag(value: str) -> str:
+    """Возвращает адрес изображения для тегов image и wikimedia_commons ("" - если адреса нет)"""
+    value = value.strip()
+    if value.startswith(("http://", "https://")):
+        return value
+    if value.startswith("File:"):
+        return commons_file_url(value[len("File:"):])
+    return ""
+
+# Функция для получения адреса файла Wikimedia Commons
+def commons_file_url(file_name: str) -> str:
+    """Возвращает адрес файла Commons по его имени"""
+    return COMMONS_FILE_URL + quote(file_name.strip().replace(" ", "_"))
+
+# Функция для разбора тега wikipedia
+def wikipedia_key(tags: Dict[str, str]) -> Optional[str]:
+    """Возвращает статью из тегов в виде "язык:Название" или None.
+
+    Поддерживаются wikipedia=ru:Название, wikipedia=Название (английская
+    статья по соглашению OSM) и wikipedia:ru=Название.
+    """
+    value = tags.get("wikipedia")
+    if value:
+        lang, _, title = value.partition(":")
+        if not title or not LANGUAGE_PATTERN.match(lang):
+            lang, title = "en", value
+    else:
+        lang = DEFAULT_LANGUAGE if f"wikipedia:{DEFAULT_LANGUAGE}" in tags else next(
+            (key[len("wikipedia:"):] for key in tags if key.startswith("wikipedia:")), None)
+        if lang is None:
+            return None
+        title = tags[f"wikipedia:{lang}"]
+    title = title.split("#")[0].strip()
+    return f"{lang}:{title}" if title else None
+
+# Постоянный кэш результатов обогащения
+class EnrichmentCache:
+    """Хранилище "ключ - значение" в SQLite.
+
+    Ключи вида wikipedia/ru:Название и wikidata/Q123, значения - словари
+    в JSON. Ненайденные статьи и сущности тоже сохраняются (пустым
+    словарем), поэтому каждый идентификатор запрашивается только один раз.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                        "resolved REAL NOT NULL)")
+        self.db.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Возвращает найденные в кэше значения"""
+        keys = list(keys)
+        found: Dict[str, Dict[str, Any]] = {}
+        with self.lock:
+            # SQLite ограничивает количество параметров запроса
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self.db.execute(f"SELECT key, value FROM items WHERE key IN ({','.join('?' * len(part))})",
+                                       part)
+                found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def put_many(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """Сохраняет значения одной транзакцией"""
+        now = time.time()
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO items (key, value, resolved) VALUES (?, ?, ?)",
+                                [(key, json.dumps(value, ensure_ascii=False), now) for key, value in items.items()])
+            self.db.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+# Источник данных Wikipedia и Wikidata
+class WikiBackend:
+    """Запрашивает вступления статей, изображения и описания через MediaWiki API.
+
+    Запросы проходят через ограничитель частоты rate_limiter и повторяются
+    по retry_policy; у Wikipedia и Wikidata свои выключатели. После ответа
+    429 ограничитель приостанавливает запросы всех потоков.
+    """
+
+    def __init__(self, timeout: float = REQUEST_TIMEOUT, rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter(REQUESTS_PER_SECOND, RATE_LIMIT_BURST)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breakers = {"wikipedia": CircuitBreaker("Wikipedia"), "wikidata": CircuitBreaker("Wikidata")}
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "CityStep-collector/1.0"
+
+    def _pause(self, error: BaseException, delay: float) -> None:
+        response = getattr(error, "response", None)
+        if response is not None and response.status_code == 429:
+            self.rate_limiter.pause(delay)
+
+    def _get(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        kind = "wikidata" if url == WIKIDATA_API_URL else "wikipedia"
+        with metrics.request(kind) as record:
+            def send() -> requests.Response:
+                self.rate_limiter.acquire()
+                response = self.session.get(url, params=dict(params, format="json", formatversion=2),
+                                            timeout=self.timeout)
+                record.update(status=response.status_code, bytes=record["bytes"] + len(response.content))
+                response.raise_for_status()
+                return response
+
+            return self.retry_policy.call(send, record, self.breakers[kind], on_retry=self._pause).json()
+
+    def wikipedia(self, lang: str, titles: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Возвращает для найденных статей описание (вступление) и адрес главного изображения"""
+        data = self._get(WIKIPEDIA_API_URL.format(lang=lang), {
+            "action": "query",
+            "prop": "extracts|pageimages",
+            "exintro": 1,
+            "explaintext": 1,
+            "exsentences": DESCRIPTION_SENTENCES,
+            "exlimit": "max",
+            "piprop": "original",
+            "redirects": 1,
+            "titles": "|".join(titles)
+        })
+        query = data.get("query", {})
+        # Запрошенное название может быть нормализовано и перенаправлено
+        aliases = {title: title for title in titles}
+        for step in ("normalized", "redirects"):
+            renamed = {item["from"]: item["to"] for item in query.get(step, [])}
+            aliases = {title: renamed.get(current, current) for title, current in aliases.items()}
+
+        pages = {page["title"]: page for page in query.get("pages", []) if not page.get("missing")}
+        result = {}
+        for title, current in aliases.items():
+            page = pages.get(current)
+            if page is not None:
+                result[title] = {"description": page.get("extract", "").strip(),
+                                 "image_url": page.get("original", {}).get("source", "")}
+        return result
+
+    def wikidata(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Возвращает для найденных сущностей описание, изображение (P18) и название статьи Wikipedia"""
+        data = self._get(WIKIDATA_API_URL, {
+            "action": "wbgetentities",
+            "ids": "|".join(ids),
+            "props": "descriptions|claims|sitelinks",
+            "languages": DEFAULT_LANGUAGE,
+            "sitefilter": f"{DEFAULT_LANGUAGE}wiki"
+        })
+        result = {}
+        for entity_id, entity in data.get("entities", {}).items():
+            if "missing" in entity:
+                continue
+            images = entity.get("claims", {}).get("P18", [])
+            image = images[0].get("mainsnak", {}).get("datavalue", {}).get("value", "") if images else ""
+            result[entity_id] = {
+                "description": entity.get("descriptions", {}).get(DEFAULT_LANGUAGE, {}).get("value", ""),
+                "image_url": commons_file_url(image) if image else "",
+                "wikipedia": entity.get("sitelinks", {}).get(f"{DEFAULT_LANGUAGE}wiki", {}).get("title", "")
+            }
+        return result
+
+# Источник данных из файла для работы без сети
+class FixtureBackend:
+    """Отдает заранее записанные ответы из JSON-файла.
+
+    Формат файла: {"wikipedia": {"ru:Название": {...}}, "wikidata": {"Q123": {...}}},
+    значения - такие же словари, как у WikiBackend. Запросы записываются в
+    self.requests, чтобы можно было проверить, что было запрошено.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            fixtures = json.load(f)
+        self.articles = fixtures.get("wikipedia", {})
+        self.entities = fixtures.get("wikidata", {})
+        self.requests: List[Tuple[str, List[str]]] = []
+        self.lock = threading.Lock()
+
+    def wikipedia(self, lang: str, titles: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            self.requests.append((f"wikipedia/{lang}", titles))
+        return {title: self.articles[f"{lang}:{title}"] for title in titles if f"{lang}:{title}" in self.articles}
+
+    def wikidata(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            self.requests.append(("wikidata", ids))
+        return {entity_id: self.entities[entity_id] for entity_id in ids if entity_id in self.entities}
+
+# Обогащение мест описаниями и изображениями
+class Enricher:
+    """Стадия конвейера: дополняет места описаниями и изображениями по тегам wikipedia, wikidata и image.
+
+    Поток мест обрабатывается частями по chunk_size: для части собираются
+    идентификаторы, которых нет в кэше, и запрашиваются пачками в пуле из
+    workers потоков. Сначала разрешаются сущности Wikidata (из них берутся
+    статьи Wikipedia для мест без тега wikipedia), затем статьи. Описание
+    заполняется, только если в тегах нет description и description:ru,
+    изображение - если его нет в тегах image и wikimedia_commons.
+    """
+
+    def __init__(self, backend, cache: EnrichmentCache, workers: int = ENRICH_WORKERS,
+                 chunk_size: int = ENRICH_CHUNK_SIZE):
+        self.backend = backend
+        self.cache = cache
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.fetched = 0
+        self.cached = 0
+        self.failed = 0
+        self.descriptions = 0
+        self.images = 0
+
+    def __call__(self, places: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        places = iter(places)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                chunk = list(islice(places, self.chunk_size))
+                if not chunk:
+                    return
+                self.enrich(chunk, executor)
+                yield from chunk
+
+    def resolve(self, kind: str, keys: Iterable[str], executor: ThreadPoolExecutor) -> Dict[str, Dict[str, Any]]:
+        """Возвращает значения для ключей вида kind/идентификатор из кэша, а недостающие запрашивает"""
+        keys = sorted(set(keys))
+        values = self.cache.get_many(f"{kind}/{key}" for key in keys)
+        self.cached += len(values)
+        missing = [key for key in keys if f"{kind}/{key}" not in values]
+
+        batches: List[Tuple[Optional[str], List[str]]] = []
+        if kind == "wikidata":
+            batches = [(None, missing[i:i + WIKIDATA_BATCH_SIZE]) for i in range(0, len(missing), WIKIDATA_BATCH_SIZE)]
+        else:
+            by_lang: Dict[str, List[str]] = {}
+            for key in missing:
+                lang, title = key.split(":", 1)
+                by_lang.setdefault(lang, []).append(title)
+            for lang, titles in by_lang.items():
+                batches.extend((lang, titles[i:i + WIKIPEDIA_BATCH_SIZE])
+                               for i in range(0, len(titles), WIKIPEDIA_BATCH_SIZE))
+
+        def fetch(batch: Tuple[Optional[str], List[str]]) -> Dict[str, Dict[str, Any]]:
+            lang, ids = batch
+            try:
+                if lang is None:
+                    found = self.backend.wikidata(ids)
+                else:
+                    found = {f"{lang}:{title}": value for title, value in self.backend.wikipedia(lang, ids).items()}
+                    ids = [f"{lang}:{title}" for title in ids]
+            except (requests.RequestException, CircuitOpen, ValueError) as e:
+                # Ненайденное из-за ошибки не кэшируется и будет запрошено при следующем запуске
+                print(f"Ошибка при запросе {kind} ({len(ids)} шт.): {e}")
+                self.failed += len(ids)
+                return {}
+            return {f"{kind}/{key}": found.get(key, {}) for key in ids}
+
+        resolved: Dict[str, Dict[str, Any]] = {}
+        for found in executor.map(fetch, batches):
+            resolved.update(found)
+        if resolved:
+            self.cache.put_many(resolved)
+            self.fetched += len(resolved)
+        values.update(resolved)
+        return {key: values[f"{kind}/{key}"] for key in keys if f"{kind}/{key}" in values}
+
+    def enrich(self, places: List[Dict[str, Any]], executor: ThreadPoolExecutor) -> None:
+        """Дополняет места части описаниями и изображениями"""
+        entities = self.resolve("wikidata", (place["tags"]["wikidata"] for place in places
+                                             if "wikidata" in place["tags"]), executor)
+
+        article_keys = []
+        for place in places:
+            key = wikipedia_key(place["tags"])
+            if key is None:
+                title = entities.get(place["tags"].get("wikidata"), {}).get("wikipedia")
+                if title:
+                    key = f"{DEFAULT_LANGUAGE}:{title}"
+            article_keys.append(key)
+        articles = self.resolve("wikipedia", (key for key in article_keys if key), executor)
+
+        for place, key in zip(places, article_keys):
+            tags = place["tags"]
+            article = articles.get(key, {}) if key else {}
+            entity = entities.get(tags.get("wikidata"), {})
+
+            if not place["description"] and "description:ru" not in tags:
+                description = article.get("description") or entity.get("description")
+                if description:
+                    place["description"] = description
+                    self.descriptions += 1
+
+            image_url = (image_url_from_tag(tags.get("image", "")) or
+                         image_url_from_tag(tags.get("wikimedia_commons", "")))
+            if not image_url:
+                image_url = article.get("image_url") or entity.get("image_url") or ""
+                self.images += bool(image_url)
+            place["image_url"] = image_url
+
+    def report(self) -> None:
+        """Выводит статистику обогащения"""
+        print(f"Обогащение: добавлено описаний {self.descriptions}, изображений {self.images}; "
+              f"запрошено {self.fetched}, из кэша {self.cached}, ошибок {self.failed}")
+
+# Функция для создания стадии обогащения
+def create_enricher(cache_dir: str = DEFAULT_CACHE_DIR, fixtures: Optional[str] = None,
+                    workers: int = ENRICH_WORKERS, rate_limiter: Optional[RateLimiter] = None,
+                    retry_policy: Optional[RetryPolicy] = None) -> Enricher:
+    """Создает стадию обогащения с кэшем в cache_dir.
+
+    Запросы к Wikipedia и Wikidata идут через rate_limiter и retry_policy
+    (по умолчанию - собственные).
+
+    С fixtures ответы берутся из файла, а не из сети, и кэш хранится только в
+    памяти: иначе статьи, которых нет в файле, попали бы в постоянный кэш как
+    ненайденные и больше никогда не запрашивались бы.
+    """
+    if fixtures:
+        return Enricher(FixtureBackend(fixtures), EnrichmentCache(MEMORY_CACHE), workers)
+    backend = WikiBackend(rate_limiter=rate_limiter, retry_policy=retry_policy)
+    return Enricher(backend, EnrichmentCache(os.path.join(cache_dir, ENRICHMENT_CACHE_FILE)), workers)
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает идентификаторы для проверки обогащения"""
+    parser = argparse.ArgumentParser(description="Описания и изображения мест по тегам wikipedia и wikidata")
+    parser.add_argument("--wikipedia", nargs="*", default=[], help="статьи в виде ru:Название")
+    parser.add_argument("--wikidata", nargs="*", default=[], help="сущности Wikidata, например Q123")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="директория кэша обогащения")
+    parser.add_argument("--fixtures", help="JSON-файл с записанными ответами вместо обращения к сети")
+    parser.add_argument("--workers", type=int, default=ENRICH_WORKERS, help="количество параллельных запросов")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="максимальное число запросов в секунду")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    enricher = create_enricher(args.cache_dir, args.fixtures, args.workers, RateLimiter(args.rate, RATE_LIMIT_BURST))
+    places = [{"name": key, "description": "", "image_url": "", "tags": {"wikipedia": key}}
+              for key in args.wikipedia]
+    places += [{"name": key, "description": "", "image_url": "", "tags": {"wikidata": key}} for key in args.wikidata]
+
+    for place in enricher(places):
+        print(json.dumps({key: place[key] for key in ("name", "description", "image_url")}, ensure_ascii=False))
+    enricher.report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from synthetic_data import DEFAULT_BOUNDS, synthetic_elements
+
+# Константы
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_COUNT = 10000
+WRITE_CHUNK_SIZE = 64 * 1024
+ERROR_CODES = [429, 502, 504]
+TIMEOUT_REMARK = 'runtime error: Query timed out in "query" at line 3 after 180 seconds.'
+
+# Оператор запроса Overpass в формате сборщика: nwr["key"~"^(a|b)$"]["name"](s,w,n,e)
+STATEMENT_PATTERN = re.compile(r'(nwr|node|way|relation)\["([^"]+)"~"\^\(([^)]*)\)\$"\]((?:\[[^\]]*\])*)'
+                               r'\((-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)\)')
+OUTPUT_PATTERN = re.compile(r"out ([a-z ]+);")
+
+# Набор элементов OSM, по которому отвечает сервер
+class OsmData:
+    """Элементы с индексом по тегам и массивами координат для быстрого отбора по bbox.
+
+    Каждый элемент заранее сериализуется во всех режимах вывода, поэтому
+    ответ собирается из готовых байтов. padding добавляет к каждому
+    элементу тег note такой длины, чтобы увеличить размер ответа.
+    """
+
+    def __init__(self, elements: List[Dict[str, Any]], padding: int = 0):
+        count = len(elements)
+        self.types = np.array([element["type"] for element in elements])
+        self.latitudes = np.empty(count)
+        self.longitudes = np.empty(count)
+        self.named = np.zeros(count, dtype=bool)
+        self.by_tag: Dict[Tuple[str, str], List[int]] = {}
+        self.center: List[bytes] = []
+        self.meta: List[bytes] = []
+        self.ids: List[bytes] = []
+
+        for i, element in enumerate(elements):
+            point = element.get("center", element)
+            self.latitudes[i], self.longitudes[i] = point.get("lat", np.nan), point.get("lon", np.nan)
+            tags = element.get("tags", {})
+            self.named[i] = "name" in tags
+            for tag in tags.items():
+                self.by_tag.setdefault(tag, []).append(i)
+
+            if padding:
+                element = dict(element, tags=dict(tags, note="x" * padding))
+            self.center.append(json.dumps(element, ensure_ascii=False).encode("utf-8"))
+            self.meta.append(json.dumps(dict(element, version=element.get("version", 1),
+                                             timestamp=element.get("timestamp", "2020-01-01T00:00:00Z")),
+                                        ensure_ascii=False).encode("utf-8"))
+            self.ids.append(json.dumps({"type": element["type"], "id": element["id"]}).encode("utf-8"))
+
+    def __len__(self) -> int:
+        return len(self.center)
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """Возвращает границы набора (south, west, north, east)"""
+        return (float(np.nanmin(self.latitudes)), float(np.nanmin(self.longitudes)),
+                float(np.nanmax(self.latitudes)), float(np.nanmax(self.longitudes)))
+
+    def select(self, query: str) -> Tuple[List[bytes], str]:
+        """Возвращает сериализованные элементы, подходящие под запрос, и режим вывода.
+
+        Поддерживаются запросы, которые строит plan_queries(): union из
+        операторов с регулярным выражением по значениям одного ключа, условием
+        ["name"] и bbox. Остальные условия на теги и фильтр newer
+        игнорируются (все элементы считаются измененными).
+        """
+        found = np.zeros(len(self), dtype=bool)
+        for selector, key, values, filters, *bbox in STATEMENT_PATTERN.findall(query):
+            south, west, north, east = map(float, bbox)
+            matches = np.zeros(len(self), dtype=bool)
+            for value in values.split("|"):
+                matches[self.by_tag.get((key, value), [])] = True
+            matches &= ((self.latitudes >= south) & (self.latitudes <= north) &
+                        (self.longitudes >= west) & (self.longitudes <= east))
+            if '["name"]' in filters:
+                matches &= self.named
+            if selector != "nwr":
+                matches &= self.types == selector
+            found |= matches
+
+        output = OUTPUT_PATTERN.search(query)
+        mode = output.group(1).strip() if output else "center"
+        serialized = self.ids if mode == "ids" else self.meta if "meta" in mode else self.center
+        return [serialized[i] for i in np.flatnonzero(found)], mode
+
+# Функция для загрузки элементов
+def load_elements(data_file: Optional[str], count: int, seed: int) -> List[Dict[str, Any]]:
+    """Читает записанный ответ Overpass API или генерирует синтетические элементы"""
+    if data_file:
+        with open(data_file, "r", encoding="utf-8") as f:
+            return json.load(f)["elements"]
+    return list(synthetic_elements(count, seed))
+
+# Локальный сервер вместо Overpass API и Nominatim
+class FakeOsmServer(ThreadingHTTPServer):
+    """HTTP-сервер, отвечающий на запросы сборщика к Overpass API и Nominatim.
+
+    Задержка ответа - latency секунд плюс случайная добавка до jitter,
+    скорость отдачи ограничивается bandwidth байт в секунду (0 - без
+    ограничения). С вероятностью error_rate запрос Overpass получает код
+    ошибки из error_codes (429 и 503 - с заголовком Retry-After), с
+    вероятностью remark_rate - неполный ответ с remark о таймауте.
+    Счетчики запросов доступны по адресу /stats.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], data: OsmData, bounds: Tuple[float, float, float, float],
+                 latency: float = 0.0, jitter: float = 0.0, bandwidth: float = 0.0, error_rate: float = 0.0,
+                 error_codes: Optional[List[int]] = None, remark_rate: float = 0.0, retry_after: int = 1,
+                 seed: int = 0, verbose: bool = False):
+        super().__init__(address, OsmRequestHandler)
+        self.data = data
+        self.city_bounds = bounds
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_codes = error_codes or ERROR_CODES
+        self.remark_rate = remark_rate
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "overpass": 0, "nominatim": 0, "errors": 0, "remarks": 0,
+                      "elements": 0, "bytes": 0, "active": 0, "max_active": 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, **values: int) -> None:
+        """Увеличивает счетчики статистики"""
+        with self.lock:
+            for name, value in values.items():
+                self.stats[name] += value
+            self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+
+    def draw(self) -> Tuple[float, float, int]:
+        """Возвращает случайные задержку, число для выбора неудачи и код ошибки"""
+        with self.lock:
+            return (self.latency + self.random.uniform(0, self.jitter), self.random.random(),
+                    self.random.choice(self.error_codes))
+
+# Обработчик запросов к локальному серверу
+class OsmRequestHandler(BaseHTTPRequestHandler):
+    """Отвечает на /api/interpreter (Overpass), /search (Nominatim) и /stats"""
+
+    protocol_version = "HTTP/1.1"
+    server: FakeOsmServer
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.endswith("/interpreter"):
+            self.handle_overpass(params.get("data", ""))
+        elif url.path.endswith("/search"):
+            self.handle_nominatim(params.get("q", ""))
+        elif url.path == "/stats":
+            with self.server.lock:
+                self.send_body(200, json.dumps(self.server.stats).encode("utf-8"))
+        else:
+            self.send_body(404, b'{"error": "not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if urlsplit(self.path).path.endswith("/interpreter"):
+            self.handle_overpass(form.get("data", [""])[0])
+        else:
+            self.send_body(404, b'{"error": "not found"}')
+
+    def handle_overpass(self, query: str) -> None:
+        """Отвечает на запрос Overpass с учетом задержки и внедренных ошибок"""
+        server = self.server
+        delay, chance, code = server.draw()
+        server.count(requests=1, overpass=1, active=1)
+        try:
+            time.sleep(delay)
+            if chance < server.error_rate:
+                server.count(errors=1)
+                headers = {"Retry-After": str(server.retry_after)} if code in (429, 503) else {}
+                self.send_body(code, f'{{"error": "injected {code}"}}'.encode("utf-8"), headers)
+                return
+
+            elements, _ = server.data.select(query)
+            remark = b""
+            if chance < server.error_rate + server.remark_rate:
+                # Overpass при таймауте отдает часть элементов и remark в конце ответа
+                server.count(remarks=1)
+                elements = elements[:len(elements) // 2]
+                remark = b',\n"remark": ' + json.dumps(TIMEOUT_REMARK).encode("utf-8")
+
+            body = b"".join([b'{"version": 0.6, "generator": "CityStep fake_osm_server", "elements": [\n',
+                             b",\n".join(elements), b"\n]", remark, b"}\n"])
+            server.count(elements=len(elements))
+            self.send_body(200, body)
+        finally:
+            server.count(active=-1)
+
+    def handle_nominatim(self, city: str) -> None:
+        """Возвращает границы набора данных для любого города"""
+        server = self.server
+        delay, _, _ = server.draw()
+        server.count(requests=1, nominatim=1)
+        time.sleep(delay)
+        south, west, north, east = server.city_bounds
+        result = [{
+            "display_name": city,
+            "lat": str((south + north) / 2),
+            "lon": str((west + east) / 2),
+            "boundingbox": [str(south), str(north), str(west), str(east)]
+        }]
+        self.send_body(200, json.dumps(result, ensure_ascii=False).encode("utf-8"))
+
+    def send_body(self, code: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        """Отправляет JSON-ответ, ограничивая скорость отдачи"""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        bandwidth = self.server.bandwidth
+        for start in range(0, len(body), WRITE_CHUNK_SIZE):
+            chunk = body[start:start + WRITE_CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+        self.server.count(bytes=len(body))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+# Функция для запуска сервера в фоновом потоке
+def start_server(data: OsmData, host: str = DEFAULT_HOST, port: int = 0, **options) -> FakeOsmServer:
+    """Запускает сервер в фоновом потоке (port=0 - любой свободный порт) и возвращает его"""
+    server = FakeOsmServer((host, port), data, options.pop("bounds", None) or data.bounds(), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры локального сервера"""
+    parser = argparse.ArgumentParser(description="Локальная замена Overpass API и Nominatim для офлайн-запусков и "
+                                                 "нагрузочных тестов сборщика")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="адрес сервера")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="порт сервера")
+    parser.add_argument("--data", help="записанный ответ Overpass API (JSON); без него элементы генерируются")
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT, help="количество синтетических элементов")
+    parser.add_argument("--seed", type=int, default=0, help="начальное значение генераторов случайных чисел")
+    parser.add_argument("--padding", type=int, default=0,
+                        help="сколько байт добавить к каждому элементу, чтобы увеличить размер ответов")
+    parser.add_argument("--bounds", type=float, nargs=4, metavar=("SOUTH", "WEST", "NORTH", "EAST"),
+                        help="границы, которые Nominatim возвращает для любого города (по умолчанию - границы данных)")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа в секундах")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке в секундах")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="скорость отдачи в КБ/с (0 - без ограничения)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов Overpass с кодом ошибки")
+    parser.add_argument("--error-codes", type=int, nargs="+", default=ERROR_CODES, help="коды внедряемых ошибок")
+    parser.add_argument("--remark-rate", type=float, default=0.0,
+                        help="доля неполных ответов Overpass (remark о таймауте)")
+    parser.add_argument("--retry-after", type=int, default=1, help="значение заголовка Retry-After для 429 и 503")
+    parser.add_argument("--verbose", action="store_true", help="выводить журнал запросов")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    elements = load_elements(args.data, args.count, args.seed)
+    data = OsmData(elements, args.padding)
+    bounds = tuple(args.bounds) if args.bounds else (DEFAULT_BOUNDS if not args.data else data.bounds())
+    server = FakeOsmServer((args.host, args.port), data, bounds, args.latency, args.jitter, args.bandwidth * 1024,
+                           args.error_rate, args.error_codes, args.remark_rate, args.retry_after, args.seed,
+                           args.verbose)
+
+    print(f"Сервер запущен на {server.url}, элементов: {len(data)}")
+    print(f"python collect_moscow_places.py --overpass-url {server.url}/api/interpreter "
+          f"--nominatim-url {server.url}/search --no-cache")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Статистика: {json.dumps(server.stats)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Константы
+READ_CHUNK_SIZE = 64 * 1024
+
+# Потоковый разбор JSON-объекта с большим массивом
+class JsonArrayStream:
+    """Разбирает JSON-объект вида {..., "elements": [...], ...} по частям.
+
+    Элементы массива array_key выдаются по одному по мере чтения потока,
+    поэтому в памяти одновременно находятся только текущий фрагмент текста
+    и один элемент. Остальные поля верхнего уровня (например, remark
+    в ответе Overpass) сохраняются в fields. При array_key=None поток - это
+    сам массив верхнего уровня ([...], как в файле мест).
+    """
+
+    def __init__(self, chunks: Iterable[bytes], array_key: Optional[str] = "elements"):
+        self.chunks = iter(chunks)
+        self.array_key = array_key
+        self.fields: Dict[str, Any] = {}
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self) -> bool:
+        """Дочитывает следующий фрагмент, возвращает False в конце потока"""
+        if self.eof:
+            return False
+
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk)
+            if text:
+                # Отбрасываем уже разобранную часть буфера
+                self.buffer = self.buffer[self.pos:] + text
+                self.pos = 0
+                return True
+
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b"", final=True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def _peek(self) -> str:
+        """Пропускает пробелы и возвращает следующий символ ("" в конце потока)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ""
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(f"Ожидался символ {char!r} на позиции {self.pos}")
+        self.pos += 1
+
+    def _value(self) -> Any:
+        """Разбирает одно значение JSON, при необходимости дочитывая поток"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Число на границе фрагмента могло быть прочитано не полностью,
+                # поэтому значение принимаем, только если за ним идет разделитель
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in " \t\r\n,]}:"):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+    def _array(self) -> Iterator[Any]:
+        """Выдает элементы массива, начинающегося в текущей позиции"""
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield self._value()
+            separator = self._peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"Ожидался символ ',' или ']' на позиции {self.pos - 1}")
+
+    def __iter__(self) -> Iterator[Any]:
+        if self.array_key is None:
+            yield from self._array()
+            if self._peek():
+                raise ValueError(f"Лишние данные после массива на позиции {self.pos}")
+            return
+
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self._value()
+            self._expect(":")
+
+            if key == self.array_key:
+                yield from self._array()
+            else:
+                self.fields[key] = self._value()
+
+            separator = self._peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Ожидался символ ',' или '}}' на позиции {self.pos - 1}")
+
+# Функция для чтения записей из JSON или JSON Lines
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Читает записи о местах из JSON-массива или файла JSON Lines по одной, не загружая файл целиком"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, "rb") as f:
+            yield from JsonArrayStream(iter(lambda: f.read(READ_CHUNK_SIZE), b""), array_key=None)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Константы
+MAP_MODES = ["auto", "scatter", "hexbin"]
+HEXBIN_THRESHOLD = 5000  # с какого количества мест режим auto рисует плотность
+HEXBIN_GRID_SIZE = 60
+MAX_LABELS = 30
+# Примерный размер подписи шрифтом 8 на карте 12x10 дюймов (в долях размера карты)
+LABEL_CHAR_WIDTH = 0.0065
+LABEL_HEIGHT = 0.025
+
+def use_hexbin(mode: str, count: int) -> bool:
+    """Определяет, рисовать ли карту плотности вместо отдельных точек"""
+    return mode == "hexbin" or (mode == "auto" and count >= HEXBIN_THRESHOLD)
+
+def scatter_by_type(ax, longitudes: np.ndarray, latitudes: np.ndarray, type_codes: np.ndarray,
+                    type_names: List[str], type_colors: Dict[str, str], sizes=30, alpha: float = 0.7,
+                    labeled: bool = True) -> None:
+    """Рисует места одним вызовом scatter на тип, цвет берется из type_colors.
+
+    sizes - общий размер маркера или массив размеров для каждого места.
+    labeled - подписывать ли типы для легенды.
+    """
+    sizes = np.broadcast_to(np.asarray(sizes, dtype=np.float64), np.shape(longitudes))
+
+    for code, type_name in enumerate(type_names):
+        mask = type_codes == code
+        if not mask.any():
+            continue
+        ax.scatter(longitudes[mask], latitudes[mask], c=type_colors.get(type_name, "gray"),
+                   s=sizes[mask], alpha=alpha, label=type_name if labeled else None)
+
+def declutter_labels(longitudes: np.ndarray, latitudes: np.ndarray, priority: np.ndarray, names=None,
+                     max_labels: int = MAX_LABELS) -> List[int]:
+    """Выбирает места для подписей: по убыванию priority, без наложения подписей.
+
+    Подпись рисуется слева от точки (ha='right'), ее прямоугольник
+    оценивается по длине названия в долях размера карты. Прямоугольники
+    раскладываются по сетке с шагом LABEL_HEIGHT, поэтому проверка каждого
+    места смотрит только ячейки под его подписью, а не все уже выбранные.
+    Названия (names) читаются только для проверяемых мест.
+    """
+    if len(longitudes) == 0:
+        return []
+
+    points = np.column_stack([longitudes, latitudes]).astype(np.float64)
+    span = points.max(axis=0) - points.min(axis=0)
+    points = (points - points.min(axis=0)) / np.where(span > 0, span, 1)
+
+    chosen: List[int] = []
+    boxes: Dict[tuple, List[tuple]] = {}
+    for index in np.argsort(-np.asarray(priority), kind="stable"):
+        x, y = points[index]
+        width = LABEL_CHAR_WIDTH * len(names[index]) if names is not None else LABEL_HEIGHT
+        box = (x - width, y - LABEL_HEIGHT / 2, x, y + LABEL_HEIGHT / 2)
+        left, bottom, right, top = (int(np.floor(edge / LABEL_HEIGHT)) for edge in box)
+        cells = [(cx, cy) for cx in range(left, right + 1) for cy in range(bottom, top + 1)]
+
+        if any(box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]
+               for cell in cells for other in boxes.get(cell, ())):
+            continue
+
+        chosen.append(int(index))
+        for cell in cells:
+            boxes.setdefault(cell, []).append(box)
+        if len(chosen) >= max_labels:
+            break
+
+    return chosen
+
+def draw_labels(ax, longitudes: np.ndarray, latitudes: np.ndarray, names: List[str], indexes: List[int],
+                fontsize: int = 8) -> None:
+    """Подписывает выбранные места"""
+    for index in indexes:
+        ax.text(longitudes[index], latitudes[index], names[index], fontsize=fontsize, ha='right')
+
+def draw_density(ax, longitudes: np.ndarray, latitudes: np.ndarray, values: Optional[np.ndarray] = None,
+                 label: str = "Количество мест", gridsize: int = HEXBIN_GRID_SIZE) -> None:
+    """Рисует карту плотности мест (hexbin); если заданы values - их среднее в ячейке"""
+    if values is None:
+        collection = ax.hexbin(longitudes, latitudes, gridsize=gridsize, mincnt=1, cmap="viridis")
+    else:
+        collection = ax.hexbin(longitudes, latitudes, C=values, reduce_C_function=np.mean,
+                               gridsize=gridsize, mincnt=1, cmap="viridis")
+    ax.figure.colorbar(collection, ax=ax, label=label)
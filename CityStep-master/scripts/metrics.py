@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Константы
+PROMETHEUS_PREFIX = "citystep"
+REQUEST_COUNTERS = ["bytes", "elements", "retries"]
+
+# Функция для определения пикового объема памяти процесса
+def peak_rss() -> Optional[int]:
+    """Возвращает максимальный с начала работы объем резидентной памяти процесса в байтах"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в килобайтах, в macOS - в байтах
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# Функция для определения текущего объема памяти процесса
+def current_rss() -> Optional[int]:
+    """Возвращает текущий объем резидентной памяти процесса в байтах (только Linux)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+# Сбор метрик запуска скрипта
+class Metrics:
+    """Время, объем данных, количество элементов, повторы и память по стадиям и запросам.
+
+    Стадия - крупный шаг скрипта (сбор города, построение карты), запрос -
+    одно обращение к внешнему API. Для стадии сохраняются время, объем
+    памяти в конце и пиковый объем памяти процесса к концу стадии, для
+    запроса - время, размер ответа, количество элементов, повторы и код
+    ответа. Запросы выполняются из рабочих потоков, поэтому записи
+    защищены блокировкой. Если метрики не сохраняются, накладные расходы -
+    несколько словарей на стадию и запрос.
+    """
+
+    def __init__(self, script: str = ""):
+        self.script = script
+        self.started = time.time()
+        self.started_monotonic = time.monotonic()
+        self.lock = threading.Lock()
+        self.stages: List[Dict[str, Any]] = []
+        self.requests: List[Dict[str, Any]] = []
+        self.counters: Dict[str, Dict[str, float]] = {}
+
+    def reset(self, script: str = "") -> None:
+        """Начинает сбор метрик заново (например, для следующего города в том же процессе)"""
+        with self.lock:
+            self.script = script
+            self.started = time.time()
+            self.started_monotonic = time.monotonic()
+            self.stages = []
+            self.requests = []
+            self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str, **labels: str) -> Iterator[Dict[str, Any]]:
+        """Замеряет стадию; в выданный словарь можно записать количество элементов (elements).
+
+        Байты и повторы запросов, завершившихся во время стадии, прибавляются
+        к ее счетчикам bytes и retries.
+        """
+        record: Dict[str, Any] = {"name": name, "labels": labels, "elements": 0, "bytes": 0, "retries": 0}
+        with self.lock:
+            first_request = len(self.requests)
+        started = time.monotonic()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = e.__class__.__name__
+            raise
+        finally:
+            record["seconds"] = round(time.monotonic() - started, 6)
+            record["rss_bytes"] = current_rss()
+            record["peak_rss_bytes"] = peak_rss()
+            with self.lock:
+                for request in self.requests[first_request:]:
+                    record["bytes"] += request["bytes"]
+                    record["retries"] += request["retries"]
+                self.stages.append(record)
+
+    @contextmanager
+    def request(self, kind: str, **labels: str) -> Iterator[Dict[str, Any]]:
+        """Замеряет запрос к API kind; в выданный словарь записываются bytes, elements, retries, status, cached"""
+        record: Dict[str, Any] = {"kind": kind, "labels": labels, "status": None, "cached": False,
+                                  "bytes": 0, "elements": 0, "retries": 0}
+        started = time.monotonic()
+        try:
+            yield record
+        except BaseException as e:
+            if record["status"] is None:
+                record["status"] = e.__class__.__name__
+            raise
+        finally:
+            record["seconds"] = round(time.monotonic() - started, 6)
+            with self.lock:
+                self.requests.append(record)
+
+    def count(self, kind: str, **values: float) -> None:
+        """Увеличивает произвольные счетчики (например, строки и повторы загрузки в Postgres)"""
+        with self.lock:
+            counters = self.counters.setdefault(kind, {})
+            for name, value in values.items():
+                counters[name] = counters.get(name, 0) + value
+
+    def request_totals(self) -> Dict[str, Dict[str, Any]]:
+        """Возвращает итоги запросов по видам API"""
+        totals: Dict[str, Dict[str, Any]] = {}
+        with self.lock:
+            for record in self.requests:
+                total = totals.setdefault(record["kind"], {"count": 0, "errors": 0, "cached": 0, "seconds": 0.0,
+                                                           **{name: 0 for name in REQUEST_COUNTERS}})
+                total["count"] += 1
+                total["cached"] += bool(record["cached"])
+                total["errors"] += not isinstance(record["status"], int) or record["status"] >= 400
+                total["seconds"] = round(total["seconds"] + record["seconds"], 6)
+                for name in REQUEST_COUNTERS:
+                    total[name] += record[name]
+        return totals
+
+    def summary(self) -> Dict[str, Any]:
+        """Возвращает сводку запуска для записи в JSON"""
+        with self.lock:
+            stages = list(self.stages)
+            requests = list(self.requests)
+            counters = {kind: dict(values) for kind, values in self.counters.items()}
+        return {
+            "script": self.script,
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "seconds": round(time.monotonic() - self.started_monotonic, 6),
+            "peak_rss_bytes": peak_rss(),
+            "stages": stages,
+            "requests": self.request_totals(),
+            "counters": counters,
+            "queries": requests
+        }
+
+    def prometheus(self) -> str:
+        """Возвращает метрики в текстовом формате Prometheus"""
+        summary = self.summary()
+        lines: List[str] = []
+
+        def metric(name: str, help_text: str, samples: Iterable[tuple]) -> None:
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if not samples:
+                return
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge")
+            for labels, value in samples:
+                labels = dict(labels, script=self.script)
+                text = ",".join(f'{key}="{escape_label(str(item))}"' for key, item in sorted(labels.items()))
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{text}}} {value}")
+
+        stage_labels = [dict(stage["labels"], stage=stage["name"]) for stage in summary["stages"]]
+        metric("run_seconds", "Run wall time in seconds", [({}, summary["seconds"])])
+        metric("peak_rss_bytes", "Peak resident memory of the process", [({}, summary["peak_rss_bytes"])])
+        for name, help_text in (("seconds", "Stage wall time in seconds"), ("elements", "Elements processed by stage"),
+                                ("bytes", "Bytes transferred by stage"), ("retries", "Retries during stage"),
+                                ("peak_rss_bytes", "Peak resident memory at the end of stage")):
+            metric(f"stage_{name}", help_text,
+                   [(labels, stage[name]) for labels, stage in zip(stage_labels, summary["stages"])])
+
+        totals = summary["requests"]
+        for name, help_text in (("count", "Requests to external API"), ("errors", "Failed requests"),
+                                ("cached", "Requests answered from cache"), ("seconds", "Total request time in seconds"),
+                                ("bytes", "Response bytes"), ("elements", "Elements received"),
+                                ("retries", "Request retries")):
+            metric(f"requests_{name}", help_text, [({"api": kind}, total[name]) for kind, total in totals.items()])
+
+        for kind, counters in summary["counters"].items():
+            for name, value in counters.items():
+                metric(f"{kind}_{name}", f"{kind} {name}", [({}, value)])
+        return "\n".join(lines) + "\n"
+
+    def save(self, json_file: Optional[str] = None, prometheus_file: Optional[str] = None) -> None:
+        """Сохраняет сводку в JSON и (или) метрики в формате Prometheus"""
+        for path, text in ((json_file, lambda: json.dumps(self.summary(), ensure_ascii=False, indent=2)),
+                           (prometheus_file, self.prometheus)):
+            if not path:
+                continue
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text())
+            os.replace(tmp_path, path)
+            print(f"Метрики сохранены в файл {path}")
+
+# Функция для экранирования значения метки Prometheus
+def escape_label(value: str) -> str:
+    """Экранирует обратную косую черту, перевод строки и кавычки"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Функция для подсчета байтов в потоке
+def count_bytes(chunks: Iterable[bytes], record: Dict[str, Any]) -> Iterator[bytes]:
+    """Пропускает фрагменты ответа дальше, добавляя их размер к record["bytes"]"""
+    for chunk in chunks:
+        record["bytes"] += len(chunk)
+        yield chunk
+
+# Метрики текущего процесса: скрипты задают script и сохраняют их в конце работы
+metrics = Metrics()
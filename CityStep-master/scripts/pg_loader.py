@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import io
+import math
+import numbers
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Any, Optional, Iterable
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+from json_stream import iter_records
+from metrics import metrics
+from resilience import RetryPolicy, RETRY_STATUSES
+
+# Константы
+DEFAULT_TABLE = "places"
+# Столбцы таблицы places, которые заполняет сбор
+PLACE_COLUMNS = ["osm_id", "name", "description", "type", "latitude", "longitude", "estimated_time", "image_url"]
+LOAD_METHODS = ["copy", "values"]
+CHUNK_SIZE = 1000
+MAX_WORKERS = 2
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0  # в секундах, удваивается с каждой попыткой
+
+# Политика повторов транзакций Postgres
+class TransactionRetryPolicy(RetryPolicy):
+    """Повторяет транзакцию при обрыве соединения, взаимоблокировке и ошибке сериализации"""
+
+    @staticmethod
+    def is_retryable(error: BaseException, retry_statuses: Iterable[int] = RETRY_STATUSES) -> bool:
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError,
+                                  psycopg2.extensions.TransactionRollbackError))
+
+# Загрузка записей напрямую в Postgres
+class PostgresLoader:
+    """Загружает поток записей в таблицу Postgres пачками через пул соединений.
+
+    Записи накапливаются в пачки по chunk_size строк, каждая пачка загружается
+    в отдельной транзакции одним из рабочих потоков. Способы загрузки:
+    - copy - COPY во временную таблицу и перенос в основную через upsert;
+    - values - многострочные INSERT ... ON CONFLICT (execute_values).
+    В обоих случаях конфликт по key_column обновляет запись, поэтому пачку
+    можно безопасно повторить после временной ошибки (обрыв соединения,
+    взаимоблокировка, ошибка сериализации). Одновременно в памяти находится
+    не больше двух пачек на рабочий поток.
+    """
+
+    def __init__(self, dsn: str, table: str = DEFAULT_TABLE, columns: Optional[List[str]] = None,
+                 key_column: str = "osm_id", method: str = "copy", chunk_size: int = CHUNK_SIZE,
+                 max_workers: int = MAX_WORKERS, max_retries: int = MAX_RETRIES):
+        if psycopg2 is None:
+            raise RuntimeError("Для загрузки в Postgres нужен пакет psycopg2: pip install psycopg2-binary")
+        if method not in LOAD_METHODS:
+            raise ValueError(f"Неизвестный способ загрузки: {method}")
+
+        self.table = table
+        self.columns = columns or PLACE_COLUMNS
+        self.key_column = key_column
+        self.method = method
+        self.chunk_size = max(1, chunk_size)
+        self.retry_policy = TransactionRetryPolicy(max_retries, RETRY_DELAY)
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, max_workers, dsn)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_workers * 2)
+        self.futures: List[Future] = []
+        self.chunk: List[tuple] = []
+        self.deleted: List[Any] = []
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.retries = 0
+        self.started = time.monotonic()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Добавляет запись в текущую пачку и отправляет пачку на загрузку, когда она заполнится"""
+        self.chunk.append(tuple(record[column] for column in self.columns))
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Отправляет накопленную пачку на загрузку"""
+        if not self.chunk:
+            return
+
+        chunk, self.chunk = self.chunk, []
+        # Ждем, пока освободится место, чтобы не копить пачки в памяти
+        self.slots.acquire()
+        future = self.executor.submit(self._load_chunk, chunk)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        self._check_errors()
+
+    def _check_errors(self) -> None:
+        """Пробрасывает ошибку уже завершенных загрузок"""
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def _load_chunk(self, chunk: List[tuple]) -> None:
+        """Загружает пачку в одной транзакции"""
+        self._transaction(self._copy_chunk if self.method == "copy" else self._insert_chunk, chunk)
+        with self.lock:
+            self.rows += len(chunk)
+        metrics.count("postgres", rows=len(chunk))
+
+    def _transaction(self, work, chunk: list) -> None:
+        """Выполняет work(cursor, chunk) в одной транзакции, повторяя ее при временных ошибках"""
+        def attempt() -> None:
+            conn = self.pool.getconn()
+            broken = False
+            try:
+                with conn:
+                    with conn.cursor() as cursor:
+                        work(cursor, chunk)
+            except Exception:
+                broken = conn.closed != 0
+                raise
+            finally:
+                self.pool.putconn(conn, close=broken)
+
+        self.retry_policy.call(attempt, on_retry=self._count_retry)
+
+    def _count_retry(self, error: BaseException, delay: float) -> None:
+        with self.lock:
+            self.retries += 1
+        metrics.count("postgres", retries=1)
+
+    def _upsert_sql(self, source: str) -> str:
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in self.columns if column != self.key_column)
+        return (f"INSERT INTO {self.table} ({', '.join(self.columns)}) {source} "
+                f"ON CONFLICT ({self.key_column}) DO UPDATE SET {updates}")
+
+    def _copy_chunk(self, cursor, chunk: List[tuple]) -> None:
+        """COPY пачки во временную таблицу и upsert из нее в основную"""
+        buffer = io.StringIO()
+        buffer.writelines(csv_line(row) for row in chunk)
+        buffer.seek(0)
+
+        columns = ", ".join(self.columns)
+        cursor.execute(f"CREATE TEMP TABLE load_{self.table} (LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY load_{self.table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(self._upsert_sql(f"SELECT {columns} FROM load_{self.table}"))
+
+    def _insert_chunk(self, cursor, chunk: List[tuple]) -> None:
+        """Многострочные INSERT ... ON CONFLICT для пачки"""
+        psycopg2.extras.execute_values(cursor, self._upsert_sql("VALUES %s"), chunk, page_size=len(chunk))
+
+    def _delete_keys(self, cursor, keys: list) -> None:
+        """Удаляет записи с ключами из пачки"""
+        cursor.execute(f"DELETE FROM {self.table} WHERE {self.key_column} = ANY(%s)", (keys,))
+
+    def delete(self, keys: Iterable[Any]) -> None:
+        """Запоминает ключи записей, которые удаляются из таблицы при закрытии загрузчика"""
+        self.deleted.extend(keys)
+
+    def close(self) -> None:
+        """Загружает остаток, удаляет отмеченные записи, дожидается всех пачек и выводит скорость загрузки"""
+        try:
+            self.flush()
+            for future in self.futures:
+                future.result()
+            if self.deleted:
+                self._transaction(self._delete_keys, self.deleted)
+        finally:
+            self.executor.shutdown(wait=True)
+            self.pool.closeall()
+
+        elapsed = time.monotonic() - self.started
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        print(f"Загружено в Postgres {self.rows} строк за {elapsed:.1f} с ({rate:.0f} строк/с), "
+              f"удалено: {len(self.deleted)}, повторов: {self.retries}")
+
+    def discard(self) -> None:
+        """Прекращает загрузку; уже загруженные пачки остаются в базе, отмеченные записи не удаляются"""
+        self.chunk = []
+        self.deleted = []
+        for future in self.futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        self.pool.closeall()
+
+# Функция для записи числа в SQL и CSV
+def format_number(value: numbers.Real) -> str:
+    """Возвращает число текстом; NaN и бесконечности - в виде NaN, Infinity и -Infinity, как их понимает Postgres"""
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return repr(value)
+
+# Функция для формирования строки CSV для COPY
+def csv_line(row: Iterable[Any]) -> str:
+    """Возвращает строку CSV: None - пустое значение без кавычек (NULL), строки - в кавычках.
+
+    csv.writer с QUOTE_NONNUMERIC заключает в кавычки и пустое значение
+    вместо None, а пустая строка в кавычках для COPY - это не NULL.
+    """
+    fields = []
+    for value in row:
+        if value is None:
+            fields.append("")
+        elif isinstance(value, bool):
+            fields.append("true" if value else "false")
+        elif isinstance(value, numbers.Real):
+            fields.append(format_number(value))
+        else:
+            fields.append('"' + str(value).replace('"', '""') + '"')
+    return ",".join(fields) + "\n"
+
+# Функция для загрузки записей в базу данных
+def load_records(records: Iterable[Dict[str, Any]], loader: PostgresLoader) -> int:
+    """Передает записи загрузчику и возвращает их количество"""
+    count = 0
+    try:
+        for record in records:
+            loader.write(record)
+            count += 1
+    except BaseException:
+        loader.discard()
+        raise
+
+    loader.close()
+    return count
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры загрузки"""
+    parser = argparse.ArgumentParser(description="Загрузка собранных мест в Postgres")
+    parser.add_argument("files", nargs="+", help="файлы с местами в формате JSON или JSON Lines")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help="строка подключения к Postgres (по умолчанию из DATABASE_URL)")
+    parser.add_argument("--method", choices=LOAD_METHODS, default="copy",
+                        help="способ загрузки: copy или values (многострочные INSERT)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="количество строк в одной транзакции")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="количество параллельных соединений")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="сколько раз повторять пачку при временной ошибке")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    if not args.database_url:
+        print("Не задана строка подключения: укажите --database-url или DATABASE_URL")
+        return
+
+    loader = PostgresLoader(args.database_url, method=args.method, chunk_size=args.chunk_size,
+                            max_workers=args.workers, max_retries=args.retries)
+    records = (record for path in args.files for record in iter_records(path))
+    load_records(records, loader)
+
+if __name__ == "__main__":
+    main()
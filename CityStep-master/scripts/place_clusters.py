@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import time
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from place_store import PlaceStore
+from spatial_index import SpatialIndex, haversine_distance, open_spatial_index, spatial_index_for
+
+# Константы
+CLUSTER_RADIUS = 300.0  # в метрах: места ближе этого расстояния считаются соседями
+MIN_CLUSTER_PLACES = 5  # сколько соседей (включая само место) нужно ядру района
+LABELS_FILE = "cluster_labels.npy"
+NOISE = -1
+
+# Функция для кластеризации мест
+def dbscan(index: SpatialIndex, latitudes: np.ndarray, longitudes: np.ndarray,
+           eps: float = CLUSTER_RADIUS, min_samples: int = MIN_CLUSTER_PLACES) -> np.ndarray:
+    """Кластеризация DBSCAN: возвращает номер района для каждого места (NOISE - вне районов).
+
+    Соседи всех мест находятся пакетным запросом к пространственному индексу.
+    Место с не меньше чем min_samples соседями в радиусе eps - ядро района;
+    район - ядра, связанные цепочками соседей, и их соседи. Районы
+    нумеруются в порядке первого ядра.
+    """
+    neighbours = index.query_radius(latitudes, longitudes, eps)
+    core = np.array([len(found) >= min_samples for found in neighbours], dtype=bool)
+    labels = np.full(len(neighbours), NOISE, dtype=np.int32)
+
+    cluster = 0
+    for seed in np.flatnonzero(core):
+        if labels[seed] != NOISE:
+            continue
+
+        labels[seed] = cluster
+        stack = [seed]
+        while stack:
+            found = neighbours[stack.pop()]
+            new = found[labels[found] == NOISE]
+            labels[new] = cluster
+            stack.extend(new[core[new]].tolist())
+        cluster += 1
+
+    return labels
+
+# Функция для расчета статистики по районам
+def cluster_stats(places: PlaceStore, labels: np.ndarray) -> List[Dict[str, Any]]:
+    """Возвращает статистику районов по убыванию количества мест.
+
+    Для каждого района: количество мест, количество по типам, средняя оценка
+    красоты (если она есть в хранилище), центр и радиус - расстояние от
+    центра до самого дальнего места в метрах.
+    """
+    count = int(labels.max()) + 1 if len(labels) else 0
+    if not count:
+        return []
+
+    member = labels != NOISE
+    codes = labels[member]
+    latitudes = np.asarray(places["latitude"], dtype=np.float64)[member]
+    longitudes = np.asarray(places["longitude"], dtype=np.float64)[member]
+
+    sizes = np.bincount(codes, minlength=count)
+    center_lat = np.bincount(codes, weights=latitudes, minlength=count) / sizes
+    center_lon = np.bincount(codes, weights=longitudes, minlength=count) / sizes
+    radius = np.zeros(count)
+    np.maximum.at(radius, codes, haversine_distance(latitudes, longitudes, center_lat[codes], center_lon[codes]))
+
+    type_names = places.labels("type")
+    type_codes = np.asarray(places["type"], dtype=np.int64)[member]
+    type_counts = np.bincount(codes * len(type_names) + type_codes,
+                              minlength=count * len(type_names)).reshape(count, len(type_names))
+
+    mean_beauty = None
+    if "beauty_score" in places:
+        beauty = np.asarray(places["beauty_score"], dtype=np.float64)[member]
+        mean_beauty = np.bincount(codes, weights=beauty, minlength=count) / sizes
+
+    stats = []
+    for cluster in np.argsort(-sizes, kind="stable"):
+        stats.append({
+            "id": int(cluster),
+            "count": int(sizes[cluster]),
+            "types": {type_names[i]: int(type_counts[cluster, i])
+                      for i in np.argsort(-type_counts[cluster], kind="stable") if type_counts[cluster, i]},
+            "mean_beauty": round(float(mean_beauty[cluster]), 2) if mean_beauty is not None else None,
+            "centroid": [round(float(center_lat[cluster]), 6), round(float(center_lon[cluster]), 6)],
+            "radius": round(float(radius[cluster]), 1)
+        })
+    return stats
+
+# Функция для кластеризации мест хранилища
+def find_clusters(places: PlaceStore, index: Optional[SpatialIndex] = None, eps: float = CLUSTER_RADIUS,
+                  min_samples: int = MIN_CLUSTER_PLACES) -> Dict[str, Any]:
+    """Делит места на районы и сохраняет номера районов в директорию хранилища.
+
+    Возвращает параметры кластеризации, количество мест вне районов
+    и статистику районов (результат пригоден для записи в JSON).
+    """
+    if index is None:
+        index = spatial_index_for(places)
+
+    labels = dbscan(index, places["latitude"], places["longitude"], eps, min_samples)
+    path = os.path.join(places.path, LABELS_FILE)
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, labels)
+    os.replace(tmp_path, path)
+
+    return {
+        "eps": eps,
+        "min_samples": min_samples,
+        "noise": int((labels == NOISE).sum()),
+        "clusters": cluster_stats(places, labels)
+    }
+
+# Функция для открытия номеров районов
+def open_cluster_labels(places: PlaceStore) -> Optional[np.ndarray]:
+    """Возвращает номера районов мест, посчитанные find_clusters(), или None"""
+    path = os.path.join(places.path, LABELS_FILE)
+    if not os.path.exists(path):
+        return None
+    labels = np.load(path, mmap_mode="r")
+    return labels if len(labels) == len(places) else None
+
+# Функция для сохранения статистики районов
+def save_clusters(result: Dict[str, Any], path: str) -> None:
+    """Сохраняет результат find_clusters() в JSON-файл"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры кластеризации"""
+    parser = argparse.ArgumentParser(description="Разбиение мест на пешеходные районы (DBSCAN)")
+    parser.add_argument("input", help="файл с местами в формате JSON или JSON Lines")
+    parser.add_argument("--radius", type=float, default=CLUSTER_RADIUS, help="радиус соседства в метрах")
+    parser.add_argument("--min-places", type=int, default=MIN_CLUSTER_PLACES,
+                        help="минимальное количество мест рядом с ядром района")
+    parser.add_argument("--output", help="JSON-файл для статистики районов")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    places, index = open_spatial_index(args.input)
+
+    started = time.monotonic()
+    result = find_clusters(places, index, args.radius, args.min_places)
+    print(f"Найдено районов: {len(result['clusters'])}, мест вне районов: {result['noise']} "
+          f"({time.monotonic() - started:.2f} с)")
+    for cluster in result["clusters"][:10]:
+        print(f"  Район {cluster['id']}: {cluster['count']} мест, радиус {cluster['radius']:.0f} м")
+
+    if args.output:
+        save_clusters(result, args.output)
+        print(f"Статистика районов сохранена в файл {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import shutil
+import time
+from array import array
+from typing import List, Dict, Any, Optional, Iterable
+
+import numpy as np
+
+from json_stream import iter_records
+
+# Константы
+STORE_VERSION = 2
+STORE_SUFFIX = ".store"
+
+# Схема хранилища: столбец -> вид хранения. Поля записей, которых нет
+# в схеме (например, tags), не сохраняются
+FLOAT_COLUMNS = ["latitude", "longitude", "beauty_score", "popularity", "historical_value", "architectural_value"]
+INT_COLUMNS = ["estimated_time"]
+CATEGORY_COLUMNS = ["type"]
+SET_COLUMNS = ["best_time"]
+STRING_COLUMNS = ["id", "osm_id", "name", "description", "image_url"]
+
+# Сколько разных значений вмещают коды категорий (uint8) и битовые маски наборов (uint32)
+LABEL_LIMITS = {"category": 256, "set": 32}
+
+# Типы элементов array для буферов записи и соответствующие типы NumPy
+ARRAY_TYPES = {"float": ("f", np.float32), "int": ("i", np.int32), "category": ("B", np.uint8),
+               "set": ("I", np.uint32), "codes": ("B", np.uint8), "offsets": ("q", np.int64)}
+
+# Функция для определения вида хранения столбца
+def column_kind(name: str) -> Optional[str]:
+    """Возвращает вид хранения столбца или None, если столбец не хранится"""
+    for kind, columns in (("float", FLOAT_COLUMNS), ("int", INT_COLUMNS), ("category", CATEGORY_COLUMNS),
+                          ("set", SET_COLUMNS), ("string", STRING_COLUMNS)):
+        if name in columns:
+            return kind
+    return None
+
+# Функция для получения пути к хранилищу рядом с JSON-файлом
+def store_path_for(json_file: str) -> str:
+    """Возвращает путь к директории хранилища для файла data/moscow_places.json"""
+    return os.path.splitext(json_file)[0] + STORE_SUFFIX
+
+# Потоковая запись хранилища
+class PlaceStoreWriter:
+    """Записывает места в столбцовое хранилище по одной записи.
+
+    Хранилище - это директория с файлами столбцов:
+    - числа - .npy (координаты и оценки float32, время int32);
+    - категории (type) - коды uint8, названия категорий в meta.json;
+    - наборы (best_time) - битовые маски uint32 для быстрых проверок
+      и подсчетов, а также коды значений uint8 в исходном порядке
+      (.codes.npy) со смещениями (.offsets.npy);
+    - строки - общий буфер UTF-8 (.data.bin) и смещения (.offsets.npy).
+    Числовые столбцы накапливаются в компактных массивах array, строки сразу
+    пишутся в файл. Результат появляется только после close().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.count = 0
+        self.kinds: Optional[Dict[str, str]] = None
+        self.buffers: Dict[str, array] = {}
+        self.labels: Dict[str, List[str]] = {}
+        self.label_codes: Dict[str, Dict[str, int]] = {}
+        self.set_codes: Dict[str, array] = {}
+        self.set_offsets: Dict[str, array] = {}
+        self.string_files = {}
+        self.string_sizes: Dict[str, int] = {}
+
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+
+    def _init_columns(self, record: Dict[str, Any]) -> None:
+        """Определяет состав столбцов по первой записи"""
+        self.kinds = {name: column_kind(name) for name in record if column_kind(name)}
+        for name, kind in self.kinds.items():
+            if kind == "string":
+                self.string_files[name] = open(os.path.join(self.tmp_path, f"{name}.data.bin"), "wb")
+                self.string_sizes[name] = 0
+                self.buffers[name] = array(ARRAY_TYPES["offsets"][0], [0])
+            else:
+                self.buffers[name] = array(ARRAY_TYPES[kind][0])
+                if kind in ("category", "set"):
+                    self.labels[name] = []
+                    self.label_codes[name] = {}
+                if kind == "set":
+                    self.set_codes[name] = array(ARRAY_TYPES["codes"][0])
+                    self.set_offsets[name] = array(ARRAY_TYPES["offsets"][0], [0])
+
+    def _label_code(self, name: str, label: str) -> int:
+        codes = self.label_codes[name]
+        code = codes.get(label)
+        if code is None:
+            limit = LABEL_LIMITS[self.kinds[name]]
+            if len(codes) >= limit:
+                raise ValueError(f"Слишком много значений в столбце {name}: больше {limit}")
+            code = codes[label] = len(codes)
+            self.labels[name].append(label)
+        return code
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Добавляет запись в хранилище"""
+        if self.kinds is None:
+            self._init_columns(record)
+
+        for name, kind in self.kinds.items():
+            value = record.get(name)
+            if kind == "string":
+                data = (value or "").encode("utf-8")
+                self.string_files[name].write(data)
+                self.string_sizes[name] += len(data)
+                self.buffers[name].append(self.string_sizes[name])
+            elif kind == "float":
+                self.buffers[name].append(float("nan") if value is None else value)
+            elif kind == "int":
+                self.buffers[name].append(value or 0)
+            elif kind == "category":
+                self.buffers[name].append(self._label_code(name, value or ""))
+            else:
+                codes = [self._label_code(name, label) for label in value or ()]
+                mask = 0
+                for code in codes:
+                    mask |= 1 << code
+                self.buffers[name].append(mask)
+                self.set_codes[name].extend(codes)
+                self.set_offsets[name].append(len(self.set_codes[name]))
+
+        self.count += 1
+
+    def close(self) -> None:
+        """Дописывает столбцы и метаданные и атомарно заменяет прошлое хранилище"""
+        for name, buffer in self.buffers.items():
+            kind = self.kinds[name]
+            if kind == "string":
+                self.string_files[name].close()
+                np.save(os.path.join(self.tmp_path, f"{name}.offsets.npy"),
+                        np.frombuffer(buffer, dtype=ARRAY_TYPES["offsets"][1]))
+            else:
+                np.save(os.path.join(self.tmp_path, f"{name}.npy"), np.frombuffer(buffer, dtype=ARRAY_TYPES[kind][1]))
+            if kind == "set":
+                np.save(os.path.join(self.tmp_path, f"{name}.codes.npy"),
+                        np.frombuffer(self.set_codes[name], dtype=ARRAY_TYPES["codes"][1]))
+                np.save(os.path.join(self.tmp_path, f"{name}.offsets.npy"),
+                        np.frombuffer(self.set_offsets[name], dtype=ARRAY_TYPES["offsets"][1]))
+
+        meta = {
+            "version": STORE_VERSION,
+            "count": self.count,
+            "columns": self.kinds or {},
+            "labels": self.labels
+        }
+        with open(os.path.join(self.tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self) -> None:
+        """Удаляет недописанное хранилище"""
+        for f in self.string_files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+# Строковый столбец хранилища
+class StringColumn:
+    """Строки, которые декодируются из отображенного в память буфера по запросу"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.data[start:end]).decode("utf-8")
+
+    def tolist(self) -> List[str]:
+        """Декодирует все строки столбца"""
+        text = bytes(self.data)
+        offsets = self.offsets.tolist()
+        return [text[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+# Чтение хранилища
+class PlaceStore:
+    """Столбцовое хранилище мест, открытое через отображение файлов в память.
+
+    Числовые столбцы возвращаются как массивы NumPy без копирования,
+    строки декодируются только при обращении к ним.
+    """
+
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        self.mmap_mode = "r" if mmap else None
+
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["version"] != STORE_VERSION:
+            raise ValueError(f"Неподдерживаемая версия хранилища {path}: {meta['version']}")
+
+        self.count: int = meta["count"]
+        self.kinds: Dict[str, str] = meta["columns"]
+        self.label_names: Dict[str, List[str]] = meta["labels"]
+        self.cache: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.kinds
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # При передаче в другой процесс столбцы не копируются:
+        # там они заново отображаются в память при первом обращении
+        state = self.__dict__.copy()
+        state["cache"] = {}
+        return state
+
+    def _load(self, file_name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, file_name), mmap_mode=self.mmap_mode)
+
+    def __getitem__(self, name: str):
+        """Возвращает столбец: массив NumPy, коды категорий, битовые маски или StringColumn"""
+        if name not in self.cache:
+            if name not in self.kinds:
+                raise KeyError(f"В хранилище нет столбца {name}")
+
+            if self.kinds[name] == "string":
+                data_file = os.path.join(self.path, f"{name}.data.bin")
+                # Пустой файл нельзя отобразить в память
+                if os.path.getsize(data_file) and self.mmap_mode:
+                    data = np.memmap(data_file, dtype=np.uint8, mode="r")
+                else:
+                    data = np.fromfile(data_file, dtype=np.uint8)
+                self.cache[name] = StringColumn(data, self._load(f"{name}.offsets.npy"))
+            else:
+                self.cache[name] = self._load(f"{name}.npy")
+
+        return self.cache[name]
+
+    def set_values(self, name: str, index: int) -> List[str]:
+        """Возвращает значения набора места в исходном порядке"""
+        key = f"{name}.codes"
+        if key not in self.cache:
+            self.cache[key] = (self._load(f"{name}.codes.npy").tolist(), self._load(f"{name}.offsets.npy"))
+        codes, offsets = self.cache[key]
+        labels = self.labels(name)
+        return [labels[code] for code in codes[offsets[index]:offsets[index + 1]]]
+
+    def labels(self, name: str) -> List[str]:
+        """Возвращает названия значений категориального столбца или набора"""
+        return self.label_names[name]
+
+    def decode(self, name: str) -> np.ndarray:
+        """Возвращает значения категориального столбца в виде массива строк"""
+        return np.array(self.labels(name), dtype=object)[self[name]]
+
+    def has_label(self, name: str, label: str) -> np.ndarray:
+        """Возвращает маску мест, у которых набор name содержит label"""
+        labels = self.labels(name)
+        if label not in labels:
+            return np.zeros(self.count, dtype=bool)
+        return (self[name] & (1 << labels.index(label))) != 0
+
+    def value_counts(self, name: str) -> List[tuple]:
+        """Возвращает (значение, количество) по убыванию количества, как Counter.most_common().
+
+        Для наборов (best_time) место учитывается в каждом своем значении.
+        """
+        labels = self.labels(name)
+        if self.kinds[name] == "category":
+            counts = np.bincount(self[name], minlength=len(labels))
+        else:
+            counts = np.array([self.has_label(name, label).sum() for label in labels], dtype=np.int64)
+
+        # Значения хранятся в порядке первого появления, поэтому устойчивая
+        # сортировка дает тот же порядок при равных количествах, что и Counter
+        order = np.argsort(-counts, kind="stable")
+        return [(labels[i], int(counts[i])) for i in order if counts[i] > 0]
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """Собирает одну запись в виде словаря"""
+        index = int(index)
+        result = {}
+        for name, kind in self.kinds.items():
+            value = self[name][index]
+            if kind == "category":
+                value = self.labels(name)[value]
+            elif kind == "set":
+                value = self.set_values(name, index)
+            elif kind == "float":
+                # Кратчайшая десятичная запись float32: 9.8 остается 9.8, а не 9.800000190734863
+                value = float(str(value))
+            elif kind == "int":
+                value = value.item()
+            result[name] = value
+        return result
+
+# Функция для записи хранилища из потока записей
+def write_place_store(records: Iterable[Dict[str, Any]], path: str) -> int:
+    """Записывает записи в хранилище и возвращает их количество"""
+    writer = PlaceStoreWriter(path)
+    try:
+        for record in records:
+            writer.write(record)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+    return writer.count
+
+# Функция для чтения версии хранилища
+def store_version(meta_file: str) -> Optional[int]:
+    """Возвращает версию формата хранилища из meta.json"""
+    with open(meta_file, "r", encoding="utf-8") as f:
+        return json.load(f).get("version")
+
+# Функция для открытия хранилища, соответствующего JSON-файлу
+def open_place_store(json_file: str) -> PlaceStore:
+    """Открывает хранилище рядом с JSON-файлом.
+
+    Если хранилища нет, JSON-файл новее или хранилище записано другой
+    версией, хранилище пересобирается из JSON.
+    """
+    path = store_path_for(json_file)
+    meta_file = os.path.join(path, "meta.json")
+
+    if os.path.exists(json_file) and (not os.path.exists(meta_file)
+                                      or os.path.getmtime(meta_file) < os.path.getmtime(json_file)
+                                      or store_version(meta_file) != STORE_VERSION):
+        write_place_store(iter_records(json_file), path)
+    elif not os.path.exists(meta_file):
+        raise FileNotFoundError(f"Файл {json_file} не найден")
+
+    return PlaceStore(path)
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры преобразования"""
+    parser = argparse.ArgumentParser(description="Преобразование мест из JSON в столбцовое хранилище")
+    parser.add_argument("input", help="файл с местами в формате JSON или JSON Lines")
+    parser.add_argument("output", nargs="?", help="директория хранилища (по умолчанию рядом с файлом)")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    output = args.output or store_path_for(args.input)
+
+    started = time.monotonic()
+    count = write_place_store(iter_records(args.input), output)
+    print(f"Записано {count} мест в хранилище {output} за {time.monotonic() - started:.2f} с")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Callable, Iterable, Tuple, TypeVar
+
+import requests
+
+# Константы
+MAX_RETRIES = 5
+BASE_DELAY = 1.0  # в секундах, удваивается с каждой попыткой
+MAX_DELAY = 120.0
+MAX_RETRY_AFTER = 600.0  # дольше этого не ждем, даже если сервер просит
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+FAILURE_THRESHOLD = 5  # неудачных попыток подряд, после которых выключатель размыкается
+RESET_TIMEOUT = 60.0  # в секундах: через столько выключатель пропускает пробный запрос
+CHECKPOINT_MANIFEST = "queries.jsonl"
+
+T = TypeVar("T")
+
+class CircuitOpen(Exception):
+    """Выключатель разомкнут: сервис недавно отказывал подряд, запросы к нему не выполняются"""
+
+# Функция для определения паузы, которую просит сервер
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Возвращает значение заголовка Retry-After ответа с ошибкой в секундах или None.
+
+    Заголовок может содержать число секунд или дату в формате HTTP.
+    """
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Ограничитель частоты запросов к внешним API
+class RateLimiter:
+    """Ограничивает частоту запросов по алгоритму token bucket"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Блокирует поток, пока в корзине не появится свободный токен"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Не выдает токены ближайшие seconds секунд, после паузы корзина пуста"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            # Корзина начинает наполняться только после паузы
+            self.tokens = 0.0
+            self.updated = self.paused_until
+
+# Ограничитель частоты запросов, общий для нескольких процессов
+class SharedRateLimiter(RateLimiter):
+    """Тот же token bucket, но состояние корзины хранится в разделяемой памяти.
+
+    Объект создается в основном процессе и передается в рабочие процессы
+    при их запуске (например, через initializer пула), после чего все
+    процессы расходуют токены из одной корзины. Время берется из
+    time.monotonic(), общего для процессов одной машины.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        # Токены, время последнего пополнения и время окончания паузы
+        self.state = multiprocessing.Array("d", [float(self.capacity), time.monotonic(), 0.0])
+        self.lock = self.state.get_lock()
+
+    tokens = property(lambda self: self.state[0], lambda self, value: self.state.__setitem__(0, value))
+    updated = property(lambda self: self.state[1], lambda self, value: self.state.__setitem__(1, value))
+    paused_until = property(lambda self: self.state[2], lambda self, value: self.state.__setitem__(2, value))
+
+# Автоматический выключатель запросов к одному сервису
+class CircuitBreaker:
+    """Прекращает обращения к сервису после failure_threshold неудач подряд.
+
+    Пока выключатель разомкнут, запросы сразу завершаются ошибкой CircuitOpen,
+    а не ждут таймаутов и повторов. Через reset_timeout секунд пропускается
+    один пробный запрос: если он успешен, выключатель замыкается, если нет -
+    снова размыкается. Остальные потоки на время пробного запроса ждут его
+    результата.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.condition = threading.Condition()
+
+    def before(self) -> None:
+        """Вызывается перед запросом; выбрасывает CircuitOpen, если запрос выполнять нельзя"""
+        with self.condition:
+            while True:
+                if self.state == "closed":
+                    return
+                if self.state == "open":
+                    remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                    if remaining > 0:
+                        raise CircuitOpen(f"{self.name} недоступен после {self.failures} неудач подряд, "
+                                          f"следующая попытка через {remaining:.0f} с")
+                    self.state = "half_open"
+                if not self.trial:
+                    self.trial = True
+                    return
+                self.condition.wait()
+
+    def is_open(self) -> bool:
+        """Проверяет, разомкнут ли выключатель"""
+        with self.condition:
+            return self.state == "open"
+
+    def success(self) -> None:
+        """Отмечает успешный ответ сервиса"""
+        with self.condition:
+            self.state = "closed"
+            self.failures = 0
+            self.trial = False
+            self.condition.notify_all()
+
+    def release(self) -> None:
+        """Отпускает пробный запрос, не меняя состояние (ошибка не связана с сервисом)"""
+        with self.condition:
+            self.trial = False
+            self.condition.notify_all()
+
+    def failure(self) -> None:
+        """Отмечает неудачу; после failure_threshold неудач подряд или неудачной пробы размыкает выключатель"""
+        with self.condition:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"{self.name}: {self.failures} неудач подряд, запросы приостановлены "
+                          f"на {self.reset_timeout:.0f} с")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self.trial = False
+            self.condition.notify_all()
+
+# Политика повторов запросов
+class RetryPolicy:
+    """Повторяет запросы при временных ошибках с экспоненциальной задержкой.
+
+    Временными считаются ошибки соединения, обрывы ответа и коды из
+    retry_statuses; таймаут чтения приравнивается к коду 504. Задержка
+    удваивается с каждой попыткой (со случайным разбросом, чтобы потоки
+    не повторяли запросы одновременно), но не меньше значения Retry-After.
+    """
+
+    def __init__(self, max_retries: int = MAX_RETRIES, base_delay: float = BASE_DELAY,
+                 max_delay: float = MAX_DELAY, seed: Optional[int] = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def is_retryable(error: BaseException, retry_statuses: Iterable[int] = RETRY_STATUSES) -> bool:
+        """Проверяет, имеет ли смысл повторить запрос после ошибки"""
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and error.response.status_code in retry_statuses
+        if isinstance(error, (requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+            return True
+        if isinstance(error, requests.Timeout):
+            return 504 in retry_statuses
+        return False
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """Возвращает задержку перед повтором номер attempt (с нуля)"""
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        backoff = self.random.uniform(backoff / 2, backoff)
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            backoff = max(backoff, min(retry_after, MAX_RETRY_AFTER))
+        return backoff
+
+    def call(self, function: Callable[[], T], record: Optional[Dict[str, Any]] = None,
+             breaker: Optional[CircuitBreaker] = None, retry_statuses: Iterable[int] = RETRY_STATUSES,
+             on_retry: Optional[Callable[[BaseException, float], None]] = None) -> T:
+        """Выполняет function, повторяя ее при временных ошибках.
+
+        Повторы прибавляются к record["retries"] (запись метрик запроса).
+        on_retry вызывается перед ожиданием с ошибкой и задержкой. Ошибка
+        последней попытки и постоянные ошибки выбрасываются дальше, как и
+        ошибка, после которой разомкнулся выключатель: ждать повтора
+        бесполезно.
+        """
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before()
+            try:
+                result = function()
+            except Exception as e:
+                retryable = self.is_retryable(e, retry_statuses)
+                if breaker is not None:
+                    if retryable:
+                        breaker.failure()
+                    elif isinstance(e, requests.HTTPError) and e.response is not None:
+                        # Постоянная ошибка HTTP (например, 400) значит, что сервис отвечает
+                        breaker.success()
+                    else:
+                        # Локальные ошибки (разбор ответа, получатель элементов) о сервисе
+                        # ничего не говорят и состояние выключателя не меняют
+                        breaker.release()
+                if not retryable or attempt >= self.max_retries or (breaker is not None and breaker.is_open()):
+                    raise
+                delay = self.delay(attempt, e)
+                if record is not None:
+                    record["retries"] += 1
+                if on_retry is not None:
+                    on_retry(e, delay)
+                print(f"Временная ошибка ({describe_error(e)}), повтор {attempt + 1} из {self.max_retries} "
+                      f"через {delay:.1f} с")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if breaker is not None:
+                breaker.success()
+            return result
+
+# Функция для краткого описания ошибки запроса
+def describe_error(error: BaseException) -> str:
+    """Возвращает код ответа или название класса ошибки"""
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        return f"HTTP {response.status_code}"
+    return error.__class__.__name__
+
+# Контрольные точки сбора
+class QueryCheckpoint:
+    """Сохраняет на диск элементы завершенных запросов, чтобы прерванный сбор можно было продолжить.
+
+    Элементы каждого запроса пишутся во временный файл по мере получения
+    и переносятся в директорию контрольной точки, только когда запрос
+    завершен; затем запрос добавляется в журнал queries.jsonl. Журнал только
+    дописывается, поэтому аварийное завершение теряет не больше одной
+    незаконченной строки. Повторный запуск получает элементы завершенных
+    запросов из файлов, не обращаясь к сети.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.queries: Dict[str, Dict[str, Any]] = {}
+        self.replayed = 0
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = os.path.join(directory, CHECKPOINT_MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # строка, недописанная при аварийном завершении
+                    if os.path.exists(self._path(entry["key"])):
+                        self.queries[entry["key"]] = entry
+
+    @staticmethod
+    def make_key(query: str) -> str:
+        """Возвращает ключ запроса: хэш его текста"""
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jsonl")
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+    def replay(self, query: str, sink: Callable[[Dict[str, Any]], None]) -> Optional[Tuple[int, bool]]:
+        """Передает в sink сохраненные элементы запроса.
+
+        Возвращает количество элементов и признак полноты ответа или None,
+        если запрос еще не завершался.
+        """
+        entry = self.queries.get(self.make_key(query))
+        if entry is None:
+            return None
+        with open(self._path(entry["key"]), "r", encoding="utf-8") as f:
+            for line in f:
+                sink(json.loads(line))
+        with self.lock:
+            self.replayed += 1
+        return entry["count"], entry["complete"]
+
+    def writer(self, query: str) -> "CheckpointWriter":
+        """Возвращает запись элементов одного запроса"""
+        return CheckpointWriter(self, self.make_key(query))
+
+    def commit(self, key: str, tmp_path: str, count: int, complete: bool) -> None:
+        """Переносит файл элементов завершенного запроса и добавляет запрос в журнал"""
+        os.replace(tmp_path, self._path(key))
+        entry = {"key": key, "count": count, "complete": complete}
+        with self.lock:
+            with open(os.path.join(self.directory, CHECKPOINT_MANIFEST), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.queries[key] = entry
+
+    def clear(self) -> None:
+        """Удаляет контрольную точку (после успешного завершения сбора)"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.queries.clear()
+
+# Запись элементов одного запроса в контрольную точку
+class CheckpointWriter:
+    """Пропускает элементы в sink, параллельно сохраняя их во временный файл.
+
+    Если запрос повторяется после обрыва ответа, элементы прерванной попытки
+    остаются в файле; получатели элементов и так пропускают повторы.
+    """
+
+    def __init__(self, checkpoint: QueryCheckpoint, key: str):
+        self.checkpoint = checkpoint
+        self.key = key
+        self.tmp_path = os.path.join(checkpoint.directory, f"{key}.{threading.get_ident()}.tmp")
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+
+    def wrap(self, sink: Callable[[Dict[str, Any]], None]) -> Callable[[Dict[str, Any]], None]:
+        """Возвращает sink, который сначала сохраняет элемент"""
+        def save(element: Dict[str, Any]) -> None:
+            self.file.write(json.dumps(element, ensure_ascii=False) + "\n")
+            sink(element)
+        return save
+
+    def commit(self, count: int, complete: bool) -> None:
+        """Отмечает запрос завершенным"""
+        self.file.close()
+        self.checkpoint.commit(self.key, self.tmp_path, count, complete)
+
+    def discard(self) -> None:
+        """Удаляет временный файл незавершенного запроса"""
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
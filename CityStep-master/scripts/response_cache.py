@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# Константы
+DEFAULT_CACHE_DIR = os.path.join("data", "cache")
+DEFAULT_TTL = 24 * 60 * 60  # в секундах
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+class CacheMiss(Exception):
+    """Ответа нет в кэше, а обращение к сети запрещено (офлайн-режим)"""
+
+# Кэш HTTP-ответов на диске
+class ResponseCache:
+    """Хранит тела ответов внешних API в файлах, адресуемых хэшем запроса.
+
+    Индекс (размер, время создания и последнего обращения) хранится в SQLite,
+    поэтому кэш можно использовать из нескольких потоков и процессов.
+    Записи старше ttl считаются устаревшими, а при превышении max_bytes
+    удаляются записи, к которым дольше всего не обращались (LRU).
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), timeout=30, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def make_key(url: str, query: str) -> str:
+        """Возвращает ключ записи: хэш адреса и текста запроса"""
+        return hashlib.sha256(f"{url}\n{query}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.body")
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Возвращает путь к файлу ответа или None, если записи нет или она устарела"""
+        with self.lock:
+            row = self.db.execute("SELECT created FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            path = self._path(key)
+
+            if row is None or (not self.offline and now - row[0] > self.ttl):
+                # В офлайн-режиме устаревшая запись лучше, чем никакой
+                self.misses += 1
+                return None
+
+            if not os.path.exists(path):
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.db.commit()
+                self.misses += 1
+                return None
+
+            self.db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+            return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Возвращает тело ответа или None, если записи нет или она устарела"""
+        path = self.get_path(key)
+        if path is None:
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Запись могли вытеснить из другого процесса
+            return None
+
+    def new_temp_path(self, key: str) -> str:
+        """Возвращает путь временного файла для потоковой записи ответа"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def put(self, key: str, body: bytes) -> None:
+        """Сохраняет тело ответа и при необходимости освобождает место"""
+        # Пишем во временный файл и переименовываем, чтобы параллельные
+        # читатели никогда не увидели недописанный ответ
+        tmp_path = self.new_temp_path(key)
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        self.put_file(key, tmp_path)
+
+    def put_file(self, key: str, tmp_path: str) -> None:
+        """Переносит полностью записанный временный файл в кэш"""
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, self._path(key))
+
+        with self.lock:
+            now = time.time()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, size, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, size, now, now)
+            )
+            self.db.commit()
+            self._evict()
+
+    def _evict(self) -> None:
+        """Удаляет устаревшие записи и самые давние, пока кэш больше лимита"""
+        expired = self.db.execute(
+            "SELECT key FROM entries WHERE created < ?", (time.time() - self.ttl,)
+        ).fetchall()
+        for (key,) in expired:
+            self._remove(key)
+
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= size
+
+        self.db.commit()
+
+    def _remove(self, key: str) -> None:
+        self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> str:
+        """Возвращает краткую статистику обращений к кэшу"""
+        return f"попаданий: {self.hits}, промахов: {self.misses}"
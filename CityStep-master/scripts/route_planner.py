@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import time
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+import numpy as np
+
+from place_clusters import open_cluster_labels
+from place_store import PlaceStore
+from spatial_index import SpatialIndex, haversine_distance, open_spatial_index
+from street_graph import StreetGraph, GRAPH_FILE, open_walking_matrix, walking_matrix, walking_matrix_path
+
+# Константы
+DATA_DIR = "data"
+INPUT_FILE = os.path.join(DATA_DIR, "moscow_places.json")
+WALKING_SPEED = 5.0  # км/ч, как в api/routes/generate
+MATRIX_FILE = "distance_matrix.npy"
+MAX_MATRIX_PLACES = 5000  # для больших наборов матрица считается только по кандидатам
+MAX_CANDIDATES = 2000
+MATRIX_BLOCK = 512  # строк матрицы за один шаг расчета
+
+# Функция для расчета матрицы расстояний
+def distance_matrix(latitudes: np.ndarray, longitudes: np.ndarray,
+                    to_latitudes: Optional[np.ndarray] = None, to_longitudes: Optional[np.ndarray] = None
+                    ) -> np.ndarray:
+    """Возвращает матрицу расстояний по прямой в метрах (float32).
+
+    Строки считаются блоками по MATRIX_BLOCK, чтобы промежуточные массивы
+    не занимали памяти больше, чем сама матрица.
+    """
+    if to_latitudes is None:
+        to_latitudes, to_longitudes = latitudes, longitudes
+    latitudes, longitudes = np.asarray(latitudes), np.asarray(longitudes)
+    to_latitudes, to_longitudes = np.asarray(to_latitudes), np.asarray(to_longitudes)
+
+    result = np.empty((len(latitudes), len(to_latitudes)), dtype=np.float32)
+    for start in range(0, len(latitudes), MATRIX_BLOCK):
+        rows = slice(start, start + MATRIX_BLOCK)
+        result[rows] = haversine_distance(latitudes[rows, None], longitudes[rows, None],
+                                          to_latitudes[None, :], to_longitudes[None, :])
+    return result
+
+# Функция для открытия матрицы расстояний между всеми местами
+def open_distance_matrix(places: PlaceStore) -> Optional[np.ndarray]:
+    """Открывает (при необходимости считает) матрицу расстояний между местами хранилища.
+
+    Матрица хранится в директории хранилища и отображается в память.
+    Для наборов больше MAX_MATRIX_PLACES возвращает None: тогда расстояния
+    считаются только между кандидатами конкретного маршрута.
+    """
+    if len(places) > MAX_MATRIX_PLACES:
+        return None
+
+    path = os.path.join(places.path, MATRIX_FILE)
+    if not os.path.exists(path):
+        matrix = distance_matrix(places["latitude"], places["longitude"])
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, path)
+
+    return np.load(path, mmap_mode="r")
+
+# Функция для построения маршрута жадными вставками
+def insert_greedy(times: np.ndarray, service: np.ndarray, scores: np.ndarray, budget: float,
+                  route: List[int], visited: np.ndarray) -> float:
+    """Добавляет в маршрут места с лучшим отношением ценности к добавленному времени.
+
+    На каждом шаге для всех непосещенных мест и всех позиций вставки сразу
+    считается прирост времени (дорога + осмотр), выбирается лучшая вставка,
+    которая укладывается в бюджет. route и visited изменяются на месте,
+    возвращается новое общее время маршрута.
+    """
+    total = route_time(times, service, route)
+    while True:
+        candidates = np.flatnonzero(~visited)
+        if not len(candidates):
+            return total
+
+        prev, nxt = np.array(route[:-1]), np.array(route[1:])
+        added = (times[np.ix_(prev, candidates)].T + times[np.ix_(candidates, nxt)]
+                 - times[prev, nxt][None, :] + service[candidates, None])
+        feasible = total + added <= budget
+        if not feasible.any():
+            return total
+
+        ratio = np.where(feasible, scores[candidates, None] / np.maximum(added, 1e-6), -np.inf)
+        row, position = np.unravel_index(np.argmax(ratio), ratio.shape)
+        route.insert(position + 1, int(candidates[row]))
+        visited[candidates[row]] = True
+        total += added[row, position]
+
+# Функция для расчета времени маршрута
+def route_time(times: np.ndarray, service: np.ndarray, route: List[int]) -> float:
+    """Возвращает время маршрута: дорога между соседними точками и осмотр мест"""
+    nodes = np.array(route)
+    return float(times[nodes[:-1], nodes[1:]].sum() + service[nodes].sum())
+
+# Функция для улучшения маршрута перестановкой 2-opt
+def improve_two_opt(times: np.ndarray, route: List[int]) -> bool:
+    """Разворачивает участки маршрута, пока это сокращает дорогу (начало и конец не меняются)"""
+    improved = False
+    while len(route) > 3:
+        nodes = np.array(route)
+        i, j = np.triu_indices(len(route) - 1, k=1)
+        keep = i >= 1
+        i, j = i[keep], j[keep]
+        # Разворот route[i..j]: ребра (i-1, i) и (j, j+1) заменяются на (i-1, j) и (i, j+1)
+        delta = (times[nodes[i - 1], nodes[j]] + times[nodes[i], nodes[j + 1]]
+                 - times[nodes[i - 1], nodes[i]] - times[nodes[j], nodes[j + 1]])
+        best = np.argmin(delta)
+        if delta[best] >= -1e-6:
+            break
+        route[i[best]:j[best] + 1] = route[i[best]:j[best] + 1][::-1]
+        improved = True
+    return improved
+
+# Функция для улучшения маршрута переносом участков (or-opt)
+def improve_or_opt(times: np.ndarray, route: List[int], max_segment: int = 3) -> bool:
+    """Переносит участки из 1-3 мест на другую позицию, пока это сокращает дорогу"""
+    improved = False
+    while True:
+        best_delta, best_move = -1e-6, None
+        for length in range(1, max_segment + 1):
+            for i in range(1, len(route) - length):
+                segment = route[i:i + length]
+                rest = route[:i] + route[i + length:]
+                removed = (times[route[i - 1], segment[0]] + times[segment[-1], route[i + length]]
+                           - times[route[i - 1], route[i + length]])
+
+                prev, nxt = np.array(rest[:-1]), np.array(rest[1:])
+                inserted = times[prev, segment[0]] + times[segment[-1], nxt] - times[prev, nxt]
+                delta = inserted - removed
+                delta[i - 1] = 0  # исходная позиция участка
+                position = int(np.argmin(delta))
+                if delta[position] < best_delta:
+                    best_delta, best_move = delta[position], (i, length, position)
+
+        if best_move is None:
+            return improved
+
+        i, length, position = best_move
+        segment = route[i:i + length]
+        del route[i:i + length]
+        route[position + 1:position + 1] = segment
+        improved = True
+
+# Функция для решения задачи ориентирования
+def solve_orienteering(times: np.ndarray, service: np.ndarray, scores: np.ndarray, budget: float
+                       ) -> Tuple[List[int], float]:
+    """Строит маршрут от узла 0 до последнего узла с наибольшей суммой scores за время budget.
+
+    times - матрица времени в пути между узлами, service - время осмотра
+    каждого узла. Жадные вставки чередуются с улучшениями 2-opt и or-opt:
+    сэкономленное на дороге время снова заполняется местами, пока маршрут
+    меняется. Возвращает узлы маршрута (с началом и концом) и его время.
+    """
+    end = len(times) - 1
+    route = [0, end]
+    visited = np.zeros(len(times), dtype=bool)
+    visited[[0, end]] = True
+    if route_time(times, service, route) > budget:
+        return route, route_time(times, service, route)
+
+    while True:
+        insert_greedy(times, service, scores, budget, route, visited)
+        improved = improve_two_opt(times, route)
+        improved = improve_or_opt(times, route) or improved
+        # Если дорога не сократилась, новых вставок не будет
+        if not improved:
+            break
+
+    return route, route_time(times, service, route)
+
+# Построение маршрутов по собранным местам
+class RoutePlanner:
+    """Строит маршруты по местам хранилища с ограничением по времени.
+
+    Ценность места - beauty_score (если столбца нет - каждое место ценно
+    одинаково, и маршрут собирает как можно больше мест). Время в пути
+    считается по матрице расстояний при скорости speed км/ч, время осмотра -
+    estimated_time. Кандидаты отбираются через пространственный индекс.
+    matrix - расстояния между всеми местами хранилища (пешеходные по графу
+    улиц или по прямой); если матрицы нет, расстояния между кандидатами
+    считаются для каждого маршрута: по графу улиц graph, если он задан,
+    иначе по прямой. От начальной и конечной точек расстояния считаются
+    по прямой. labels - номера районов (place_clusters.py), по ним маршрут
+    можно ограничить одним районом.
+    """
+
+    def __init__(self, places: PlaceStore, index: SpatialIndex, matrix: Optional[np.ndarray] = None,
+                 speed: float = WALKING_SPEED, max_candidates: int = MAX_CANDIDATES,
+                 labels: Optional[np.ndarray] = None, graph: Optional[StreetGraph] = None):
+        self.places = places
+        self.graph = graph
+        self.labels = labels
+        self.index = index
+        self.matrix = matrix
+        self.meters_per_minute = speed * 1000 / 60
+        self.max_candidates = max_candidates
+        self.scores = (np.asarray(places["beauty_score"], dtype=np.float64) if "beauty_score" in places
+                       else np.ones(len(places)))
+        self.service = np.asarray(places["estimated_time"], dtype=np.float64)
+
+    def candidates(self, start: Tuple[float, float], end: Tuple[float, float], budget: float,
+                   include_types: Optional[Iterable[str]] = None, cluster: Optional[int] = None) -> np.ndarray:
+        """Возвращает места, которые можно посетить по пути от start к end за budget минут"""
+        reach = budget * self.meters_per_minute
+        nearby = self.index.query_radius(start[0], start[1], reach, include_types)[0]
+        if cluster is not None:
+            nearby = nearby[self.labels[nearby] == cluster]
+        latitudes, longitudes = self.places["latitude"][nearby], self.places["longitude"][nearby]
+        detour = (haversine_distance(start[0], start[1], latitudes, longitudes)
+                  + haversine_distance(latitudes, longitudes, end[0], end[1]))
+        feasible = detour / self.meters_per_minute + self.service[nearby] <= budget
+        nearby, detour = nearby[feasible], detour[feasible]
+
+        if len(nearby) > self.max_candidates:
+            # Оставляем самые ценные места, при равной ценности - с меньшим крюком
+            keep = np.lexsort((detour, -self.scores[nearby]))[:self.max_candidates]
+            nearby = nearby[keep]
+        return np.sort(nearby)
+
+    def plan(self, start: Tuple[float, float], end: Tuple[float, float], travel_time: float,
+             include_types: Optional[Iterable[str]] = None, cluster: Optional[int] = None) -> Dict[str, Any]:
+        """Строит маршрут; travel_time - время пути в часах, как в api/routes/generate.
+
+        Если задан cluster, в маршрут попадают только места этого района.
+        """
+        budget = travel_time * 60
+        places = self.candidates(start, end, budget, include_types, cluster)
+
+        # Узлы: начало, кандидаты, конец
+        latitudes = np.concatenate([[start[0]], self.places["latitude"][places], [end[0]]])
+        longitudes = np.concatenate([[start[1]], self.places["longitude"][places], [end[1]]])
+        if self.matrix is not None:
+            distances = np.empty((len(places) + 2, len(places) + 2), dtype=np.float32)
+            distances[1:-1, 1:-1] = self.matrix[np.ix_(places, places)]
+            for row in (0, -1):
+                distances[row] = haversine_distance(latitudes[row], longitudes[row], latitudes, longitudes)
+                distances[:, row] = distances[row]
+        else:
+            distances = distance_matrix(latitudes, longitudes)
+            if self.graph is not None:
+                distances[1:-1, 1:-1] = walking_matrix(self.graph, latitudes[1:-1], longitudes[1:-1])
+
+        times = distances.astype(np.float64) / self.meters_per_minute
+        service = np.concatenate([[0.0], self.service[places], [0.0]])
+        scores = np.concatenate([[0.0], self.scores[places], [0.0]])
+        route, total = solve_orienteering(times, service, scores, budget)
+
+        selected = places[np.array(route[1:-1], dtype=np.int64) - 1]
+        return {
+            "places": selected.tolist(),
+            "total_time": total,
+            "travel_time": total - float(self.service[selected].sum()),
+            "score": float(self.scores[selected].sum()),
+            "candidates": len(places)
+        }
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры маршрута"""
+    parser = argparse.ArgumentParser(description="Построение пешеходного маршрута по собранным местам")
+    parser.add_argument("input", nargs="?", default=INPUT_FILE, help="файл с местами в формате JSON или JSON Lines")
+    parser.add_argument("--start", type=float, nargs=2, required=True, metavar=("LAT", "LON"),
+                        help="начальная точка")
+    parser.add_argument("--end", type=float, nargs=2, metavar=("LAT", "LON"),
+                        help="конечная точка (по умолчанию совпадает с начальной)")
+    parser.add_argument("--hours", type=float, default=3, help="время пути в часах")
+    parser.add_argument("--types", nargs="+", help="типы мест для включения в маршрут")
+    parser.add_argument("--cluster", type=int,
+                        help="строить маршрут только по местам района (номер из place_clusters.py)")
+    parser.add_argument("--speed", type=float, default=WALKING_SPEED, help="скорость пешехода, км/ч")
+    parser.add_argument("--graph", help="граф улиц для пешеходных расстояний, если их матрица не посчитана "
+                                        "(по умолчанию street_graph.npz рядом с файлом мест)")
+    parser.add_argument("--output", help="сохранить маршрут в JSON-файл")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    start = tuple(args.start)
+    end = tuple(args.end) if args.end else start
+
+    places, index = open_spatial_index(args.input)
+    # Пешеходные расстояния по графу улиц, если они посчитаны; для больших наборов
+    # без матрицы - по графу между кандидатами маршрута, без графа - по прямой
+    matrix = open_walking_matrix(places, walking_matrix_path(args.input))
+    graph = None
+    if matrix is None:
+        graph_file = args.graph or os.path.join(os.path.dirname(args.input), GRAPH_FILE)
+        if os.path.exists(graph_file):
+            graph = StreetGraph.load(graph_file)
+        else:
+            matrix = open_distance_matrix(places)
+    labels = open_cluster_labels(places)
+    if args.cluster is not None and labels is None:
+        print("Районы не посчитаны: сначала запустите place_clusters.py или analyze_moscow_places.py")
+        return
+    planner = RoutePlanner(places, index, matrix, speed=args.speed, labels=labels, graph=graph)
+
+    started = time.monotonic()
+    route = planner.plan(start, end, args.hours, args.types, args.cluster)
+    elapsed = (time.monotonic() - started) * 1000
+
+    records = [places.record(place) for place in route["places"]]
+    print(f"Маршрут построен за {elapsed:.1f} мс (кандидатов: {route['candidates']})")
+    for i, place in enumerate(records, 1):
+        print(f"{i}. {place['name']} ({place['type']}, {place['estimated_time']} мин.)")
+    print(f"Общее время: {route['total_time']:.0f} мин., из них в пути: {route['travel_time']:.0f} мин.")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"places": records, "total_time": round(route["total_time"])}, f, ensure_ascii=False, indent=2)
+        print(f"Маршрут сохранен в файл {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import time
+from typing import List, Optional, Iterable, Tuple
+
+import numpy as np
+
+from place_store import PlaceStore, open_place_store
+
+# Константы
+EARTH_RADIUS = 6371000.0  # в метрах
+CELL_SIZE = 250.0  # размер ячейки сетки в метрах
+MAX_CELLS = 4_000_000  # при большем количестве ячеек их размер увеличивается
+INDEX_FILE = "spatial_index.npz"
+INDEX_VERSION = 1
+
+# Функция для расчета расстояний между точками
+def haversine_distance(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Возвращает расстояние в метрах между точками (градусы, массивы поэлементно или с broadcasting)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+# Пространственный индекс мест
+class SpatialIndex:
+    """Сеточный индекс мест для поиска по радиусу, прямоугольнику и ближайших мест.
+
+    Координаты проецируются на плоскость (равнопромежуточная проекция
+    вокруг центра набора), плоскость делится на квадратные ячейки по
+    cell_size метров. Места отсортированы по номеру ячейки, а cell_starts
+    хранит начало каждой ячейки (как строки в формате CSR), поэтому ячейки
+    одной строки сетки образуют непрерывный срез и запрос читает по одному
+    срезу на строку. Сетка только отбирает кандидатов, расстояния до них
+    считаются по формуле гаверсинуса. Все запросы возвращают номера мест
+    в исходном наборе (в хранилище).
+    """
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, type_codes: Optional[np.ndarray] = None,
+                 type_names: Optional[List[str]] = None, cell_size: float = CELL_SIZE):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        count = len(latitudes)
+
+        self.type_names = list(type_names or [])
+        self.lat0 = float(latitudes.mean()) if count else 0.0
+        self.lon0 = float(longitudes.mean()) if count else 0.0
+        self.kx = EARTH_RADIUS * np.cos(np.radians(self.lat0)) * np.pi / 180
+        self.ky = EARTH_RADIUS * np.pi / 180
+
+        x, y = self._project(latitudes, longitudes)
+        self.x0 = float(x.min()) if count else 0.0
+        self.y0 = float(y.min()) if count else 0.0
+        width = float(x.max()) - self.x0 if count else 0.0
+        height = float(y.max()) - self.y0 if count else 0.0
+
+        # Для наборов на всю страну ячейки укрупняются, чтобы сетка оставалась компактной
+        self.requested_cell_size = float(cell_size)
+        self.cell_size = float(max(cell_size, np.sqrt(width * height / MAX_CELLS)))
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        cells = self._cell_y(y) * self.nx + self._cell_x(x)
+        self.order = np.argsort(cells, kind="stable").astype(np.int32)
+        self.cell_starts = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))])
+        self.latitudes = latitudes[self.order]
+        self.longitudes = longitudes[self.order]
+        codes = np.zeros(count, dtype=np.uint8) if type_codes is None else np.asarray(type_codes, dtype=np.uint8)
+        self.type_codes = codes[self.order]
+
+    @classmethod
+    def from_store(cls, places: PlaceStore, cell_size: float = CELL_SIZE) -> "SpatialIndex":
+        """Строит индекс по столбцам хранилища мест"""
+        return cls(places["latitude"], places["longitude"], places["type"], places.labels("type"), cell_size)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _project(self, latitudes, longitudes) -> Tuple[np.ndarray, np.ndarray]:
+        return (np.asarray(longitudes) - self.lon0) * self.kx, (np.asarray(latitudes) - self.lat0) * self.ky
+
+    def _cell_x(self, x) -> np.ndarray:
+        return np.clip(np.floor((x - self.x0) / self.cell_size), 0, self.nx - 1).astype(np.int64)
+
+    def _cell_y(self, y) -> np.ndarray:
+        return np.clip(np.floor((y - self.y0) / self.cell_size), 0, self.ny - 1).astype(np.int64)
+
+    def _type_mask(self, types: Optional[Iterable[str]]) -> Optional[np.ndarray]:
+        """Таблица допустимых кодов типов или None, если фильтра нет"""
+        if types is None:
+            return None
+        allowed = np.zeros(256, dtype=bool)
+        for type_name in types:
+            if type_name in self.type_names:
+                allowed[self.type_names.index(type_name)] = True
+        return allowed
+
+    def _candidates(self, south: float, west: float, north: float, east: float,
+                    allowed: Optional[np.ndarray]) -> np.ndarray:
+        """Позиции (в отсортированном порядке) мест из ячеек, пересекающих прямоугольник"""
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+
+        (x_min, x_max), (y_min, y_max) = self._project([south, north], [west, east])
+        if x_max < self.x0 or y_max < self.y0:
+            return np.empty(0, dtype=np.int64)
+        x_lo, x_hi = self._cell_x(np.array([x_min, x_max]))
+        y_lo, y_hi = self._cell_y(np.array([y_min, y_max]))
+
+        rows = np.arange(y_lo, y_hi + 1) * self.nx
+        starts = self.cell_starts[rows + x_lo]
+        ends = self.cell_starts[rows + x_hi + 1]
+        positions = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+
+        if allowed is not None:
+            positions = positions[allowed[self.type_codes[positions]]]
+        return positions
+
+    def _radius_positions(self, latitude: float, longitude: float, radius: float,
+                          allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Позиции мест в круге и расстояния до них"""
+        dlat = np.degrees(radius / EARTH_RADIUS)
+        # Долготный размах берем по самой удаленной от экватора широте круга
+        cos_lat = np.cos(np.radians(min(abs(latitude) + dlat, 89.9)))
+        dlon = np.degrees(radius / (EARTH_RADIUS * cos_lat))
+
+        positions = self._candidates(latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon, allowed)
+        distances = haversine_distance(latitude, longitude, self.latitudes[positions], self.longitudes[positions])
+        inside = distances <= radius
+        return positions[inside], distances[inside]
+
+    def query_radius(self, latitudes, longitudes, radius: float, types: Optional[Iterable[str]] = None,
+                     sort: bool = False) -> List[np.ndarray]:
+        """Для каждой точки возвращает номера мест не дальше radius метров.
+
+        При sort=True места упорядочены по расстоянию.
+        """
+        allowed = self._type_mask(types)
+        result = []
+        for latitude, longitude in zip(np.atleast_1d(latitudes), np.atleast_1d(longitudes)):
+            positions, distances = self._radius_positions(float(latitude), float(longitude), radius, allowed)
+            if sort:
+                positions = positions[np.argsort(distances, kind="stable")]
+            result.append(self.order[positions])
+        return result
+
+    def query_bbox(self, boxes, types: Optional[Iterable[str]] = None) -> List[np.ndarray]:
+        """Для каждого прямоугольника (south, west, north, east) возвращает номера мест внутри него"""
+        allowed = self._type_mask(types)
+        result = []
+        for south, west, north, east in np.atleast_2d(boxes):
+            positions = self._candidates(south, west, north, east, allowed)
+            lat, lon = self.latitudes[positions], self.longitudes[positions]
+            inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+            result.append(self.order[positions[inside]])
+        return result
+
+    def query_knn(self, latitudes, longitudes, k: int, types: Optional[Iterable[str]] = None
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает k ближайших мест для каждой точки: массивы номеров и расстояний (n, k).
+
+        Если подходящих мест меньше k, недостающие номера равны -1, а расстояния - inf.
+        Радиус поиска удваивается, пока в круге не окажется k мест: все места
+        внутри круга уже найдены, поэтому k ближайших среди них - точный ответ.
+        """
+        allowed = self._type_mask(types)
+        latitudes, longitudes = np.atleast_1d(latitudes), np.atleast_1d(longitudes)
+        indexes = np.full((len(latitudes), k), -1, dtype=np.int64)
+        result_distances = np.full((len(latitudes), k), np.inf)
+
+        # Начальный радиус - такой, чтобы при средней плотности в круг попало около k мест
+        area = max(self.nx * self.ny, 1) * self.cell_size ** 2
+        start_radius = max(self.cell_size, np.sqrt(k * area / max(len(self), 1) / np.pi))
+        max_radius = 2 * np.hypot(self.nx, self.ny) * self.cell_size
+
+        for row, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            radius = start_radius
+            while True:
+                positions, distances = self._radius_positions(float(latitude), float(longitude), radius, allowed)
+                if len(positions) >= k or radius >= max_radius:
+                    break
+                radius *= 2
+
+            nearest = np.argsort(distances, kind="stable")[:k]
+            indexes[row, :len(nearest)] = self.order[positions[nearest]]
+            result_distances[row, :len(nearest)] = distances[nearest]
+
+        return indexes, result_distances
+
+    def save(self, path: str) -> None:
+        """Сохраняет индекс в файл .npz"""
+        meta = {
+            "version": INDEX_VERSION,
+            "lat0": self.lat0, "lon0": self.lon0, "x0": self.x0, "y0": self.y0,
+            "cell_size": self.cell_size, "requested_cell_size": self.requested_cell_size, "nx": self.nx, "ny": self.ny,
+            "type_names": self.type_names
+        }
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, order=self.order, cell_starts=self.cell_starts, latitudes=self.latitudes,
+                 longitudes=self.longitudes, type_codes=self.type_codes, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SpatialIndex":
+        """Загружает индекс, сохраненный методом save()"""
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["version"] != INDEX_VERSION:
+                raise ValueError(f"Неподдерживаемая версия индекса {path}: {meta['version']}")
+
+            index = cls.__new__(cls)
+            for name in ("order", "cell_starts", "latitudes", "longitudes", "type_codes"):
+                setattr(index, name, data[name])
+
+        for name in ("lat0", "lon0", "x0", "y0", "cell_size", "requested_cell_size", "nx", "ny", "type_names"):
+            setattr(index, name, meta[name])
+        index.kx = EARTH_RADIUS * np.cos(np.radians(index.lat0)) * np.pi / 180
+        index.ky = EARTH_RADIUS * np.pi / 180
+        return index
+
+# Функция для получения индекса хранилища мест
+def spatial_index_for(places: PlaceStore, cell_size: float = CELL_SIZE) -> SpatialIndex:
+    """Загружает пространственный индекс хранилища или строит и сохраняет его.
+
+    Индекс хранится в директории хранилища, поэтому при пересоздании
+    хранилища он удаляется вместе с ним и строится заново при следующем
+    открытии.
+    """
+    path = os.path.join(places.path, INDEX_FILE)
+
+    if os.path.exists(path):
+        index = SpatialIndex.load(path)
+        if index.requested_cell_size == cell_size and len(index) == len(places):
+            return index
+
+    index = SpatialIndex.from_store(places, cell_size)
+    index.save(path)
+    return index
+
+# Функция для открытия индекса мест, соответствующего JSON-файлу
+def open_spatial_index(json_file: str, cell_size: float = CELL_SIZE) -> Tuple[PlaceStore, SpatialIndex]:
+    """Открывает хранилище мест рядом с JSON-файлом и его пространственный индекс"""
+    places = open_place_store(json_file)
+    return places, spatial_index_for(places, cell_size)
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры поиска"""
+    parser = argparse.ArgumentParser(description="Поиск мест рядом с точкой по пространственному индексу")
+    parser.add_argument("input", help="файл с местами в формате JSON или JSON Lines")
+    parser.add_argument("--lat", type=float, required=True, help="широта точки")
+    parser.add_argument("--lon", type=float, required=True, help="долгота точки")
+    parser.add_argument("--radius", type=float, help="радиус поиска в метрах")
+    parser.add_argument("--knn", type=int, default=10, help="количество ближайших мест (если радиус не задан)")
+    parser.add_argument("--types", nargs="+", help="искать только места этих типов")
+    parser.add_argument("--cell-size", type=float, default=CELL_SIZE, help="размер ячейки сетки в метрах")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+
+    started = time.monotonic()
+    places, index = open_spatial_index(args.input, args.cell_size)
+    print(f"Индекс на {len(index)} мест открыт за {(time.monotonic() - started) * 1000:.1f} мс")
+
+    started = time.monotonic()
+    if args.radius is not None:
+        found = index.query_radius(args.lat, args.lon, args.radius, args.types, sort=True)[0]
+    else:
+        found = index.query_knn(args.lat, args.lon, args.knn, args.types)[0][0]
+        found = found[found >= 0]
+    elapsed = (time.monotonic() - started) * 1000
+
+    distances = haversine_distance(args.lat, args.lon, places["latitude"][found], places["longitude"][found])
+    names = places["name"]
+    types = places.labels("type")
+    for place, distance in zip(found, distances):
+        print(f"  {names[place]} ({types[places['type'][place]]}) - {distance:.0f} м")
+    print(f"Найдено {len(found)} мест за {elapsed:.1f} мс")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import heapq
+import os
+import time
+from array import array
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+try:
+    import scipy.sparse
+    import scipy.sparse.csgraph
+except ImportError:
+    scipy = None
+
+from place_store import PlaceStore, open_place_store
+from spatial_index import SpatialIndex, haversine_distance
+
+# Константы
+DATA_DIR = "data"
+GRAPH_FILE = "street_graph.npz"
+WALKING_MATRIX_SUFFIX = ".walking.npy"  # матрица лежит рядом с файлом мест, а не в хранилище
+MAX_WALKING_PLACES = 5000  # для больших наборов расстояния считаются только между кандидатами маршрута
+MAX_SNAP_DISTANCE = 300.0  # в метрах; места дальше от улиц считаются недостижимыми
+MAX_WALK_DISTANCE = 15000.0  # в метрах; дальше поиск кратчайших путей не идет
+DIJKSTRA_MATRIX_CELLS = 2 ** 24  # размер блока расстояний при поиске через SciPy
+
+# Дороги и дорожки, по которым можно пройти пешком
+WALKABLE_HIGHWAYS = [
+    "footway", "pedestrian", "path", "steps", "living_street", "residential", "service", "unclassified",
+    "tertiary", "tertiary_link", "secondary", "secondary_link", "primary", "primary_link", "track", "cycleway",
+    "bridleway", "corridor"
+]
+
+# Запрос пешеходной сети в том же формате, что и категории мест сборщика
+STREET_CATEGORIES = [{"name": "walkway", "tags": [f"highway={value}" for value in WALKABLE_HIGHWAYS]}]
+STREET_QUERY_OPTIONS = {
+    "selector": "way",
+    "filters": '["foot"!~"^(no|private)$"]["access"!~"^(no|private)$"]',
+    "output": "geom"
+}
+
+# Граф пешеходной сети
+class StreetGraph:
+    """Неориентированный граф улиц в формате CSR.
+
+    Соседи узла u - indices[indptr[u]:indptr[u + 1]], длины ребер в метрах -
+    weights в тех же позициях. Узлы - точки линий OSM с координатами
+    latitudes, longitudes.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray,
+                 latitudes: np.ndarray, longitudes: np.ndarray, bounds: Optional[Tuple[float, ...]] = None):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.bounds = tuple(bounds) if bounds is not None else None
+        self.node_index: Optional[SpatialIndex] = None
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices) // 2
+
+    def save(self, path: str) -> None:
+        """Сохраняет граф в файл .npz"""
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, indptr=self.indptr, indices=self.indices, weights=self.weights,
+                 latitudes=self.latitudes, longitudes=self.longitudes,
+                 bounds=np.array(self.bounds if self.bounds is not None else [], dtype=np.float64))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "StreetGraph":
+        """Загружает граф, сохраненный методом save()"""
+        with np.load(path) as data:
+            bounds = data["bounds"]
+            return cls(data["indptr"], data["indices"], data["weights"], data["latitudes"], data["longitudes"],
+                       tuple(bounds.tolist()) if len(bounds) else None)
+
+    def snap(self, latitudes: np.ndarray, longitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает ближайший узел графа для каждой точки и расстояние до него"""
+        if self.node_index is None:
+            self.node_index = SpatialIndex(self.latitudes, self.longitudes)
+        nodes, distances = self.node_index.query_knn(latitudes, longitudes, 1)
+        return nodes[:, 0], distances[:, 0]
+
+    def shortest_distances(self, sources: np.ndarray, targets: np.ndarray,
+                           limit: float = MAX_WALK_DISTANCE) -> np.ndarray:
+        """Возвращает матрицу кратчайших расстояний (len(sources), len(targets)) в метрах.
+
+        Недостижимые и более далекие, чем limit, узлы получают inf. Если
+        установлен SciPy, поиск идет через scipy.sparse.csgraph.dijkstra
+        блоками источников, иначе - через dijkstra() на heapq.
+        """
+        result = np.full((len(sources), len(targets)), np.inf, dtype=np.float32)
+        if not len(self) or not len(sources):
+            return result
+
+        if scipy is not None:
+            graph = scipy.sparse.csr_matrix((self.weights, self.indices, self.indptr), shape=(len(self), len(self)))
+            block = max(1, DIJKSTRA_MATRIX_CELLS // len(self))
+            for start in range(0, len(sources), block):
+                distances = scipy.sparse.csgraph.dijkstra(graph, indices=sources[start:start + block], limit=limit)
+                result[start:start + block] = distances[:, targets]
+            return result
+
+        indptr, indices, weights = self.indptr.tolist(), self.indices.tolist(), self.weights.tolist()
+        target_list = targets.tolist()
+        target_set = set(target_list)
+        for row, source in enumerate(sources.tolist()):
+            distances = dijkstra(indptr, indices, weights, source, target_set, limit)
+            result[row] = [distances.get(target, np.inf) for target in target_list]
+        return result
+
+# Функция для поиска кратчайших путей от одного узла
+def dijkstra(indptr: List[int], indices: List[int], weights: List[float], source: int, targets: set,
+             limit: float = MAX_WALK_DISTANCE) -> Dict[int, float]:
+    """Алгоритм Дейкстры на двоичной куче по графу в формате CSR (списки Python).
+
+    Поиск останавливается, когда найдены расстояния до всех targets или
+    расстояние превысило limit. Возвращает расстояния до просмотренных узлов.
+    """
+    distances = {source: 0.0}
+    settled = {}
+    remaining = len(targets)
+    heap = [(0.0, source)]
+    heappop, heappush = heapq.heappop, heapq.heappush
+
+    while heap:
+        distance, node = heappop(heap)
+        if node in settled:
+            continue
+        settled[node] = distance
+        if node in targets:
+            remaining -= 1
+            if not remaining:
+                break
+
+        for k in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[k]
+            candidate = distance + weights[k]
+            if candidate <= limit and candidate < distances.get(neighbour, limit + 1):
+                distances[neighbour] = candidate
+                heappush(heap, (candidate, neighbour))
+
+    return settled
+
+# Построение графа из потока линий OSM
+class StreetGraphBuilder:
+    """Собирает граф улиц из элементов ответа Overpass (way с out geom).
+
+    Точки линий накапливаются в компактных массивах array, повторы линий
+    из пересекающихся тайлов пропускаются по id. Узлы графа получают
+    сплошную нумерацию только в build().
+    """
+
+    def __init__(self, bounds: Optional[Tuple[float, ...]] = None):
+        self.bounds = bounds
+        self.way_ids = set()
+        self.node_ids = array("q")
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.way_starts = array("b")
+
+    def add(self, element: Dict[str, Any]) -> None:
+        """Добавляет линию в граф"""
+        if element.get("type") != "way" or element["id"] in self.way_ids:
+            return
+        self.way_ids.add(element["id"])
+
+        first = 1
+        for node_id, point in zip(element.get("nodes", ()), element.get("geometry", ())):
+            if point is None:
+                # Точка вне области запроса: линия прерывается
+                first = 1
+                continue
+            self.node_ids.append(node_id)
+            self.latitudes.append(point["lat"])
+            self.longitudes.append(point["lon"])
+            self.way_starts.append(first)
+            first = 0
+
+    def build(self) -> StreetGraph:
+        """Нумерует узлы и строит CSR-представление графа"""
+        node_ids = np.frombuffer(self.node_ids, dtype=np.int64)
+        latitudes = np.frombuffer(self.latitudes, dtype=np.float64)
+        longitudes = np.frombuffer(self.longitudes, dtype=np.float64)
+        way_starts = np.frombuffer(self.way_starts, dtype=np.int8).astype(bool)
+
+        unique_ids, first_seen, nodes = np.unique(node_ids, return_index=True, return_inverse=True)
+
+        # Ребра - соседние точки одной линии
+        edges = ~way_starts[1:]
+        sources, targets = nodes[:-1][edges], nodes[1:][edges]
+        lengths = haversine_distance(latitudes[:-1][edges], longitudes[:-1][edges],
+                                     latitudes[1:][edges], longitudes[1:][edges])
+        keep = sources != targets
+        sources, targets, lengths = sources[keep], targets[keep], lengths[keep]
+
+        # Каждое ребро в обе стороны, сортировка по начальному узлу дает CSR
+        sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+        lengths = np.concatenate([lengths, lengths])
+        order = np.argsort(sources, kind="stable")
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(unique_ids)))])
+
+        return StreetGraph(indptr.astype(np.int64), targets[order].astype(np.int32),
+                           lengths[order].astype(np.float32), latitudes[first_seen], longitudes[first_seen],
+                           self.bounds)
+
+# Функция для расчета пешеходных расстояний между местами
+def walking_matrix(graph: StreetGraph, latitudes: np.ndarray, longitudes: np.ndarray,
+                   limit: float = MAX_WALK_DISTANCE) -> np.ndarray:
+    """Возвращает матрицу пешеходных расстояний между точками в метрах (float32).
+
+    Каждая точка привязывается к ближайшему узлу графа; расстояние - путь
+    по графу плюс расстояния привязки на обоих концах. Поиск идет от каждого
+    различного узла мест одновременно до всех остальных. Точки дальше
+    MAX_SNAP_DISTANCE от улиц и пары, между которыми нет пути короче limit,
+    получают inf.
+    """
+    count = len(latitudes)
+    result = np.full((count, count), np.inf, dtype=np.float32)
+    np.fill_diagonal(result, 0)
+    if not len(graph) or not count:
+        return result
+
+    nodes, snap = graph.snap(latitudes, longitudes)
+    snapped = np.flatnonzero(snap <= MAX_SNAP_DISTANCE)
+    unique_nodes, place_nodes = np.unique(nodes[snapped], return_inverse=True)
+
+    distances = graph.shortest_distances(unique_nodes, unique_nodes, limit)
+    block = distances[np.ix_(place_nodes, place_nodes)] + snap[snapped][:, None] + snap[snapped][None, :]
+    block[block > limit] = np.inf
+    result[np.ix_(snapped, snapped)] = block
+    np.fill_diagonal(result, 0)
+    return result
+
+# Функция для получения пути к матрице пешеходных расстояний
+def walking_matrix_path(json_file: str) -> str:
+    """Возвращает путь к матрице пешеходных расстояний для файла data/moscow_places.json.
+
+    Матрица хранится вне директории хранилища: хранилище пересобирается
+    при каждом изменении файла мест, а матрица может считаться долго.
+    """
+    return os.path.splitext(json_file)[0] + WALKING_MATRIX_SUFFIX
+
+# Функция для сохранения матрицы пешеходных расстояний
+def save_walking_matrix(places: PlaceStore, graph: StreetGraph, path: str,
+                        limit: float = MAX_WALK_DISTANCE) -> Optional[np.ndarray]:
+    """Считает матрицу пешеходных расстояний между местами и сохраняет ее в path.
+
+    Матрица занимает 4 * N * N байт, поэтому для наборов больше
+    MAX_WALKING_PLACES она не считается (возвращается None, старая матрица
+    удаляется): тогда пешеходные расстояния считаются только между
+    кандидатами конкретного маршрута.
+    """
+    if len(places) > MAX_WALKING_PLACES:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    matrix = walking_matrix(graph, places["latitude"], places["longitude"], limit)
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, matrix)
+    os.replace(tmp_path, path)
+    return matrix
+
+# Функция для открытия матрицы пешеходных расстояний
+def open_walking_matrix(places: PlaceStore, path: str) -> Optional[np.ndarray]:
+    """Открывает сохраненную матрицу пешеходных расстояний или возвращает None.
+
+    Матрица, посчитанная до последней пересборки хранилища, относится к
+    прежнему набору мест и не используется.
+    """
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(os.path.join(places.path, "meta.json")):
+        return None
+    matrix = np.load(path, mmap_mode="r")
+    return matrix if matrix.shape == (len(places), len(places)) else None
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры расчета"""
+    parser = argparse.ArgumentParser(description="Расчет пешеходных расстояний между местами по графу улиц")
+    parser.add_argument("input", help="файл с местами в формате JSON или JSON Lines")
+    parser.add_argument("--graph", default=os.path.join(DATA_DIR, GRAPH_FILE),
+                        help="граф улиц, сохраненный collect_moscow_places.py --street-graph")
+    parser.add_argument("--limit", type=float, default=MAX_WALK_DISTANCE,
+                        help="максимальное пешеходное расстояние в метрах")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    graph = StreetGraph.load(args.graph)
+    places = open_place_store(args.input)
+    print(f"Граф улиц: {len(graph)} узлов, {graph.edge_count} ребер")
+
+    started = time.monotonic()
+    matrix = save_walking_matrix(places, graph, walking_matrix_path(args.input), args.limit)
+    if matrix is None:
+        print(f"Мест больше {MAX_WALKING_PLACES}: матрица не сохраняется, пешеходные расстояния "
+              f"считаются между кандидатами маршрута")
+        return
+    reachable = np.isfinite(matrix).sum() - len(places)
+    print(f"Матрица пешеходных расстояний для {len(places)} мест посчитана за {time.monotonic() - started:.1f} с, "
+          f"достижимых пар: {reachable}")
+
+if __name__ == "__main__":
+    main()
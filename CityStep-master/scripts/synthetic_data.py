@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+from typing import Dict, Any, Iterator, Tuple
+
+import numpy as np
+
+# Константы
+DEFAULT_BOUNDS = (55.55, 37.35, 55.95, 37.85)  # south, west, north, east (Москва)
+DISTRICT_SHARE = 0.7  # доля мест, сгруппированных вокруг центров районов
+DISTRICT_SPREAD = 0.004  # в градусах: разброс мест вокруг центра района
+SEASONS = ["весна", "лето", "осень", "зима"]
+BEAUTIFUL_TYPES = ["attraction", "park", "exhibition", "cafe", "restaurant", "shop"]
+
+# Теги категорий сборщика (по одному-два на категорию)
+CATEGORY_TAGS = [
+    "tourism=attraction", "historic=monument", "tourism=museum", "leisure=park", "amenity=cafe",
+    "amenity=restaurant", "shop=mall", "tourism=gallery", "amenity=theatre", "amenity=cinema", "tourism=viewpoint"
+]
+
+# Функция для генерации координат мест
+def synthetic_coordinates(rng: np.random.Generator, count: int,
+                          bounds: Tuple[float, float, float, float] = DEFAULT_BOUNDS) -> Tuple[np.ndarray, np.ndarray]:
+    """Возвращает координаты мест: DISTRICT_SHARE мест - вокруг центров районов, остальные - равномерно.
+
+    Районов тем больше, чем больше мест (примерно по 200 мест на район),
+    поэтому плотность мест похожа на реальный город при любом размере набора.
+    """
+    south, west, north, east = bounds
+    districts = max(1, count // 200)
+    centers = rng.uniform((south, west), (north, east), size=(districts, 2))
+
+    clustered = int(count * DISTRICT_SHARE)
+    points = np.empty((count, 2))
+    points[:clustered] = centers[rng.integers(0, districts, clustered)] + rng.normal(0, DISTRICT_SPREAD, (clustered, 2))
+    points[clustered:] = rng.uniform((south, west), (north, east), size=(count - clustered, 2))
+    points[:, 0] = np.clip(points[:, 0], south, north)
+    points[:, 1] = np.clip(points[:, 1], west, east)
+    order = rng.permutation(count)
+    return np.round(points[order, 0], 7), np.round(points[order, 1], 7)
+
+# Функция для генерации элементов ответа Overpass API
+def synthetic_elements(count: int, seed: int = 0,
+                       bounds: Tuple[float, float, float, float] = DEFAULT_BOUNDS) -> Iterator[Dict[str, Any]]:
+    """Генерирует элементы ответа Overpass API (out center): узлы и линии с центром.
+
+    У каждого элемента есть имя и тег одной из категорий сборщика, у части -
+    описание, изображение, ссылки на Wikipedia и Wikidata, теги heritage,
+    historic и start_date. Элементы генерируются по одному, поэтому набор
+    любого размера не держится в памяти целиком.
+    """
+    rng = np.random.default_rng(seed)
+    latitudes, longitudes = synthetic_coordinates(rng, count, bounds)
+    categories = rng.integers(0, len(CATEGORY_TAGS), count)
+    is_way = rng.random(count) < 0.3
+    extras = rng.random((count, 6)) < [0.2, 0.1, 0.1, 0.15, 0.05, 0.1]
+    years = rng.integers(1500, 2020, count)
+
+    for i in range(count):
+        key, value = CATEGORY_TAGS[categories[i]].split("=")
+        tags = {"name": f"Место {i}", key: value}
+        description, image, wikipedia, wikidata, heritage, historic = extras[i]
+        if description:
+            tags["description"] = f"Описание места {i}"
+        if image:
+            tags["image"] = f"https://example.com/images/{i}.jpg"
+        if wikipedia:
+            tags["wikipedia"] = f"ru:Место {i}"
+        if wikidata:
+            tags["wikidata"] = f"Q{1000 + i}"
+        if heritage:
+            tags["heritage"] = "2"
+        if historic:
+            tags.setdefault("historic", "building")
+            tags["start_date"] = str(years[i])
+
+        element = {"type": "way" if is_way[i] else "node", "id": i + 1}
+        if is_way[i]:
+            element["center"] = {"lat": float(latitudes[i]), "lon": float(longitudes[i])}
+        else:
+            element["lat"], element["lon"] = float(latitudes[i]), float(longitudes[i])
+        element["tags"] = tags
+        yield element
+
+# Функция для записи ответа Overpass API в файл
+def write_overpass_response(path: str, count: int, seed: int = 0) -> None:
+    """Записывает синтетический ответ Overpass API в формате JSON, элемент за элементом"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"version": 0.6, "generator": "CityStep synthetic data", "elements": [\n')
+        for i, element in enumerate(synthetic_elements(count, seed)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(element, ensure_ascii=False))
+        f.write("\n]}\n")
+
+# Функция для генерации записей о местах
+def synthetic_places(count: int, seed: int = 0, beautiful: bool = False) -> Iterator[Dict[str, Any]]:
+    """Генерирует записи о местах в формате результатов сборщика.
+
+    С beautiful=True записи дополнительно содержат поля moscow_beautiful_places.json:
+    оценки красоты, популярности, исторической и архитектурной ценности
+    и лучшие сезоны.
+    """
+    rng = np.random.default_rng(seed)
+    latitudes, longitudes = synthetic_coordinates(rng, count)
+    types = rng.integers(0, len(BEAUTIFUL_TYPES), count)
+    times = rng.choice([30, 60, 90, 120, 150, 180], count)
+    beauty = np.round(np.clip(rng.normal(7.5, 1.2, count), 0, 10), 1)
+    factors = np.round(np.clip(beauty[:, None] + rng.normal(0, 1.0, (count, 3)), 0, 10), 1)
+    seasons = rng.random((count, len(SEASONS))) < 0.5
+
+    for i in range(count):
+        record = {
+            "osm_id": f"node/{i + 1}",
+            "name": f"Место {i}",
+            "description": f"Описание места {i}",
+            "type": BEAUTIFUL_TYPES[types[i]],
+            "latitude": float(latitudes[i]),
+            "longitude": float(longitudes[i]),
+            "estimated_time": int(times[i]),
+            "image_url": ""
+        }
+        if beautiful:
+            record.update({
+                "id": str(i + 1),
+                "beauty_score": float(beauty[i]),
+                "popularity": float(factors[i, 0]),
+                "historical_value": float(factors[i, 1]),
+                "architectural_value": float(factors[i, 2]),
+                "best_time": [season for season, chosen in zip(SEASONS, seasons[i]) if chosen]
+            })
+        yield record
+
+# Функция для записи мест в JSON-файл
+def write_places(path: str, count: int, seed: int = 0, beautiful: bool = False) -> None:
+    """Записывает синтетические места в JSON-файл, запись за записью"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i, record in enumerate(synthetic_places(count, seed, beautiful)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(record, ensure_ascii=False))
+        f.write("\n]\n")
+
+# Функция для разбора аргументов командной строки
+def parse_args() -> argparse.Namespace:
+    """Разбирает параметры генерации"""
+    parser = argparse.ArgumentParser(description="Генерация синтетических наборов данных для тестов производительности")
+    parser.add_argument("kind", choices=["overpass", "places", "beautiful"],
+                        help="ответ Overpass API, места сборщика или красивые места с оценками")
+    parser.add_argument("--count", type=int, default=1000, help="количество элементов")
+    parser.add_argument("--seed", type=int, default=0, help="начальное значение генератора случайных чисел")
+    parser.add_argument("--output", required=True, help="JSON-файл результата")
+    return parser.parse_args()
+
+# Основная функция
+def main():
+    args = parse_args()
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    if args.kind == "overpass":
+        write_overpass_response(args.output, args.count, args.seed)
+    else:
+        write_places(args.output, args.count, args.seed, beautiful=args.kind == "beautiful")
+    print(f"Записано {args.count} элементов в файл {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# Скрипты - отдельные модули без пакета, поэтому тесты импортируют их из директории scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
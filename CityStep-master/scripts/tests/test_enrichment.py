@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+import requests
+
+import enrichment
+from enrichment import Enricher, EnrichmentCache, FixtureBackend, WikiBackend
+from resilience import CircuitBreaker, RetryPolicy
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "enrichment.json")
+
+
+def make_place(name, description="", **tags):
+    return {"name": name, "description": description, "image_url": "", "tags": dict(tags, name=name)}
+
+
+def enrich(places, cache_path, backend=None):
+    enricher = Enricher(backend or FixtureBackend(FIXTURES), EnrichmentCache(cache_path), workers=2)
+    return list(enricher(places)), enricher
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "enrichment.sqlite")
+
+
+@pytest.mark.parametrize("tags, key", [
+    ({"wikipedia": "ru:Большой театр"}, "ru:Большой театр"),
+    ({"wikipedia": "Red Square"}, "en:Red Square"),
+    ({"wikipedia": "ru:Московский Кремль#История"}, "ru:Московский Кремль"),
+    ({"wikipedia:de": "Roter Platz"}, "de:Roter Platz"),
+    ({"wikipedia:de": "Roter Platz", "wikipedia:ru": "Красная площадь"}, "ru:Красная площадь"),
+    ({"wikipedia": "Mount Rainier: the peak"}, "en:Mount Rainier: the peak"),
+    ({"wikidata": "Q9000001"}, None),
+])
+def test_wikipedia_key(tags, key):
+    assert enrichment.wikipedia_key(tags) == key
+
+
+@pytest.mark.parametrize("value, url", [
+    ("https://example.com/a.jpg", "https://example.com/a.jpg"),
+    ("File:Red Square.jpg", "https://commons.wikimedia.org/wiki/Special:FilePath/Red_Square.jpg"),
+    ("Category:Moscow", ""),
+    ("", ""),
+])
+def test_image_url_from_tag(value, url):
+    assert enrichment.image_url_from_tag(value) == url
+
+
+def test_article_fills_description_and_image(cache_path):
+    (place,), enricher = enrich([make_place("Большой театр", wikipedia="ru:Большой театр")], cache_path)
+
+    assert place["description"].startswith("Большой театр — один из крупнейших")
+    assert place["image_url"] == "https://upload.wikimedia.org/wikipedia/commons/a/a1/Bolshoi_Theatre.jpg"
+    assert (enricher.descriptions, enricher.images) == (1, 1)
+
+
+def test_existing_description_and_image_tags_win(cache_path):
+    places = [
+        make_place("Большой театр", "Описание из OSM", wikipedia="ru:Большой театр",
+                   image="https://example.com/own.jpg"),
+        make_place("Красная площадь", wikipedia="Red Square", wikimedia_commons="File:Own photo.jpg"),
+        make_place("Кремль", wikipedia="ru:Московский Кремль", **{"description:ru": "Описание на русском"}),
+    ]
+    (theatre, square, kremlin), enricher = enrich(places, cache_path)
+
+    assert theatre["description"] == "Описание из OSM"
+    assert theatre["image_url"] == "https://example.com/own.jpg"
+    assert square["description"].startswith("Red Square is")
+    assert square["image_url"] == "https://commons.wikimedia.org/wiki/Special:FilePath/Own_photo.jpg"
+    # description:ru в тегах: описание не подменяется статьей
+    assert kremlin["description"] == ""
+    assert (enricher.descriptions, enricher.images) == (1, 0)
+
+
+def test_wikidata_links_article(cache_path):
+    (place,), _ = enrich([make_place("Театр", wikidata="Q9000001")], cache_path)
+
+    # Статья из sitelink Wikidata важнее описания сущности
+    assert place["description"].startswith("Большой театр — один из крупнейших")
+    assert place["image_url"] == "https://upload.wikimedia.org/wikipedia/commons/a/a1/Bolshoi_Theatre.jpg"
+
+
+def test_wikidata_fallback_without_article(cache_path):
+    places = [make_place("Парк", wikidata="Q9000002"), make_place("Памятник", wikidata="Q9000003"),
+              make_place("Кремль", wikipedia="ru:Московский Кремль", wikidata="Q9000002")]
+    (park, monument, kremlin), _ = enrich(places, cache_path)
+
+    # Статьи "Парк Горького" нет: описание и изображение берутся у сущности
+    assert park["description"] == "парк культуры и отдыха в Москве"
+    assert park["image_url"] == "https://commons.wikimedia.org/wiki/Special:FilePath/Park.jpg"
+    assert monument["description"] == "памятник в Москве"
+    assert monument["image_url"] == ""
+    # Описание статьи важнее описания сущности, а изображение сущности заменяет пустое изображение статьи
+    assert kremlin["description"].startswith("Московский Кремль — крепость")
+    assert kremlin["image_url"] == "https://commons.wikimedia.org/wiki/Special:FilePath/Park.jpg"
+
+
+def test_unknown_identifiers(cache_path):
+    (place,), enricher = enrich([make_place("Нечто", wikipedia="ru:Нет такой статьи", wikidata="Q1")], cache_path)
+
+    assert place["description"] == ""
+    assert place["image_url"] == ""
+    assert enricher.fetched == 2
+
+
+def test_cache_hit_and_miss(cache_path):
+    places = [make_place("Большой театр", wikipedia="ru:Большой театр"),
+              make_place("Нечто", wikipedia="ru:Нет такой статьи"),
+              make_place("Парк", wikidata="Q9000002")]
+
+    first_backend = FixtureBackend(FIXTURES)
+    first, enricher = enrich([dict(place, tags=dict(place["tags"])) for place in places], cache_path, first_backend)
+    assert first_backend.requests
+    assert enricher.fetched == 4  # 1 сущность и 3 статьи, включая ненайденные
+    assert enricher.cached == 0
+    assert len(EnrichmentCache(cache_path)) == 4
+
+    # Повторный запуск: все, включая ненайденное, берется из кэша без запросов
+    second_backend = FixtureBackend(FIXTURES)
+    second, enricher = enrich(places, cache_path, second_backend)
+    assert second_backend.requests == []
+    assert (enricher.fetched, enricher.cached) == (0, 4)
+    assert [place["description"] for place in second] == [place["description"] for place in first]
+    assert [place["image_url"] for place in second] == [place["image_url"] for place in first]
+
+    # Новый идентификатор запрашивается, остальные - из кэша
+    third_backend = FixtureBackend(FIXTURES)
+    _, enricher = enrich([make_place("Площадь", wikipedia="Red Square")] + places, cache_path, third_backend)
+    assert third_backend.requests == [("wikipedia/en", ["Red Square"])]
+    assert (enricher.fetched, enricher.cached) == (1, 4)
+
+
+class FailingBackend(FixtureBackend):
+    def wikipedia(self, lang, titles):
+        super().wikipedia(lang, titles)
+        raise requests.ConnectionError("network is down")
+
+
+def test_errors_are_not_cached(cache_path):
+    places = [make_place("Большой театр", wikipedia="ru:Большой театр")]
+
+    (place,), enricher = enrich([dict(places[0], tags=dict(places[0]["tags"]))], cache_path,
+                                FailingBackend(FIXTURES))
+    assert place["description"] == ""
+    assert enricher.failed == 1
+    assert len(EnrichmentCache(cache_path)) == 0
+
+    backend = FixtureBackend(FIXTURES)
+    (place,), enricher = enrich(places, cache_path, backend)
+    assert backend.requests == [("wikipedia/ru", ["Большой театр"])]
+    assert place["description"].startswith("Большой театр")
+
+
+def test_batches(cache_path):
+    backend = FixtureBackend(FIXTURES)
+    places = [make_place(f"Место {i}", wikipedia=f"ru:Статья {i}") for i in range(45)]
+    enrich(places, cache_path, backend)
+
+    sizes = sorted(len(titles) for kind, titles in backend.requests)
+    assert sizes == [5, enrichment.WIKIPEDIA_BATCH_SIZE, enrichment.WIKIPEDIA_BATCH_SIZE]
+
+
+def test_fixtures_do_not_touch_persistent_cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    enricher = enrichment.create_enricher(str(cache_dir), FIXTURES, workers=2)
+    (place,) = enricher([make_place("Нечто", wikipedia="ru:Нет такой статьи")])
+
+    assert place["description"] == ""
+    assert enricher.fetched == 1
+    assert not (cache_dir / enrichment.ENRICHMENT_CACHE_FILE).exists()
+
+
+class CountingLimiter:
+    """Ограничитель частоты, который только считает запросы"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.paused = []
+
+    def acquire(self):
+        self.acquired += 1
+
+    def pause(self, seconds):
+        self.paused.append(seconds)
+
+
+def make_response(status, data=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(data or {}).encode("utf-8")
+    return response
+
+
+def wiki_backend(monkeypatch, responses, **kwargs):
+    limiter = CountingLimiter()
+    backend = WikiBackend(rate_limiter=limiter, retry_policy=RetryPolicy(base_delay=0.0, **kwargs))
+    responses = iter(responses)
+    monkeypatch.setattr(backend.session, "get", lambda url, params, timeout: next(responses))
+    return backend, limiter
+
+
+def test_wiki_backend_retries_through_limiter(monkeypatch):
+    page = {"title": "Большой театр", "extract": "Театр оперы и балета.", "original": {"source": "https://img/1.jpg"}}
+    backend, limiter = wiki_backend(monkeypatch, [make_response(429), make_response(503),
+                                                  make_response(200, {"query": {"pages": [page]}})])
+
+    result = backend.wikipedia("ru", ["Большой театр"])
+
+    assert result == {"Большой театр": {"description": "Театр оперы и балета.", "image_url": "https://img/1.jpg"}}
+    assert limiter.acquired == 3
+    assert len(limiter.paused) == 1  # паузу всем потокам ставит только ответ 429
+
+
+def test_open_breaker_is_not_cached(monkeypatch, cache_path):
+    backend, limiter = wiki_backend(monkeypatch, [make_response(503)], max_retries=0)
+    backend.breakers["wikipedia"] = CircuitBreaker("Wikipedia", failure_threshold=1)
+    places = [make_place("Большой театр", wikipedia="ru:Большой театр")]
+
+    # Первый запрос размыкает выключатель, второй завершается CircuitOpen без обращения к сети
+    for expected_requests in (1, 1):
+        (place,), enricher = enrich([dict(places[0], tags=dict(places[0]["tags"]))], cache_path, backend)
+        assert place["description"] == ""
+        assert enricher.failed == 1
+        assert limiter.acquired == expected_requests
+    assert len(EnrichmentCache(cache_path)) == 0
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import threading
+import types
+
+import pytest
+
+import pg_loader
+from metrics import Metrics
+
+
+# Исключения psycopg2, которые различает загрузчик
+class OperationalError(Exception):
+    pass
+
+
+class InterfaceError(Exception):
+    pass
+
+
+class TransactionRollbackError(Exception):
+    pass
+
+
+class DataError(Exception):
+    pass
+
+
+# Поддельная база: сохраняет пачки, завершившиеся фиксацией транзакции
+class FakeDatabase:
+    def __init__(self):
+        self.committed = []
+        self.failures = []  # исключения, которые выбросят следующие execute
+        self.gate = None  # если задан, загрузка пачки ждет его
+        self.lock = threading.Lock()
+
+    def fail(self):
+        with self.lock:
+            error = self.failures.pop(0) if self.failures else None
+        if error is not None:
+            raise error
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        database = self.connection.database
+        if database.gate is not None:
+            database.gate.wait(5)
+        self.connection.statements.append(sql)
+        try:
+            database.fail()
+        except OperationalError:
+            self.connection.closed = 1
+            raise
+
+    def copy_expert(self, sql, buffer):
+        self.connection.statements.append(sql)
+        text = buffer.read()
+        self.connection.rows.extend(csv.reader(io.StringIO(text)))
+        self.connection.csv.append(text)
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.closed = 0
+        self.statements = []
+        self.rows = []
+        self.csv = []
+
+    def __enter__(self):
+        self.statements, self.rows, self.csv = [], [], []
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Как в psycopg2: без ошибки транзакция фиксируется, с ошибкой - откатывается
+        if exc_type is None:
+            with self.database.lock:
+                self.database.committed.append({"statements": self.statements, "rows": self.rows, "csv": self.csv})
+        return False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakePool:
+    def __init__(self, database):
+        self.database = database
+        self.returned = []
+        self.closed_all = False
+
+    def getconn(self):
+        return FakeConnection(self.database)
+
+    def putconn(self, conn, close=False):
+        self.returned.append(close)
+
+    def closeall(self):
+        self.closed_all = True
+
+
+def execute_values(cursor, sql, rows, page_size=None):
+    cursor.execute(sql)
+    cursor.connection.rows.extend(list(row) for row in rows)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    pools = []
+
+    def pool_factory(minconn, maxconn, dsn):
+        pool = FakePool(database)
+        pools.append(pool)
+        return pool
+
+    fake = types.SimpleNamespace(
+        OperationalError=OperationalError,
+        InterfaceError=InterfaceError,
+        extensions=types.SimpleNamespace(TransactionRollbackError=TransactionRollbackError),
+        extras=types.SimpleNamespace(execute_values=execute_values),
+        pool=types.SimpleNamespace(ThreadedConnectionPool=pool_factory),
+    )
+    monkeypatch.setattr(pg_loader, "psycopg2", fake)
+    monkeypatch.setattr(pg_loader, "RETRY_DELAY", 0.0)
+    monkeypatch.setattr(pg_loader, "metrics", Metrics("test"))
+    database.pools = pools
+    return database
+
+
+def make_record(i, **fields):
+    record = {"osm_id": f"node/{i}", "name": f"Место {i}", "description": "", "type": "cafe",
+              "latitude": 55.75 + i / 1000, "longitude": 37.61, "estimated_time": 30, "image_url": ""}
+    record.update(fields)
+    return record
+
+
+def test_requires_psycopg2(monkeypatch):
+    monkeypatch.setattr(pg_loader, "psycopg2", None)
+    with pytest.raises(RuntimeError):
+        pg_loader.PostgresLoader("postgresql://localhost/test")
+
+
+def test_unknown_method(database):
+    with pytest.raises(ValueError):
+        pg_loader.PostgresLoader("postgresql://localhost/test", method="insert")
+
+
+@pytest.mark.parametrize("method", pg_loader.LOAD_METHODS)
+def test_load_records_in_chunks(database, method):
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method=method, chunk_size=2)
+
+    count = pg_loader.load_records((make_record(i) for i in range(5)), loader)
+
+    assert count == 5
+    assert loader.rows == 5
+    assert sorted(len(chunk["rows"]) for chunk in database.committed) == [1, 2, 2]
+    loaded = sorted(row[0] for chunk in database.committed for row in chunk["rows"])
+    assert loaded == [f"node/{i}" for i in range(5)]
+    assert database.pools[0].closed_all
+    assert pg_loader.metrics.counters["postgres"]["rows"] == 5
+
+
+def test_upsert_statement(database):
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="copy")
+    pg_loader.load_records([make_record(1)], loader)
+
+    statements = database.committed[0]["statements"]
+    assert statements[0].startswith("CREATE TEMP TABLE load_places (LIKE places")
+    assert statements[1].startswith("COPY load_places (osm_id, name,")
+    assert "ON CONFLICT (osm_id) DO UPDATE SET name = EXCLUDED.name" in statements[2]
+    assert "osm_id = EXCLUDED.osm_id" not in statements[2]
+
+
+def test_delete_after_upserts(database):
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="values")
+    loader.delete(["node/7", "way/8"])
+
+    pg_loader.load_records([make_record(1)], loader)
+
+    # Удаление выполняется отдельной транзакцией после загрузки пачек
+    assert len(database.committed) == 2
+    assert database.committed[1]["statements"] == ["DELETE FROM places WHERE osm_id = ANY(%s)"]
+    assert loader.rows == 1
+
+
+def test_discard_skips_delete(database):
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="values")
+    loader.delete(["node/7"])
+
+    with pytest.raises(KeyError):
+        pg_loader.load_records([{}], loader)
+
+    assert database.committed == []
+
+
+def test_copy_csv_quoting(database):
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="copy")
+    record = make_record(1, name='Кафе "Ромашка", центр', description="строка 1\nстрока 2", image_url=None)
+    pg_loader.load_records([record], loader)
+
+    # Строки в кавычках (пустая строка не превращается в NULL), числа и None - без кавычек
+    text = database.committed[0]["csv"][0]
+    assert text == '"node/1","Кафе ""Ромашка"", центр","строка 1\nстрока 2","cafe",55.751,37.61,30,\n'
+    assert database.committed[0]["rows"] == [["node/1", 'Кафе "Ромашка", центр', "строка 1\nстрока 2", "cafe",
+                                              "55.751", "37.61", "30", ""]]
+
+
+def test_csv_line():
+    assert pg_loader.csv_line(["", None, True, 1.5, 7]) == '"",,true,1.5,7\n'
+
+
+@pytest.mark.parametrize("error", [OperationalError, InterfaceError, TransactionRollbackError])
+def test_retry_on_transient_error(database, error):
+    database.failures = [error("connection lost")]
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="values", max_workers=1)
+
+    pg_loader.load_records([make_record(1), make_record(2)], loader)
+
+    assert loader.rows == 2
+    assert loader.retries == 1
+    assert len(database.committed) == 1
+    assert pg_loader.metrics.counters["postgres"]["retries"] == 1
+    # Оборванное соединение возвращается в пул с закрытием
+    assert database.pools[0].returned == [error is OperationalError, False]
+
+
+def test_retries_exhausted(database):
+    database.failures = [OperationalError("down")] * 3
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="values", max_retries=2)
+
+    with pytest.raises(OperationalError):
+        pg_loader.load_records([make_record(1)], loader)
+
+    assert loader.retries == 2
+    assert database.committed == []
+    assert database.pools[0].closed_all
+
+
+def test_permanent_error_is_not_retried(database):
+    database.failures = [DataError("invalid input")]
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="values")
+
+    with pytest.raises(DataError):
+        pg_loader.load_records([make_record(1)], loader)
+
+    assert loader.retries == 0
+    assert database.committed == []
+
+
+def test_discard_on_source_error(database):
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="values", chunk_size=2)
+
+    def records():
+        for i in range(3):
+            yield make_record(i)
+        raise KeyError("broken record")
+
+    with pytest.raises(KeyError):
+        pg_loader.load_records(records(), loader)
+
+    # Полная пачка успела загрузиться, неполная отброшена
+    assert [len(chunk["rows"]) for chunk in database.committed] == [2]
+    assert loader.chunk == []
+    assert database.pools[0].closed_all
+
+
+def test_backpressure(database):
+    database.gate = threading.Event()
+    loader = pg_loader.PostgresLoader("postgresql://localhost/test", method="values", chunk_size=1,
+                                      max_workers=1)
+    written = []
+
+    def write_all():
+        for i in range(4):
+            loader.write(make_record(i))
+            written.append(i)
+
+    writer = threading.Thread(target=write_all)
+    writer.start()
+    writer.join(0.5)
+
+    # Один поток загрузки: в памяти не больше двух пачек, третья ждет
+    assert writer.is_alive()
+    assert written == [0, 1]
+
+    database.gate.set()
+    writer.join(5)
+    assert not writer.is_alive()
+    loader.close()
+    assert loader.rows == 4
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import requests
+
+from resilience import CircuitBreaker, CircuitOpen, RetryPolicy
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"HTTP {status}", response=response)
+
+
+def failing(error):
+    def call():
+        raise error
+    return call
+
+
+@pytest.fixture
+def policy():
+    return RetryPolicy(max_retries=2, base_delay=0.0, seed=1)
+
+
+def test_retries_transient_errors(policy):
+    attempts = []
+    record = {"retries": 0}
+
+    def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise http_error(503)
+        return "ok"
+
+    assert policy.call(call, record) == "ok"
+    assert record["retries"] == 2
+
+
+def test_permanent_http_error_closes_breaker(policy):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.failure()
+
+    with pytest.raises(requests.HTTPError):
+        policy.call(failing(http_error(400)), breaker=breaker)
+
+    # Сервис ответил, поэтому счетчик неудач подряд сброшен
+    assert breaker.failures == 0
+
+
+@pytest.mark.parametrize("error", [ValueError("bad JSON"), KeyError("sink")])
+def test_local_error_does_not_reset_breaker(policy, error):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.failure()
+
+    with pytest.raises(type(error)):
+        policy.call(failing(error), breaker=breaker)
+
+    assert breaker.failures == 1
+    assert breaker.state == "closed"
+
+
+def test_local_errors_do_not_hide_outage(policy):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+
+    with pytest.raises(requests.ConnectionError):
+        policy.call(failing(requests.ConnectionError("down")), breaker=breaker)
+    assert breaker.is_open()
+
+    with pytest.raises(CircuitOpen):
+        policy.call(failing(ValueError("bad JSON")), breaker=breaker)
+
+
+def test_local_error_releases_trial(policy):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.failure()
+
+    # Пробный запрос после паузы завершился локальной ошибкой: следующий запрос снова пробный
+    with pytest.raises(ValueError):
+        policy.call(failing(ValueError("bad JSON")), breaker=breaker)
+    assert breaker.state == "half_open"
+    assert not breaker.trial
+
+    assert policy.call(lambda: "ok", breaker=breaker) == "ok"
+    assert breaker.state == "closed"
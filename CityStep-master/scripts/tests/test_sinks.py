@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from collect_moscow_places import RecordSink, JsonArraySink, JsonLinesSink, write_records
+
+
+class FailingSink:
+    """Загрузчик, который не может завершить запись"""
+
+    def __init__(self):
+        self.discarded = False
+
+    def write(self, record):
+        pass
+
+    def close(self):
+        raise RuntimeError("flush failed")
+
+    def discard(self):
+        self.discarded = True
+
+
+def test_record_sink_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        RecordSink(str(tmp_path / "places.json"))
+
+
+def test_write_records(tmp_path):
+    json_file = tmp_path / "places.json"
+    jsonl_file = tmp_path / "places.jsonl"
+    records = [{"osm_id": "node/1", "name": "Парк"}, {"osm_id": "node/2", "name": "Кафе"}]
+
+    assert write_records(iter(records), [JsonArraySink(str(json_file)), JsonLinesSink(str(jsonl_file))]) == 2
+
+    assert json.loads(json_file.read_text(encoding="utf-8")) == records
+    assert [json.loads(line) for line in jsonl_file.read_text(encoding="utf-8").splitlines()] == records
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["places.json", "places.jsonl"]
+
+
+def test_close_error_discards_remaining_sinks(tmp_path):
+    json_file = tmp_path / "places.json"
+    json_file.write_text("[]", encoding="utf-8")
+    loader = FailingSink()
+    last = FailingSink()
+
+    with pytest.raises(RuntimeError):
+        write_records(iter([{"osm_id": "node/1"}]), [loader, JsonArraySink(str(json_file)), last])
+
+    # Прошлый результат не заменен, временный файл удален
+    assert json_file.read_text(encoding="utf-8") == "[]"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["places.json"]
+    assert last.discarded
+    assert not loader.discarded
+
+
+def test_source_error_discards_all_sinks(tmp_path):
+    sink = FailingSink()
+
+    def records():
+        yield {"osm_id": "node/1"}
+        raise KeyError("broken")
+
+    with pytest.raises(KeyError):
+        write_records(records(), [JsonArraySink(str(tmp_path / "places.json")), sink])
+
+    assert sink.discarded
+    assert list(tmp_path.iterdir()) == []
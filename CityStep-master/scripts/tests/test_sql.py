@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from collect_moscow_places import OSM_ID_MIGRATION, SqlSink, csv_line, sql_literal, sql_values
+
+
+RECORD = {
+    "osm_id": 42,
+    "name": "Дом Пашкова",
+    "description": None,
+    "type": "attraction",
+    "latitude": 55.7494,
+    "longitude": 37.6091,
+    "estimated_time": 30,
+    "image_url": None,
+}
+
+
+def test_sql_literal_types():
+    assert sql_literal(None) == "NULL"
+    assert sql_literal(True) == "TRUE"
+    assert sql_literal(False) == "FALSE"
+    assert sql_literal(7) == "7"
+    assert sql_literal(np.int64(7)) == "7"
+    assert sql_literal(0.1) == "0.1"
+    assert sql_literal(np.float32(0.5)) == "0.5"
+    assert sql_literal(float("nan")) == "'NaN'"
+    assert sql_literal(float("-inf")) == "'-Infinity'"
+    assert sql_literal("O'Hara") == "'O''Hara'"
+
+
+def test_csv_line_types():
+    assert csv_line([None, True, 3, np.float32(0.5), float("inf"), 'say "hi"']) == ',true,3,0.5,Infinity,"say ""hi"""\n'
+
+
+def test_sql_values_emits_null():
+    assert sql_values(RECORD) == "(42, 'Дом Пашкова', NULL, 'attraction', 55.7494, 37.6091, 30, NULL)"
+
+
+def test_sql_sink_formats(tmp_path):
+    for sql_format in ("insert", "multirow", "upsert"):
+        path = tmp_path / f"{sql_format}.sql"
+        sink = SqlSink(str(path), sql_format)
+        sink.write(RECORD)
+        sink.close()
+        text = path.read_text(encoding="utf-8")
+        assert "'Дом Пашкова', NULL, 'attraction'" in text
+        assert "None" not in text
+        assert OSM_ID_MIGRATION in text
+
+
+def test_sql_sink_copy_writes_null(tmp_path):
+    path = tmp_path / "copy.sql"
+    sink = SqlSink(str(path), "copy")
+    sink.write(RECORD)
+    sink.close()
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert '42,"Дом Пашкова",,"attraction",55.7494,37.6091,30,' in lines
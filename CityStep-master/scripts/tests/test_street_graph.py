@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+
+import street_graph
+from place_store import open_place_store
+from route_planner import RoutePlanner
+from spatial_index import spatial_index_for
+from street_graph import StreetGraphBuilder, open_walking_matrix, save_walking_matrix, walking_matrix_path
+
+
+def make_graph():
+    # Одна улица вдоль широты 55.75 с узлами через 0.001 градуса долготы
+    builder = StreetGraphBuilder()
+    builder.add({"type": "way", "id": 1, "nodes": list(range(20)),
+                 "geometry": [{"lat": 55.75, "lon": 37.60 + i / 1000} for i in range(20)]})
+    return builder.build()
+
+
+def write_places(path, count=4):
+    places = [{"osm_id": f"node/{i}", "name": f"Место {i}", "description": "", "type": "attraction",
+               "latitude": 55.7502, "longitude": 37.601 + 3 * i / 1000, "estimated_time": 10, "image_url": ""}
+              for i in range(count)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(places, f, ensure_ascii=False)
+    return str(path)
+
+
+def test_matrix_is_stored_next_to_places(tmp_path):
+    places_file = write_places(tmp_path / "places.json")
+    places = open_place_store(places_file)
+    path = walking_matrix_path(places_file)
+
+    matrix = save_walking_matrix(places, make_graph(), path)
+
+    assert path == str(tmp_path / "places.walking.npy")
+    assert not os.path.dirname(path).startswith(places.path)
+    assert matrix.shape == (4, 4)
+    assert np.isfinite(matrix).all()
+    np.testing.assert_array_equal(open_walking_matrix(places, path), matrix)
+
+
+def test_matrix_survives_store_rebuild_only_if_newer(tmp_path):
+    places_file = write_places(tmp_path / "places.json")
+    path = walking_matrix_path(places_file)
+    save_walking_matrix(open_place_store(places_file), make_graph(), path)
+
+    # Файл мест изменился: хранилище пересобирается, а старая матрица к нему уже не относится
+    write_places(places_file)
+    future = os.path.getmtime(path) + 10
+    os.utime(places_file, (future, future))
+    places = open_place_store(places_file)
+
+    assert os.path.exists(path)
+    assert open_walking_matrix(places, path) is None
+
+
+def test_large_sets_skip_the_matrix(tmp_path, monkeypatch):
+    places_file = write_places(tmp_path / "places.json")
+    places = open_place_store(places_file)
+    path = walking_matrix_path(places_file)
+    save_walking_matrix(places, make_graph(), path)
+
+    monkeypatch.setattr(street_graph, "MAX_WALKING_PLACES", 3)
+    assert save_walking_matrix(places, make_graph(), path) is None
+    assert not os.path.exists(path)
+
+
+def test_planner_computes_walking_distances_per_candidate(tmp_path):
+    places_file = write_places(tmp_path / "places.json")
+    places = open_place_store(places_file)
+    index = spatial_index_for(places)
+    graph = make_graph()
+    start = (55.75, 37.600)
+
+    with_matrix = RoutePlanner(places, index, save_walking_matrix(places, graph, walking_matrix_path(places_file)))
+    per_candidate = RoutePlanner(places, index, graph=graph)
+
+    expected = with_matrix.plan(start, start, 1)
+    route = per_candidate.plan(start, start, 1)
+    assert route["places"] == expected["places"]
+    assert route["total_time"] == expected["total_time"]